@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Materialized Demand Aggregates
+daily_sku_demand keeps one small row per (order_date, sku, pos_id), built once
+per day from orders_orc, so multi-day demand windows never rescan raw orders.
+Micro-batches append partial rows for their new files; readers always SUM
+"""
+
+from datetime import datetime, timedelta
+from columnar import ORDERS_TABLE, path_list
+
+DEMAND_TABLE = 'daily_sku_demand'
+
+
+def date_range(start, end):
+    """Yield every date string from start to end inclusive"""
+    day = datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.strptime(end, '%Y-%m-%d').date()
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def window_dates(end_date_str, days):
+    """Return (start, end) date strings for a window of `days` days ending on end_date_str"""
+    end = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    start = end - timedelta(days=max(1, days) - 1)
+    return start.isoformat(), end.isoformat()
+
+
+class DailyDemandAggregates:
+    """Incrementally maintained per-day, per-SKU, per-POS demand table"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def ensure_table(self):
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DEMAND_TABLE} (
+                sku VARCHAR,
+                pos_id VARCHAR,
+                total_quantity BIGINT,
+                order_count BIGINT,
+                order_date DATE
+            ) WITH (
+                format = 'ORC',
+                partitioned_by = ARRAY['order_date']
+            )
+        """)
+
+    def refresh_day(self, date_str):
+        """(Re)build the partition for one day (requires insert_existing_partitions_behavior=OVERWRITE)"""
+        self.cursor.execute(f"""
+            INSERT INTO {DEMAND_TABLE}
+            SELECT sku, pos_id, SUM(quantity), COUNT(*), order_date
+            FROM {ORDERS_TABLE}
+            WHERE order_date = DATE '{date_str}'
+            GROUP BY sku, pos_id, order_date
+        """)
+        result = self.cursor.fetchone()
+        return result[0] if result else 0
+
+    def append_files(self, date_str, paths):
+        """
+        Add partial rows for the orders of these raw files to the day's partition
+        (requires insert_existing_partitions_behavior=APPEND)
+        """
+        if not paths:
+            return 0
+        self.cursor.execute(f"""
+            INSERT INTO {DEMAND_TABLE}
+            SELECT sku, pos_id, SUM(quantity), COUNT(*), CAST(order_date AS DATE)
+            FROM orders_data
+            WHERE order_date = '{date_str}' AND "$path" IN ({path_list(paths)})
+            GROUP BY sku, pos_id, order_date
+        """)
+        result = self.cursor.fetchone()
+        return result[0] if result else 0
+
+    def _partition_dates(self, table, start, end):
+        self.cursor.execute(f"""
+            SELECT order_date FROM "{table}$partitions"
+            WHERE order_date BETWEEN DATE '{start}' AND DATE '{end}'
+        """)
+        return {str(row[0]) for row in self.cursor.fetchall()}
+
+    def backfill(self, start, end):
+        """Build aggregates for converted days in [start, end] that have none yet"""
+        missing = sorted(self._partition_dates(ORDERS_TABLE, start, end) -
+                         self._partition_dates(DEMAND_TABLE, start, end))
+        for date_str in missing:
+            self.refresh_day(date_str)
+        return missing
+
+    def demand_by_sku_pos(self, start, end):
+        """Total quantity and order count per (SKU, POS) over [start, end]"""
+        self.cursor.execute(f"""
+            SELECT
+                sku,
+                pos_id,
+                SUM(total_quantity) as total_quantity,
+                SUM(order_count) as order_count
+            FROM {DEMAND_TABLE}
+            WHERE order_date BETWEEN DATE '{start}' AND DATE '{end}'
+            GROUP BY sku, pos_id
+            ORDER BY total_quantity DESC
+        """)
+        return self.cursor.fetchall()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Stage Benchmarks
+Times every ProcurementPipeline stage and scheduler.upload_to_hdfs at several
+data scales against local stand-ins (a fake WebHDFS server, SQLite in place of
+Trino and of the PostgreSQL master data) and compares with a JSON baseline
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import contextlib
+import urllib.parse
+import http.server
+from datetime import datetime
+
+# Configuration
+BASELINE_PATH = os.getenv('BENCHMARK_BASELINE',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json'))
+REGRESSION_TOLERANCE = float(os.getenv('BENCHMARK_TOLERANCE', '0.25'))
+# Differences below this are timer noise, never regressions
+NOISE_FLOOR_SECONDS = 0.01
+BENCHMARK_DATE = '2025-01-04'
+
+SCALES = {
+    'small': {'skus': 25, 'pos': 5, 'warehouses': 3, 'orders_per_day': 750},
+    'medium': {'skus': 2000, 'pos': 50, 'warehouses': 10, 'orders_per_day': 100000},
+    'large': {'skus': 20000, 'pos': 200, 'warehouses': 20, 'orders_per_day': 1000000},
+}
+
+
+# ============================================
+# WEBHDFS STAND-IN
+# ============================================
+
+class FakeWebHDFSHandler(http.server.BaseHTTPRequestHandler):
+    """NameNode and DataNode in one: CREATE/APPEND are redirected once, only file lengths are kept"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            size = 0
+            while True:
+                chunk = int(self.rfile.readline().strip(), 16)
+                if chunk == 0:
+                    self.rfile.readline()
+                    return size
+                size += len(self.rfile.read(chunk))
+                self.rfile.readline()
+        return len(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+
+    def _parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.server.count(params.get('op'))
+        return url, params
+
+    def do_GET(self):
+        url, params = self._parse()
+        if params.get('op') == 'LISTSTATUS':
+            prefix = url.path.rstrip('/') + '/'
+            statuses = [{'pathSuffix': path[len(prefix):], 'length': length, 'type': 'FILE',
+                         'modificationTime': 0}
+                        for path, length in sorted(self.server.files.items())
+                        if path.startswith(prefix) and '/' not in path[len(prefix):]]
+            if not statuses:
+                self._reply(404, {'RemoteException': {'exception': 'FileNotFoundException'}})
+                return
+            self._reply(200, {'FileStatuses': {'FileStatus': statuses}})
+            return
+        if url.path not in self.server.files:
+            self._reply(404, {'RemoteException': {'exception': 'FileNotFoundException'}})
+            return
+        self._reply(200, {'FileStatus': {'length': self.server.files[url.path], 'type': 'FILE'}})
+
+    def do_PUT(self):
+        url, params = self._parse()
+        size = self._read_body()
+        op = params.get('op')
+        if op == 'MKDIRS':
+            self._reply(200, {'boolean': True})
+        elif op in ('CREATE', 'APPEND') and 'datanode' not in params:
+            location = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}{self.path}&datanode=true"
+            self._reply(307, headers={'Location': location})
+        elif op == 'CREATE':
+            self.server.files[url.path] = size
+            self._reply(201)
+        elif op == 'APPEND':
+            self.server.files[url.path] = self.server.files.get(url.path, 0) + size
+            self._reply(200)
+        else:
+            self._reply(400, {'RemoteException': {'message': f'Unsupported op {op}'}})
+
+    do_POST = do_PUT
+
+
+class FakeWebHDFS(http.server.ThreadingHTTPServer):
+    """In-process WebHDFS endpoint on a free local port"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeWebHDFSHandler)
+        self.files = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, op):
+        with self._lock:
+            self.requests[op] = self.requests.get(op, 0) + 1
+
+    def reset(self):
+        self.files.clear()
+        self.requests.clear()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# ============================================
+# TRINO AND POSTGRESQL STAND-INS
+# ============================================
+
+class SQLiteTrinoCursor:
+    """Trino DB-API cursor stand-in running the engine's queries on SQLite"""
+
+    DATE_LITERAL = re.compile(r"DATE '(\d{4}-\d{2}-\d{2})'")
+
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(self.DATE_LITERAL.sub(r"'\1'", sql), params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class FixtureConnection:
+    """psycopg2 connection stand-in over SQLite; any cursor_factory yields dict-like rows"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, cursor_factory=None):
+        cursor = self.conn.cursor()
+        if cursor_factory is not None:
+            cursor.row_factory = sqlite3.Row
+        return cursor
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        pass
+
+
+def build_master_db(skus, pos_ids, warehouses):
+    """SQLite fixture with the master tables load_master_data reads"""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.executescript("""
+        CREATE TABLE suppliers (supplier_id TEXT PRIMARY KEY, supplier_name TEXT,
+                                lead_time_days INTEGER, active BOOLEAN DEFAULT TRUE);
+        CREATE TABLE products (sku TEXT PRIMARY KEY, product_name TEXT, supplier_id TEXT,
+                               pack_size INTEGER, case_size INTEGER, active BOOLEAN DEFAULT TRUE);
+        CREATE TABLE replenishment_rules (sku TEXT, warehouse_id TEXT, safety_stock INTEGER,
+                                          minimum_order_quantity INTEGER, maximum_order_quantity INTEGER,
+                                          reorder_point INTEGER, active BOOLEAN DEFAULT TRUE);
+        CREATE TABLE points_of_sale (pos_id TEXT PRIMARY KEY, warehouse_id TEXT, active BOOLEAN DEFAULT TRUE);
+    """)
+    suppliers = [f'SUP{str(i).zfill(3)}' for i in range(1, 9)]
+    conn.executemany("INSERT INTO suppliers (supplier_id, supplier_name, lead_time_days) VALUES (?, ?, ?)",
+                     [(s, f'Supplier {s}', 1 + i % 3) for i, s in enumerate(suppliers)])
+    conn.executemany("INSERT INTO products (sku, product_name, supplier_id, pack_size, case_size) "
+                     "VALUES (?, ?, ?, 1, ?)",
+                     [(sku, f'Product {sku}', suppliers[i % len(suppliers)], (6, 10, 12, 24)[i % 4])
+                      for i, sku in enumerate(skus)])
+    conn.executemany("INSERT INTO replenishment_rules (sku, warehouse_id, safety_stock, minimum_order_quantity, "
+                     "maximum_order_quantity, reorder_point) VALUES (?, ?, 100, 12, NULL, NULL)",
+                     [(sku, wh) for sku in skus for wh in warehouses])
+    conn.executemany("INSERT INTO points_of_sale (pos_id, warehouse_id) VALUES (?, ?)",
+                     [(pos_id, warehouses[i % len(warehouses)]) for i, pos_id in enumerate(pos_ids)])
+    conn.commit()
+    return conn
+
+
+def build_trino_db(local_engine, date_str):
+    """SQLite copies of daily_sku_demand and stock_orc, aggregated from the raw files"""
+    from aggregates import DEMAND_TABLE
+    from columnar import STOCK_TABLE
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.executescript(f"""
+        CREATE TABLE {DEMAND_TABLE} (sku TEXT, pos_id TEXT, total_quantity INTEGER,
+                                     order_count INTEGER, order_date TEXT);
+        CREATE TABLE {STOCK_TABLE} (warehouse_id TEXT, sku TEXT, available_stock INTEGER,
+                                    reserved_stock INTEGER, safety_stock INTEGER, snapshot_date TEXT);
+        CREATE VIEW "{STOCK_TABLE}$partitions" AS SELECT DISTINCT snapshot_date FROM {STOCK_TABLE};
+    """)
+    conn.executemany(f"INSERT INTO {DEMAND_TABLE} VALUES (?, ?, ?, ?, ?)",
+                     [row + (date_str,) for row in local_engine.orders_by_sku_pos(date_str, date_str)])
+    conn.executemany(f"INSERT INTO {STOCK_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                     [row + (date_str,) for row in local_engine.stock_by_warehouse(date_str)])
+    conn.commit()
+    return conn
+
+
+# ============================================
+# BENCHMARK
+# ============================================
+
+def time_stage(func, repeat):
+    """Run func `repeat` times with its output silenced, returns (first result, timings)"""
+    result = None
+    timings = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = func()
+            timings.append(time.perf_counter() - start)
+        if i == 0:
+            result = value
+    return result, timings
+
+
+def run_scale(name, params, repeat, hdfs_server):
+    """Benchmark every stage at one scale, returns its result record"""
+    import scheduler
+    from generate_data_realistic import generate_scaled, _ids
+    from hdfs_client import WebHDFSClient
+    from engines import LocalEngine, TrinoEngine, RAW_DATA_DIR
+    from aggregates import DailyDemandAggregates
+    from pipeline import ProcurementPipeline
+    from snapshot_catalog import SNAPSHOT_CATALOG_PATH
+
+    print(f"\n📐 Scale '{name}': {params}")
+    shutil.rmtree(RAW_DATA_DIR, ignore_errors=True)
+    # Snapshots recorded by the previous scale's uploads would restrict this scale's stock
+    if os.path.exists(SNAPSHOT_CATALOG_PATH):
+        os.remove(SNAPSHOT_CATALOG_PATH)
+    with contextlib.redirect_stdout(io.StringIO()):
+        order_count = generate_scaled(BENCHMARK_DATE, 1, params['skus'], params['pos'], params['warehouses'],
+                                      params['orders_per_day'], output_dir=RAW_DATA_DIR)
+
+    master_db = build_master_db(_ids('SKU', params['skus']), _ids('POS', params['pos']),
+                                _ids('WH', params['warehouses']))
+    trino_db = build_trino_db(LocalEngine(RAW_DATA_DIR), BENCHMARK_DATE)
+
+    hdfs_server.reset()
+    hdfs = WebHDFSClient(hdfs_server.url)
+    scheduler.hdfs_client = WebHDFSClient(hdfs_server.url)
+    pipeline = ProcurementPipeline(BENCHMARK_DATE, window_days=1, engine='trino', hdfs=hdfs)
+    pipeline.db_conn = FixtureConnection(master_db)
+    cursor = SQLiteTrinoCursor(trino_db)
+    pipeline.engine = TrinoEngine(cursor, DailyDemandAggregates(cursor))
+
+    stages = {}
+    results = {}
+
+    def run(stage, func):
+        results[stage], timings = time_stage(func, repeat)
+        stages[stage] = {
+            'median_s': round(statistics.median(timings), 6),
+            'min_s': round(min(timings), 6),
+            'runs': [round(t, 6) for t in timings]
+        }
+        print(f"  {stage:<34} {stages[stage]['median_s'] * 1000:>10.1f} ms")
+
+    run('load_master_data', pipeline.load_master_data)
+    run('get_historical_orders_via_trino', pipeline.get_historical_orders_via_trino)
+    run('get_latest_stock_via_trino', pipeline.get_latest_stock_via_trino)
+    run('calculate_net_demand', lambda: pipeline.calculate_net_demand(
+        results['get_historical_orders_via_trino'], results['get_latest_stock_via_trino'],
+        *results['load_master_data']))
+    run('generate_supplier_orders', lambda: pipeline.generate_supplier_orders(results['calculate_net_demand']))
+    run('upload_to_hdfs', lambda: scheduler.upload_to_hdfs(BENCHMARK_DATE))
+
+    # The timed stages never publish the exception log, so drop its stream instead of leaving the .part
+    pipeline.close()
+    if os.path.exists(f"{pipeline.exceptions.stream_path}.part"):
+        os.remove(f"{pipeline.exceptions.stream_path}.part")
+    hdfs.close()
+    scheduler.hdfs_client.close()
+    master_db.close()
+    trino_db.close()
+
+    return {
+        'params': params,
+        'counts': {
+            'orders': order_count,
+            'sku_pos_rows': len(results['get_historical_orders_via_trino']),
+            'stock_rows': len(results['get_latest_stock_via_trino']),
+            'net_demand_items': len(results['calculate_net_demand']),
+            'supplier_files': results['generate_supplier_orders'],
+            'hdfs_files': len(hdfs_server.files),
+            'hdfs_bytes': sum(hdfs_server.files.values()),
+            'hdfs_requests': dict(hdfs_server.requests)
+        },
+        'stages': stages
+    }
+
+
+def compare(current, baseline, tolerance=REGRESSION_TOLERANCE):
+    """[(scale, stage, baseline_s, current_s)] for stages slower than baseline × (1 + tolerance)"""
+    regressions = []
+    for scale, record in current['scales'].items():
+        base_stages = baseline.get('scales', {}).get(scale, {}).get('stages', {})
+        for stage, timing in record['stages'].items():
+            if stage not in base_stages:
+                continue
+            before, after = base_stages[stage]['median_s'], timing['median_s']
+            if after > before * (1 + tolerance) and after - before > NOISE_FLOOR_SECONDS:
+                regressions.append((scale, stage, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages against local service stand-ins')
+    parser.add_argument('--scales', default='small,medium',
+                        help=f"Comma-separated scales to run ({', '.join(SCALES)})")
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (median is compared)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='Allowed slowdown before a stage counts as a regression (0.25 = 25%%)')
+    parser.add_argument('--output', help='Also write this run\'s results to this JSON file')
+    parser.add_argument('--work-dir', help='Data directory for generated files (default: a temp dir)')
+    args = parser.parse_args()
+
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        parser.error(f"unknown scales: {', '.join(unknown)}")
+    # A run without a baseline would pass without comparing anything
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}, create one with --save-baseline")
+
+    # Pipeline modules read DATA_DIR at import time, so point them at the work dir first
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='procurement-bench-')
+    os.environ['DATA_DIR'] = work_dir
+    os.environ['MASTER_CACHE_ENABLED'] = '0'
+    os.environ['QUERY_CACHE_ENABLED'] = '0'
+    # Every repeat writes the supplier orders instead of timing the unchanged-content skip
+    os.environ['SUPPLIER_ORDERS_INCREMENTAL'] = '0'
+    os.makedirs(f"{work_dir}/logs", exist_ok=True)
+    import logging
+    import scheduler
+    scheduler.logger.setLevel(logging.WARNING)
+
+    print("="*70)
+    print(f"STAGE BENCHMARKS - scales: {', '.join(scales)}, {args.repeat} runs each")
+    print(f"Work dir: {work_dir}")
+    print("="*70)
+
+    hdfs_server = FakeWebHDFS().start()
+    try:
+        current = {
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'host': platform.node(),
+            'repeat': args.repeat,
+            'scales': {name: run_scale(name, SCALES[name], args.repeat, hdfs_server) for name in scales}
+        }
+    finally:
+        hdfs_server.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+    regressions = []
+    if not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        print(f"\n📏 Compared with baseline from {baseline.get('created_at')} (tolerance {args.tolerance:.0%})")
+        for scale, stage, before, after in regressions:
+            print(f"  ✗ {scale}/{stage}: {before * 1000:.1f} ms → {after * 1000:.1f} ms")
+        if not regressions:
+            print("  ✓ No regressions")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\n✓ Baseline saved to {args.baseline}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
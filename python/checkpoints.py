@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Run Checkpoints
+Stage outputs of a pipeline run (master data, order and stock aggregates, net
+demand, uploaded supplier orders) saved under a run directory keyed by date and
+input fingerprint, so a retry with --resume skips the stages that completed
+"""
+
+import os
+import json
+import glob
+import shutil
+import time
+import hashlib
+from datetime import datetime
+from engines import DATA_DIR, RAW_DATA_DIR
+
+# Configuration
+CHECKPOINT_DIR = os.getenv('CHECKPOINT_DIR', f"{DATA_DIR}/checkpoints")
+CHECKPOINT_RETENTION_DAYS = int(os.getenv('CHECKPOINT_RETENTION_DAYS', '7'))
+INGEST_STATE_DIR = os.getenv('INGEST_STATE_DIR', f"{DATA_DIR}/state/ingested")
+HDFS_RAW_DIR = '/data/raw'
+RAW_KINDS = ('orders', 'stock')
+
+
+def _json_default(value):
+    # NumPy scalars from the local engine and the master-data snapshot
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _encode_mapping(mapping):
+    """[[key, value], ...] so tuple keys survive JSON (as lists)"""
+    return [[list(key) if isinstance(key, tuple) else key, value] for key, value in mapping.items()]
+
+
+def _decode_mapping(pairs):
+    return {tuple(key) if isinstance(key, list) else key: value for key, value in pairs}
+
+
+def input_fingerprint(dates, hdfs=None, raw_dir=RAW_DATA_DIR, extra=(), kinds=RAW_KINDS):
+    """
+    Hash of the names, sizes and modification times of the raw files of `kinds` for
+    `dates` (HDFS listings when a client is given, else the local raw directories)
+    """
+    entries = [str(part) for part in extra]
+    for kind in kinds:
+        for date_str in dates:
+            entries.extend(f"{kind}/{date_str}/{entry}" for entry in _listing(kind, date_str, hdfs, raw_dir))
+    return _digest(entries)
+
+
+def _digest(entries):
+    return hashlib.sha256('\n'.join(sorted(entries)).encode()).hexdigest()[:16]
+
+
+def _listing(kind, date_str, hdfs=None, raw_dir=RAW_DATA_DIR):
+    """'name:size:mtime' of each raw file of one kind and date"""
+    if hdfs is not None:
+        return [f"{status['pathSuffix']}:{status['length']}:{status['modificationTime']}"
+                for status in hdfs.list_status(f"{HDFS_RAW_DIR}/{kind}/{date_str}")]
+    entries = []
+    for path in glob.glob(f"{raw_dir}/{kind}/{date_str}/*"):
+        stat = os.stat(path)
+        entries.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return entries
+
+
+def raw_files(date_str, hdfs=None, raw_dir=RAW_DATA_DIR):
+    """{kind: sorted 'name:size:mtime' entries} of one date's raw files"""
+    return {kind: sorted(_listing(kind, date_str, hdfs, raw_dir)) for kind in RAW_KINDS}
+
+
+def added_files(before, after):
+    """
+    {kind: [file names]} added from listing `before` to `after` (raw_files results), or None
+    if anything else changed (a file rewritten or removed) or there is no `before`
+    """
+    if not before:
+        return None
+    added = {}
+    for kind in RAW_KINDS:
+        old, new = set(before.get(kind, [])), set(after.get(kind, []))
+        if not old <= new:
+            return None
+        added[kind] = sorted(entry.rsplit(':', 2)[0] for entry in new - old)
+    return added
+
+
+class IngestState:
+    """
+    Raw files (and their fingerprint per kind) each date's ORC partitions and demand aggregates
+    were last built from, one small JSON file per date in <state_dir>/
+    A date whose raw files still match needs no new ingest, one that only gained files can
+    append them, and queries over it can be cached
+    """
+
+    def __init__(self, state_dir=INGEST_STATE_DIR):
+        self.state_dir = state_dir
+
+    def _path(self, date_str):
+        return f"{self.state_dir}/{date_str}.json"
+
+    def get(self, date_str):
+        try:
+            with open(self._path(date_str)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, date_str, files):
+        """Remember the raw_files() listing the date was built from"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._path(date_str)
+        # Same value input_fingerprint([date_str], kinds=(kind,)) gives for this listing
+        entry = {kind: _digest(f"{kind}/{date_str}/{name}" for name in files[kind]) for kind in RAW_KINDS}
+        entry['files'] = files
+        with open(f"{path}.{os.getpid()}.tmp", 'w') as f:
+            json.dump(entry, f)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def forget(self, date_str):
+        """The date's tables are being rewritten, so they match no raw fingerprint until recorded again"""
+        if os.path.exists(self._path(date_str)):
+            os.remove(self._path(date_str))
+
+
+class RunCheckpoint:
+    """
+    One JSON file per completed stage in <checkpoint_dir>/<date>/<fingerprint>/
+    holding the stage result, next to an NDJSON file of the exceptions the stage raised
+    """
+
+    def __init__(self, date_str, fingerprint, checkpoint_dir=CHECKPOINT_DIR, reset=False):
+        self.date_str = date_str
+        self.fingerprint = fingerprint
+        self.checkpoint_dir = checkpoint_dir
+        self.day_dir = f"{checkpoint_dir}/{date_str}"
+        self.run_dir = f"{self.day_dir}/{fingerprint}"
+        if reset:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.created_at = self._created_at()
+
+    def _created_at(self):
+        """Creation time of the run, kept across retries so rewritten outputs are identical"""
+        path = f"{self.run_dir}/run.json"
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)['created_at']
+        created_at = datetime.now().isoformat()
+        self._write(path, {'date': self.date_str, 'fingerprint': self.fingerprint, 'created_at': created_at})
+        return created_at
+
+    @staticmethod
+    def _write(path, payload):
+        # Written under a temp name and renamed, so an interrupted write is never loaded
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(payload, f, default=_json_default)
+        os.replace(f"{path}.tmp", path)
+
+    def _path(self, stage):
+        return f"{self.run_dir}/{stage}.json"
+
+    def _exceptions_path(self, stage):
+        return f"{self.run_dir}/{stage}.exceptions.ndjson"
+
+    def has(self, stage):
+        return os.path.exists(self._path(stage))
+
+    def save(self, stage, result=None, exceptions=(), mappings=False):
+        """
+        Checkpoint a stage; mappings=True for a dict or tuple of dicts with tuple keys
+        exceptions can be any iterable, it is streamed to the stage's exceptions file
+        """
+        path = self._exceptions_path(stage)
+        with open(f"{path}.tmp", 'w') as f:
+            for exception in exceptions:
+                f.write(json.dumps(exception, default=_json_default) + '\n')
+        os.replace(f"{path}.tmp", path)
+        if mappings:
+            single = isinstance(result, dict)
+            result = [_encode_mapping(m) for m in ([result] if single else result)]
+            result = {'single': single, 'mappings': result}
+        # The stage file is written last: it marks the checkpoint as complete
+        self._write(self._path(stage), {'result': result, 'mappings': mappings})
+
+    def _exceptions(self, stage):
+        with open(self._exceptions_path(stage)) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def load(self, stage):
+        """(result, exceptions) of a checkpointed stage; exceptions are read lazily"""
+        with open(self._path(stage)) as f:
+            payload = json.load(f)
+        result = payload['result']
+        if payload['mappings']:
+            mappings = [_decode_mapping(pairs) for pairs in result['mappings']]
+            result = mappings[0] if result['single'] else tuple(mappings)
+        if 'exceptions' in payload:
+            # Checkpoints written before exceptions moved to their own file
+            return result, payload['exceptions']
+        return result, self._exceptions(stage)
+
+    def prune(self, retention_days=CHECKPOINT_RETENTION_DAYS):
+        """Drop checkpoints of earlier inputs of the same day and of days not run for retention_days"""
+        for name in os.listdir(self.day_dir):
+            if name != self.fingerprint:
+                shutil.rmtree(f"{self.day_dir}/{name}", ignore_errors=True)
+        cutoff = time.time() - retention_days * 86400
+        for name in os.listdir(self.checkpoint_dir):
+            path = f"{self.checkpoint_dir}/{name}"
+            if name != self.date_str and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Columnar Conversion Stage
+Rewrites each day's raw JSON orders / CSV stock partitions into typed,
+compressed ORC tables that the pipeline queries instead of the raw files.
+Micro-batches append only the files that landed since the last ingest
+"""
+
+import os
+
+ORDERS_TABLE = 'orders_orc'
+STOCK_TABLE = 'stock_orc'
+# Full HDFS URI of a raw file as Trino reports it in "$path"
+HDFS_FS_URI = os.getenv('HDFS_FS_URI', 'hdfs://namenode:9000')
+# HDFS location of the warehouse schema: managed tables live in <WAREHOUSE_DIR>/<table>/<column>=<value>/
+WAREHOUSE_DIR = '/data/warehouse'
+
+
+class ColumnarConverter:
+    """Maintains the ORC copies of orders_data and stock_data, one partition per day"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def ensure_tables(self):
+        """Create the managed ORC tables (stored under the warehouse schema location)"""
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ORDERS_TABLE} (
+                order_id VARCHAR,
+                pos_id VARCHAR,
+                sku VARCHAR,
+                quantity INTEGER,
+                order_time VARCHAR,
+                customer_id VARCHAR,
+                order_date DATE
+            ) WITH (
+                format = 'ORC',
+                partitioned_by = ARRAY['order_date']
+            )
+        """)
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {STOCK_TABLE} (
+                warehouse_id VARCHAR,
+                sku VARCHAR,
+                available_stock INTEGER,
+                reserved_stock INTEGER,
+                safety_stock INTEGER,
+                snapshot_time VARCHAR,
+                snapshot_date DATE
+            ) WITH (
+                format = 'ORC',
+                partitioned_by = ARRAY['snapshot_date']
+            )
+        """)
+
+    def _insert(self, query):
+        self.cursor.execute(query)
+        result = self.cursor.fetchone()
+        return result[0] if result else 0
+
+    def convert_orders(self, date_str):
+        """Rewrite one order_date partition (requires insert_existing_partitions_behavior=OVERWRITE)"""
+        return self._insert(f"""
+            INSERT INTO {ORDERS_TABLE}
+            SELECT order_id, pos_id, sku, quantity, order_time, customer_id,
+                   CAST(order_date AS DATE)
+            FROM orders_data
+            WHERE order_date = '{date_str}'
+        """)
+
+    def convert_stock(self, date_str):
+        """Rewrite one snapshot_date partition, casting the CSV strings once"""
+        return self._insert(f"""
+            INSERT INTO {STOCK_TABLE}
+            SELECT warehouse_id, sku,
+                   CAST(available_stock AS INTEGER),
+                   CAST(reserved_stock AS INTEGER),
+                   CAST(safety_stock AS INTEGER),
+                   snapshot_time,
+                   CAST(snapshot_date AS DATE)
+            FROM stock_data
+            WHERE snapshot_date = '{date_str}'
+        """)
+
+    def convert_day(self, date_str):
+        """Convert both raw partitions for date_str, returns (order_rows, stock_rows)"""
+        return self.convert_orders(date_str), self.convert_stock(date_str)
+
+    def append_orders(self, date_str, paths):
+        """Add the rows of these raw order files to the partition (requires ..._behavior=APPEND)"""
+        return self._insert(f"""
+            INSERT INTO {ORDERS_TABLE}
+            SELECT order_id, pos_id, sku, quantity, order_time, customer_id,
+                   CAST(order_date AS DATE)
+            FROM orders_data
+            WHERE order_date = '{date_str}' AND "$path" IN ({path_list(paths)})
+        """) if paths else 0
+
+    def append_stock(self, date_str, paths):
+        """Add the rows of these raw stock files to the partition (requires ..._behavior=APPEND)"""
+        return self._insert(f"""
+            INSERT INTO {STOCK_TABLE}
+            SELECT warehouse_id, sku,
+                   CAST(available_stock AS INTEGER),
+                   CAST(reserved_stock AS INTEGER),
+                   CAST(safety_stock AS INTEGER),
+                   snapshot_time,
+                   CAST(snapshot_date AS DATE)
+            FROM stock_data
+            WHERE snapshot_date = '{date_str}' AND "$path" IN ({path_list(paths)})
+        """) if paths else 0
+
+
+def raw_path(kind, date_str, name):
+    """"$path" of a raw file in its day's partition directory"""
+    return f"{HDFS_FS_URI}/data/raw/{kind}/{date_str}/{name}"
+
+
+def path_list(paths):
+    """SQL list of quoted "$path" values"""
+    return ', '.join("'" + path.replace("'", "''") + "'" for path in paths)
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Raw Small-File Compaction
+Merges the per-POS order files and per-warehouse stock files of closed days on
+HDFS into a few size-targeted part files. Inputs are streamed into each part with
+bounded ranged reads and APPENDs under a new hidden version directory of the day
+(<kind>/<date>/_vN/), then the day's Trino partition is pointed at it. The files
+it replaces stay in place for a grace period, so queries already reading them
+finish, and are deleted by a later run
+"""
+
+import os
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from hdfs_client import WebHDFSClient
+from metrics import RunMetrics
+from watcher import WATCH_LOOKBACK_DAYS
+from engines import DATA_DIR
+from columnar import HDFS_FS_URI
+from pipeline import create_trino_connection
+
+# Configuration
+HDFS_NAMENODE_URL = os.getenv('HDFS_URL', 'http://namenode:9870')
+COMPACTION_TARGET_BYTES = int(os.getenv('COMPACTION_TARGET_BYTES', str(128 * 1024 * 1024)))
+# Days still receiving micro-batches or late files are left alone
+COMPACTION_MIN_AGE_DAYS = int(os.getenv('COMPACTION_MIN_AGE_DAYS', str(WATCH_LOOKBACK_DAYS + 1)))
+# Bytes held in memory at a time while copying an input file into its part
+COMPACTION_BUFFER_BYTES = int(os.getenv('COMPACTION_BUFFER_BYTES', str(16 * 1024 * 1024)))
+# Replaced files are kept this long after their partition moved to the compacted version
+COMPACTION_GRACE_SECONDS = int(os.getenv('COMPACTION_GRACE_SECONDS', '3600'))
+COMPACTION_STATE_PATH = os.getenv('COMPACTION_STATE_PATH', f"{DATA_DIR}/state/compaction.json")
+
+HDFS_RAW_DIR = '/data/raw'
+KINDS = {'orders': '.json', 'stock': '.csv'}
+# Raw table and partition column of each kind
+PARTITIONS = {'orders': ('orders_data', 'order_date'), 'stock': ('stock_data', 'snapshot_date')}
+# Trino skips '_' entries, so a version is invisible until the partition points at it
+VERSION_PREFIX = '_v'
+
+
+def _is_date(name):
+    try:
+        datetime.strptime(name, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+
+# Longest CSV header line read when comparing stock file headers
+MAX_HEADER_BYTES = 64 * 1024
+
+
+def plan_parts(statuses, target_bytes):
+    """Group files (in name order) into parts of at most target_bytes; larger files get their own part"""
+    parts = []
+    size = 0
+    for status in statuses:
+        if parts and size + status['length'] <= target_bytes:
+            parts[-1].append(status)
+            size += status['length']
+        else:
+            parts.append([status])
+            size = status['length']
+    return parts
+
+
+class RawCompactor:
+    """
+    Compacts raw partition directories of closed days on HDFS
+    Partition locations are read and switched through Trino (cursor), and the replaced files
+    are listed in a small JSON state file until they are deleted
+    """
+
+    def __init__(self, hdfs, target_bytes=COMPACTION_TARGET_BYTES, raw_dir=HDFS_RAW_DIR, metrics=None,
+                 buffer_bytes=COMPACTION_BUFFER_BYTES, cursor=None, grace_seconds=COMPACTION_GRACE_SECONDS,
+                 state_path=COMPACTION_STATE_PATH):
+        self.hdfs = hdfs
+        self.target_bytes = target_bytes
+        self.raw_dir = raw_dir
+        self.metrics = metrics
+        self.buffer_bytes = max(1, buffer_bytes)
+        self.cursor = cursor
+        self.grace_seconds = grace_seconds
+        self.state_path = state_path
+        self.state = self._load_state()
+
+    def _load_state(self):
+        state = {'switches': []}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state.update(json.load(f))
+        return state
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def closed_days(self, kind, min_age_days=COMPACTION_MIN_AGE_DAYS):
+        """Date directories of a kind older than min_age_days"""
+        cutoff = (datetime.now().date() - timedelta(days=min_age_days)).isoformat()
+        return sorted(status['pathSuffix'] for status in self.hdfs.list_status(f"{self.raw_dir}/{kind}")
+                      if status['type'] == 'DIRECTORY' and _is_date(status['pathSuffix'])
+                      and status['pathSuffix'] <= cutoff)
+
+    def live_location(self, kind, date_str):
+        """HDFS directory the day's partition is read from, None if it is not registered"""
+        table, column = PARTITIONS[kind]
+        self.cursor.execute(f"SELECT COUNT(*) FROM \"{table}$partitions\" WHERE {column} = '{date_str}'")
+        if self.cursor.fetchone()[0] == 0:
+            return None
+        self.cursor.execute(f"SELECT \"$path\" FROM {table} WHERE {column} = '{date_str}' LIMIT 1")
+        row = self.cursor.fetchone()
+        if row is None:
+            # Registered but empty: the day's own directory
+            return f"{self.raw_dir}/{kind}/{date_str}"
+        path = row[0][len(HDFS_FS_URI):] if row[0].startswith(HDFS_FS_URI) else row[0]
+        return path.rsplit('/', 1)[0]
+
+    def _call(self, procedure, kind, date_str, *args):
+        table, column = PARTITIONS[kind]
+        extra = ''.join(f", '{arg}'" for arg in args)
+        self.cursor.execute(f"CALL system.{procedure}('warehouse', '{table}', ARRAY['{column}'], "
+                            f"ARRAY['{date_str}']{extra})")
+        self.cursor.fetchall()
+
+    def _switch(self, kind, date_str, live, location):
+        """
+        Point the day's partition at location. The file metastore has no location update, so it
+        is unregistered and registered again back to back: a query planned in between (two
+        metastore writes) misses the day, queries already running keep reading the old files
+        """
+        if live is None:
+            self._call('register_partition', kind, date_str, f"{HDFS_FS_URI}{location}")
+            return
+        self._call('unregister_partition', kind, date_str)
+        try:
+            self._call('register_partition', kind, date_str, f"{HDFS_FS_URI}{location}")
+        except Exception:
+            self._call('register_partition', kind, date_str, f"{HDFS_FS_URI}{live}")
+            raise
+
+    def purge(self, now=None):
+        """
+        Settle switches a crash interrupted (kept if the partition moved, else their version is
+        dropped) and delete replaced files whose grace period is over; returns how many were deleted
+        """
+        now = time.time() if now is None else now
+        deleted = 0
+        for switch in list(self.state['switches']):
+            try:
+                if switch['delete_after'] is None:
+                    if self.live_location(switch['kind'], switch['date']) != switch['location']:
+                        self.hdfs.delete(switch['location'], recursive=True)
+                        self.state['switches'].remove(switch)
+                        continue
+                    switch['delete_after'] = now + self.grace_seconds
+                if switch['delete_after'] <= now:
+                    for path in switch['old']:
+                        if self.hdfs.delete(path, recursive=True) or not self.hdfs.exists(path):
+                            deleted += 1
+                        else:
+                            raise IOError(f"Could not delete {path}")
+                    self.state['switches'].remove(switch)
+            except Exception as e:
+                print(f"  ⚠ {switch['kind']}/{switch['date']}: replaced files not cleaned up yet: {e}")
+        self._save_state()
+        if deleted:
+            print(f"✓ Deleted {deleted} files and versions replaced by earlier compactions")
+        return deleted
+
+    def _header(self, path, length):
+        """First line of a CSV file (with its newline), None if longer than MAX_HEADER_BYTES"""
+        data = self.hdfs.read_range(path, 0, min(length, MAX_HEADER_BYTES))
+        end = data.find(b'\n')
+        if end >= 0:
+            return data[:end + 1]
+        return data + b'\n' if len(data) == length else None
+
+    def _copy(self, path, start, length, part, written):
+        """
+        Append bytes [start, length) of path to part (already `written` bytes long), at most
+        buffer_bytes at a time and ending with a newline; returns the new length of part
+        """
+        offset = start
+        while offset < length:
+            data = self.hdfs.read_range(path, offset, min(self.buffer_bytes, length - offset))
+            if not data:
+                raise IOError(f"{path} ended at {offset} bytes, expected {length}")
+            offset += len(data)
+            if offset >= length and not data.endswith(b'\n'):
+                data += b'\n'
+            self.hdfs.append_bytes(part, data, written)
+            written += len(data)
+        return written
+
+    def compact_day(self, kind, date_str, dry_run=False):
+        """
+        Merge one day's files into part-NNNNN files of a new version; returns (files in, files out),
+        or None if the day is already compact or cannot be compacted safely
+
+        The inputs are the files of the live partition (the day's directory, or its current
+        version) plus any file that landed in the day's directory after it was compacted.
+        Each input is streamed into its part buffer_bytes at a time, so memory stays bounded
+        whatever the target or input sizes. The version becomes live with one partition
+        switch (see _switch); the replaced files are deleted by purge() after the grace period
+        """
+        extension = KINDS[kind]
+        directory = f"{self.raw_dir}/{kind}/{date_str}"
+        replaced = {path for switch in self.state['switches'] for path in switch['old'] + [switch['location']]}
+
+        listing = self.hdfs.list_status(directory)
+        numbers = [int(status['pathSuffix'][len(VERSION_PREFIX):]) for status in listing
+                   if status['type'] == 'DIRECTORY' and status['pathSuffix'].startswith(VERSION_PREFIX)
+                   and status['pathSuffix'][len(VERSION_PREFIX):].isdigit()]
+        listing = [status for status in listing if f"{directory}/{status['pathSuffix']}" not in replaced]
+        versions = sorted(f"{directory}/{status['pathSuffix']}" for status in listing
+                          if status['type'] == 'DIRECTORY' and status['pathSuffix'].startswith(VERSION_PREFIX))
+        if any(status['type'] != 'FILE' and f"{directory}/{status['pathSuffix']}" not in versions
+               or status['type'] == 'FILE' and not status['pathSuffix'].endswith(extension)
+               for status in listing):
+            print(f"  ⚠ {directory}: skipped, contains entries other than {extension} files")
+            return None
+        landed = sorted((dict(status, path=f"{directory}/{status['pathSuffix']}")
+                         for status in listing if status['type'] == 'FILE'), key=lambda status: status['path'])
+
+        if dry_run:
+            live = versions[-1] if versions else directory
+        else:
+            live = self.live_location(kind, date_str)
+            if live is None and versions:
+                print(f"  ⚠ {directory}: skipped, partition not registered but has compacted versions")
+                return None
+            # Versions that are not live are left over from interrupted runs
+            for version in versions:
+                if version != live:
+                    self._replace(kind, date_str, None, [version])
+        if live in versions:
+            statuses = sorted((dict(status, path=f"{live}/{status['pathSuffix']}")
+                               for status in self.hdfs.list_status(live) if status['type'] == 'FILE'),
+                              key=lambda status: status['path']) + landed
+            # Already compact unless files landed since or the version itself can be merged further
+            if not landed and len(plan_parts(statuses, self.target_bytes)) >= len(statuses):
+                return None
+        else:
+            statuses = landed
+        parts = plan_parts(statuses, self.target_bytes)
+        if len(parts) >= len(statuses) and live not in versions:
+            return None
+        if dry_run:
+            print(f"  → {directory}: {len(statuses)} files → {len(parts)}")
+            return len(statuses), len(parts)
+
+        version = f"{directory}/{VERSION_PREFIX}{max(numbers, default=0) + 1}"
+
+        # Stock CSVs keep a single header line (skip_header_line_count = 1 applies per file),
+        # so every header is checked before anything is written
+        header = b''
+        header_lengths = {}
+        if kind == 'stock':
+            for status in statuses:
+                if not status['length']:
+                    continue
+                file_header = self._header(status['path'], status['length'])
+                if file_header is None or (header and file_header.rstrip(b'\r\n') != header.rstrip(b'\r\n')):
+                    print(f"  ⚠ {directory}: skipped, {status['pathSuffix']} has a different CSV header")
+                    return None
+                header = header or file_header
+                header_lengths[status['path']] = min(len(file_header), status['length'])
+
+        bytes_read = bytes_written = 0
+        try:
+            for i, part in enumerate(parts):
+                part_path = f"{version}/part-{i:05d}{extension}"
+                if not self.hdfs.create_file(part_path, header):
+                    raise IOError(f"Could not create compacted part {i} of {directory}")
+                written = len(header)
+                for status in part:
+                    start = header_lengths.get(status['path'], 0)
+                    written = self._copy(status['path'], start, status['length'], part_path, written)
+                    bytes_read += status['length']
+                bytes_written += written
+        except Exception:
+            self.hdfs.delete(version, recursive=True)
+            raise
+
+        # The old live version goes as a whole, files of the day's directory one by one
+        old = [live] if live in versions else []
+        self._replace(kind, date_str, version, old + [status['path'] for status in landed], live)
+
+        if self.metrics:
+            self.metrics.add(rows_in=len(statuses), rows_out=len(parts),
+                             bytes_read=bytes_read, bytes_written=bytes_written)
+        print(f"  ✓ {directory}: {len(statuses)} files → {len(parts)} ({bytes_written:,} bytes)")
+        return len(statuses), len(parts)
+
+    def _replace(self, kind, date_str, version, old, live=None):
+        """
+        Make version live (None: keep the partition as it is) and schedule the deletion of old
+        The switch is recorded before it is made, so purge() can settle it after a crash
+        """
+        switch = {'kind': kind, 'date': date_str, 'location': version or live, 'old': old, 'delete_after': None}
+        if version is None:
+            switch['delete_after'] = time.time() + self.grace_seconds
+            self.state['switches'].append(switch)
+            self._save_state()
+            return
+        self.state['switches'].append(switch)
+        self._save_state()
+        try:
+            self._switch(kind, date_str, live, version)
+        except Exception:
+            self.state['switches'].remove(switch)
+            self._save_state()
+            self.hdfs.delete(version, recursive=True)
+            raise
+        switch['delete_after'] = time.time() + self.grace_seconds
+        self._save_state()
+
+    def compact(self, kinds=tuple(KINDS), dates=None, min_age_days=COMPACTION_MIN_AGE_DAYS, dry_run=False,
+                purge=True):
+        """
+        Compact the given dates (default: every closed day) of each kind, after purging expired
+        replaced files; returns False if any day failed
+        """
+        if purge and not dry_run:
+            self.purge()
+        ok = True
+        for kind in kinds:
+            days = dates if dates is not None else self.closed_days(kind, min_age_days)
+            compacted = files_in = files_out = 0
+            for date_str in days:
+                try:
+                    result = self.compact_day(kind, date_str, dry_run)
+                except Exception as e:
+                    print(f"  ✗ {kind}/{date_str}: {e}")
+                    if self.metrics:
+                        self.metrics.fail()
+                    ok = False
+                    continue
+                if result:
+                    compacted += 1
+                    files_in += result[0]
+                    files_out += result[1]
+            print(f"✓ {kind}: {compacted}/{len(days)} days compacted, {files_in} files → {files_out}")
+        return ok
+
+
+def run_compaction(hdfs, kinds=tuple(KINDS), dates=None, min_age_days=COMPACTION_MIN_AGE_DAYS,
+                   target_bytes=COMPACTION_TARGET_BYTES, dry_run=False, trino_conn=None):
+    """
+    One compaction run over every kind, recorded as a 'compaction' run in the metrics history
+    Partitions are switched over trino_conn (a new connection if none is given)
+    """
+    print("="*70)
+    print(f"RAW FILE COMPACTION - target {target_bytes // (1024 * 1024)} MB per file" +
+          (" (dry run)" if dry_run else ""))
+    print("="*70)
+    metrics = RunMetrics('compaction', datetime.now().strftime('%Y-%m-%d'))
+    conn = None
+    if not dry_run:
+        conn = trino_conn or create_trino_connection()
+    cursor = conn.cursor() if conn else None
+    compactor = RawCompactor(hdfs, target_bytes, metrics=metrics, cursor=cursor)
+    ok = True
+    try:
+        if not dry_run:
+            compactor.purge()
+        for kind in kinds:
+            with metrics.stage(kind):
+                ok = compactor.compact((kind,), dates, min_age_days, dry_run, purge=False) and ok
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and trino_conn is None:
+            conn.close()
+    metrics.finish('ok' if ok else 'error')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge small raw HDFS files of closed days')
+    parser.add_argument('--kinds', default=','.join(KINDS), help='Comma-separated: orders,stock')
+    parser.add_argument('--dates', help='Comma-separated dates to compact (default: every closed day)')
+    parser.add_argument('--min-age-days', type=int, default=COMPACTION_MIN_AGE_DAYS,
+                        help='Only days at least this old are closed')
+    parser.add_argument('--target-mb', type=int, default=COMPACTION_TARGET_BYTES // (1024 * 1024),
+                        help='Target size of a compacted file')
+    parser.add_argument('--dry-run', action='store_true', help='Only show what would be merged')
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        parser.error(f"unknown kinds: {', '.join(unknown)}")
+    dates = sorted({d.strip() for d in args.dates.split(',') if d.strip()}) if args.dates else None
+
+    hdfs = WebHDFSClient(HDFS_NAMENODE_URL, user='root')
+    try:
+        ok = run_compaction(hdfs, kinds, dates, args.min_age_days, args.target_mb * 1024 * 1024, args.dry_run)
+    finally:
+        hdfs.close()
+    if not ok:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Order-ID De-duplication Index
+Persistent set of recently ingested order_ids, stored as a few sorted, memory-mapped
+runs of 64-bit hashes (with the day and source file each order was first seen in),
+each behind its own Bloom filter, so each incoming record is checked in O(1) without
+rescanning old orders. A commit writes only its own batch as a new run; runs of
+similar size are merged (log-structured), and orders older than the retention
+horizon are dropped while merging
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+import numpy as np
+from engines import DATA_DIR
+
+# Configuration
+DEDUP_INDEX_DIR = os.getenv('DEDUP_INDEX_DIR', f"{DATA_DIR}/cache/order_index")
+# order_ids first seen this many days before the newest indexed day are forgotten
+DEDUP_RETENTION_DAYS = int(os.getenv('DEDUP_RETENTION_DAYS', '90'))
+DEDUP_FALSE_POSITIVE_RATE = float(os.getenv('DEDUP_FALSE_POSITIVE_RATE', '0.01'))
+
+BLOOM_HASHES = 7
+
+
+def _hash(order_id):
+    """64-bit hash of an order_id"""
+    return int.from_bytes(hashlib.blake2b(order_id.encode(), digest_size=8).digest(), 'little')
+
+
+def _ordinal(date_str):
+    return datetime.strptime(date_str, '%Y-%m-%d').toordinal()
+
+
+def _bloom_bits(capacity, rate=DEDUP_FALSE_POSITIVE_RATE):
+    """Bloom filter size for `capacity` items at the target false-positive rate"""
+    return max(1024, int(-max(1, capacity) * np.log(rate) / (np.log(2) ** 2)))
+
+
+def _bloom_positions(hashes, bits):
+    """Bit positions (len(hashes) × BLOOM_HASHES) via double hashing of the 64-bit hash"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    h1 = hashes & np.uint64(0xFFFFFFFF)
+    h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+    rounds = np.arange(BLOOM_HASHES, dtype=np.uint64)
+    return (h1[:, None] + rounds[None, :] * h2[:, None]) % np.uint64(bits)
+
+
+def _set_bits(bloom, hashes, bits):
+    positions = _bloom_positions(hashes, bits).ravel()
+    np.bitwise_or.at(bloom, (positions >> np.uint64(3)).astype(np.int64),
+                     (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+
+
+class _Run:
+    """One sorted run: hashes (uint64), days (int32 ordinals), sources (uint64), bloom (uint8 bits)"""
+
+    def __init__(self, name, hashes, days, sources, bloom, bits):
+        self.name = name
+        self.hashes = hashes
+        self.days = days
+        self.sources = sources
+        self.bloom = bloom
+        self.bits = bits
+        self.max_day = int(days.max()) if len(days) else 0
+
+    @classmethod
+    def load(cls, path, name, bits):
+        hashes = np.load(f"{path}/hashes.npy", mmap_mode='r')
+        days = np.load(f"{path}/days.npy", mmap_mode='r')
+        # Runs written before sources were kept: 0 = unknown source
+        if os.path.exists(f"{path}/sources.npy"):
+            sources = np.load(f"{path}/sources.npy", mmap_mode='r')
+        else:
+            sources = np.zeros(len(hashes), dtype=np.uint64)
+        return cls(name, hashes, days, sources, np.load(f"{path}/bloom.npy", mmap_mode='r'), bits)
+
+    @classmethod
+    def build(cls, name, hashes, days, sources):
+        """Run from arrays already sorted by hash, with a Bloom filter sized for them"""
+        bits = _bloom_bits(len(hashes))
+        bloom = np.zeros(bits // 8 + 1, dtype=np.uint8)
+        _set_bits(bloom, hashes, bits)
+        return cls(name, hashes, days, sources, bloom, bits)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(f"{path}/hashes.npy", self.hashes)
+        np.save(f"{path}/days.npy", self.days)
+        np.save(f"{path}/sources.npy", self.sources)
+        np.save(f"{path}/bloom.npy", self.bloom)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _bloom_hit(self, h):
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        for i in range(BLOOM_HASHES):
+            position = (h1 + i * h2) % self.bits
+            if not self.bloom[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def find(self, h):
+        """Position of hash h, or -1"""
+        if not self._bloom_hit(h):
+            return -1
+        # Bloom filter says "maybe": confirm against the sorted hash array
+        i = int(np.searchsorted(self.hashes, np.uint64(h)))
+        return i if i < len(self.hashes) and int(self.hashes[i]) == h else -1
+
+    def contains(self, hashes):
+        """Vectorized membership of a hash array"""
+        if len(self.hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return self.hashes[idx] == hashes
+
+
+class OrderIdIndex:
+    """
+    Run directory per sorted run: hashes.npy (sorted uint64), days.npy (int32 ordinals),
+    sources.npy (uint64 hashes of the source file names), bloom.npy (uint8 bit array);
+    CURRENT lists the live runs, newest first. An order_id is in at most one run
+
+    An order_id is a duplicate if it was already accepted in this run, or if the index
+    holds it from a different day or from another file of the same day (re-processing
+    the same file is idempotent)
+    """
+
+    def __init__(self, index_dir=DEDUP_INDEX_DIR, retention_days=DEDUP_RETENTION_DAYS):
+        self.index_dir = index_dir
+        self.retention_days = retention_days
+        self.sequence = 0
+        self.runs = []
+        self.pending = {}
+        self._load()
+
+    def _run_dir(self, name):
+        return f"{self.index_dir}/{name}"
+
+    def _load(self):
+        current = f"{self.index_dir}/CURRENT"
+        self.runs = []
+        if not os.path.exists(current):
+            return
+        with open(current) as f:
+            meta = json.load(f)
+        if 'runs' not in meta:
+            # Single-generation index written before runs: it becomes the only run
+            meta = {'sequence': meta['generation'],
+                    'runs': [{'name': f"{meta['generation']:08d}", 'bloom_bits': meta['bloom_bits']}]}
+        self.sequence = meta['sequence']
+        self.runs = [_Run.load(self._run_dir(run['name']), run['name'], run['bloom_bits']) for run in meta['runs']]
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs) + len(self.pending)
+
+    def is_duplicate(self, order_id, date_str, source=None):
+        """
+        Check one order_id (read from the file named source) and remember it for this run;
+        True if it must be dropped
+        """
+        h = _hash(order_id)
+        if h in self.pending:
+            return True
+        day = _ordinal(date_str)
+        source_hash = _hash(source) if source else 0
+        for run in self.runs:
+            i = run.find(h)
+            if i < 0:
+                continue
+            if int(run.days[i]) != day:
+                return True
+            # Same day: a duplicate unless it is the file the order_id was indexed from
+            indexed_source = int(run.sources[i])
+            if source_hash and indexed_source and indexed_source != source_hash:
+                return True
+            break
+        self.pending[h] = (day, source_hash)
+        return False
+
+    def _next_name(self):
+        self.sequence += 1
+        return f"{self.sequence:08d}"
+
+    def _merge(self, runs, horizon):
+        """One run from several (stable sort of already sorted runs), dropping days before horizon"""
+        hashes = np.concatenate([run.hashes for run in runs])
+        days = np.concatenate([run.days for run in runs])
+        sources = np.concatenate([run.sources for run in runs])
+        keep = days >= horizon
+        hashes, days, sources = hashes[keep], days[keep], sources[keep]
+        order = np.argsort(hashes, kind='stable')
+        return _Run.build(self._next_name(), hashes[order], days[order], sources[order])
+
+    def commit(self):
+        """
+        Write this run's new order_ids as a new sorted run, merging runs of similar size and
+        dropping order_ids past the retention horizon; returns how many were added
+        """
+        if not self.pending:
+            return 0
+        new_hashes = np.fromiter(self.pending.keys(), dtype=np.uint64, count=len(self.pending))
+        new_days = np.fromiter((day for day, _ in self.pending.values()), dtype=np.int32, count=len(self.pending))
+        new_sources = np.fromiter((source for _, source in self.pending.values()), dtype=np.uint64,
+                                  count=len(self.pending))
+        # Re-processed files bring order_ids an older run already holds
+        known = np.zeros(len(new_hashes), dtype=bool)
+        for run in self.runs:
+            known |= run.contains(new_hashes)
+        new_hashes, new_days, new_sources = new_hashes[~known], new_days[~known], new_sources[~known]
+        self.pending = {}
+        if len(new_hashes) == 0:
+            return 0
+
+        order = np.argsort(new_hashes)
+        runs = [_Run.build(self._next_name(), new_hashes[order], new_days[order], new_sources[order])] + self.runs
+        horizon = max(run.max_day for run in runs) - self.retention_days
+        # Runs entirely past the horizon are dropped without reading them
+        runs = [run for run in runs if run.max_day >= horizon]
+        # Merge the newest run into the next one while they are of similar size, so there are
+        # O(log n) runs and each order_id is rewritten O(log n) times overall
+        while len(runs) > 1 and len(runs[1]) <= 2 * len(runs[0]):
+            runs = [self._merge(runs[:2], horizon)] + runs[2:]
+
+        # Write the new runs, then switch CURRENT atomically and prune the replaced ones
+        live = {run.name for run in self.runs}
+        for run in runs:
+            if run.name not in live:
+                run.save(self._run_dir(run.name))
+        tmp_current = f"{self.index_dir}/CURRENT.tmp"
+        with open(tmp_current, 'w') as f:
+            json.dump({'sequence': self.sequence,
+                       'runs': [{'name': run.name, 'bloom_bits': run.bits, 'count': len(run)} for run in runs],
+                       'count': sum(len(run) for run in runs),
+                       'updated_at': datetime.now().isoformat()}, f)
+        os.replace(tmp_current, f"{self.index_dir}/CURRENT")
+
+        names = {run.name for run in runs}
+        for name in os.listdir(self.index_dir):
+            if name != 'CURRENT' and name not in names:
+                shutil.rmtree(f"{self.index_dir}/{name}", ignore_errors=True)
+
+        self._load()
+        return len(new_hashes)
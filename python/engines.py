@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Aggregation Engines
+Backends answering the pipeline's orders and stock aggregations:
+  - TrinoEngine: SQL over the ORC / aggregate tables in HDFS
+  - LocalEngine: parses data/raw files directly (process pool + NumPy), no services needed
+"""
+
+import os
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from columnar import STOCK_TABLE
+from aggregates import date_range
+
+# Configuration
+DATA_DIR = os.getenv('DATA_DIR', '/data')
+RAW_DATA_DIR = f"{DATA_DIR}/raw"
+LOCAL_ENGINE_WORKERS = int(os.getenv('LOCAL_ENGINE_WORKERS', str(os.cpu_count() or 1)))
+
+ENGINES = ('trino', 'local')
+
+
+class QueryRows(list):
+    """
+    Rows of one aggregation with what it cost, returned together so concurrent
+    queries on the same engine never read each other's numbers
+    """
+
+    def __init__(self, rows=(), bytes_read=0, cache_hit=False):
+        super().__init__(rows)
+        # Raw bytes parsed (local engine) and whether the query result cache answered
+        self.bytes_read = bytes_read
+        self.cache_hit = cache_hit
+
+
+class TrinoEngine:
+    """Aggregations via Trino (tables prepared by ProcurementPipeline.connect_trino)"""
+
+    name = 'trino'
+
+    def __init__(self, cursor, aggregates):
+        self.cursor = cursor
+        self.aggregates = aggregates
+
+    def orders_by_sku_pos(self, start, end):
+        """[(sku, pos_id, total_quantity, order_count)] over [start, end]"""
+        return QueryRows(self.aggregates.demand_by_sku_pos(start, end))
+
+    def latest_stock_date(self, date_str):
+        """Latest snapshot date on or before date_str (partition metadata only, no data scan)"""
+        self.cursor.execute(f"""
+        SELECT MAX(snapshot_date) as latest_date
+        FROM "{STOCK_TABLE}$partitions"
+        WHERE snapshot_date <= DATE '{date_str}'
+        """)
+        result = self.cursor.fetchone()
+        return str(result[0]) if result and result[0] else None
+
+    def stock_by_warehouse(self, snapshot_date):
+        """[(warehouse_id, sku, total_available, total_reserved, max_safety_stock)] for one snapshot"""
+        self.cursor.execute(f"""
+        SELECT
+            warehouse_id,
+            sku,
+            SUM(available_stock) as total_available,
+            SUM(reserved_stock) as total_reserved,
+            MAX(safety_stock) as max_safety_stock
+        FROM {STOCK_TABLE}
+        WHERE snapshot_date = DATE '{snapshot_date}'
+        GROUP BY warehouse_id, sku
+        """)
+        return QueryRows(self.cursor.fetchall())
+
+    def stock_by_snapshots(self, snapshots):
+        """
+        Same rows as stock_by_warehouse, each warehouse read from its own snapshot
+        ({warehouse_id: {'date', ...}}); only those snapshot_date partitions are scanned
+        """
+        by_date = {}
+        for warehouse_id, snapshot in snapshots.items():
+            by_date.setdefault(snapshot['date'], []).append(warehouse_id)
+        if not by_date:
+            return QueryRows()
+        dates = ', '.join(f"DATE '{date_str}'" for date_str in sorted(by_date))
+        warehouses = ' OR '.join(
+            f"(snapshot_date = DATE '{date_str}' AND warehouse_id IN ({_sql_strings(by_date[date_str])}))"
+            for date_str in sorted(by_date))
+        self.cursor.execute(f"""
+        SELECT
+            warehouse_id,
+            sku,
+            SUM(available_stock) as total_available,
+            SUM(reserved_stock) as total_reserved,
+            MAX(safety_stock) as max_safety_stock
+        FROM {STOCK_TABLE}
+        WHERE snapshot_date IN ({dates})
+          AND ({warehouses})
+        GROUP BY warehouse_id, sku
+        """)
+        return QueryRows(self.cursor.fetchall())
+
+
+def _sql_strings(values):
+    return ', '.join("'" + value.replace("'", "''") + "'" for value in sorted(values))
+
+
+def _is_date(name):
+    try:
+        datetime.strptime(name, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+
+def _total_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def _read_orders(path):
+    """Yield order dicts from a JSON array file or a newline-delimited JSON file"""
+    with open(path) as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == '[':
+            yield from json.load(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+KEY_SEPARATOR = '\x1f'
+
+
+def _split_keys(keys):
+    return [key.split(KEY_SEPARATOR) for key in keys]
+
+
+def _parse_orders_file(path):
+    """Per-file partial aggregate keyed by sku␟pos_id: (keys, quantity_sums, order_counts)"""
+    keys = []
+    quantities = []
+    for order in _read_orders(path):
+        keys.append(f"{order['sku']}{KEY_SEPARATOR}{order['pos_id']}")
+        quantities.append(order['quantity'])
+    if not keys:
+        return np.array([], dtype=str), np.zeros(0, np.int64), np.zeros(0, np.int64)
+    unique, inverse = np.unique(np.array(keys), return_inverse=True)
+    sums = np.bincount(inverse, weights=np.array(quantities, dtype=np.int64), minlength=len(unique))
+    counts = np.bincount(inverse, minlength=len(unique))
+    return unique, sums.astype(np.int64), counts.astype(np.int64)
+
+
+def _parse_stock_file(path):
+    """Per-file partial aggregate keyed by warehouse_id␟sku: (keys, available_sums, reserved_sums, safety_max)"""
+    keys = []
+    values = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            keys.append(f"{row['warehouse_id']}{KEY_SEPARATOR}{row['sku']}")
+            values.append((int(row['available_stock']), int(row['reserved_stock']), int(row['safety_stock'])))
+    if not keys:
+        empty = np.zeros(0, np.int64)
+        return np.array([], dtype=str), empty, empty, empty
+    values = np.array(values, dtype=np.int64)
+    unique, inverse = np.unique(np.array(keys), return_inverse=True)
+    available = np.bincount(inverse, weights=values[:, 0], minlength=len(unique)).astype(np.int64)
+    reserved = np.bincount(inverse, weights=values[:, 1], minlength=len(unique)).astype(np.int64)
+    safety = np.full(len(unique), np.iinfo(np.int64).min)
+    np.maximum.at(safety, inverse, values[:, 2])
+    return unique, available, reserved, safety
+
+
+class LocalEngine:
+    """Aggregations straight from data/raw/{orders,stock}/<date>/ files"""
+
+    name = 'local'
+
+    def __init__(self, raw_dir=RAW_DATA_DIR, workers=LOCAL_ENGINE_WORKERS):
+        self.raw_dir = raw_dir
+        self.workers = max(1, workers)
+
+    def _files(self, kind, date_str, extension):
+        directory = f"{self.raw_dir}/{kind}/{date_str}"
+        if not os.path.isdir(directory):
+            return []
+        return [f"{directory}/{name}" for name in sorted(os.listdir(directory)) if name.endswith(extension)]
+
+    def _map(self, func, paths):
+        if self.workers == 1 or len(paths) <= 1:
+            return [func(path) for path in paths]
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(paths))) as executor:
+            return list(executor.map(func, paths))
+
+    def orders_by_sku_pos(self, start, end):
+        """[(sku, pos_id, total_quantity, order_count)] over [start, end], largest demand first"""
+        paths = []
+        for date_str in date_range(start, end):
+            paths.extend(self._files('orders', date_str, '.json'))
+        bytes_read = _total_size(paths)
+        partials = [p for p in self._map(_parse_orders_file, paths) if len(p[0])]
+        if not partials:
+            return QueryRows(bytes_read=bytes_read)
+
+        # Merge per-file partials by (sku, pos_id)
+        unique, inverse = np.unique(np.concatenate([p[0] for p in partials]), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate([p[1] for p in partials]), minlength=len(unique))
+        counts = np.bincount(inverse, weights=np.concatenate([p[2] for p in partials]), minlength=len(unique))
+        order = np.argsort(-totals, kind='stable')
+        return QueryRows([(sku, pos_id, total, count) for (sku, pos_id), total, count in
+                          zip(_split_keys(unique[order].tolist()), totals[order].astype(np.int64).tolist(),
+                              counts[order].astype(np.int64).tolist())], bytes_read=bytes_read)
+
+    def latest_stock_date(self, date_str):
+        """Latest snapshot directory on or before date_str that contains stock files"""
+        stock_dir = f"{self.raw_dir}/stock"
+        if not os.path.isdir(stock_dir):
+            return None
+        dates = sorted((name for name in os.listdir(stock_dir) if _is_date(name) and name <= date_str),
+                       reverse=True)
+        for name in dates:
+            if self._files('stock', name, '.csv'):
+                return name
+        return None
+
+    def stock_by_warehouse(self, snapshot_date):
+        """[(warehouse_id, sku, total_available, total_reserved, max_safety_stock)] for one snapshot"""
+        paths = self._files('stock', snapshot_date, '.csv')
+        return self._merge_stock([p for p in self._map(_parse_stock_file, paths) if len(p[0])],
+                                 _total_size(paths))
+
+    def stock_by_snapshots(self, snapshots):
+        """
+        Same rows as stock_by_warehouse, each warehouse read from its own snapshot
+        ({warehouse_id: {'date', 'files'}}); only the listed files are parsed
+        """
+        files = sorted({(snapshot['date'], path) for snapshot in snapshots.values() for path in snapshot['files']
+                        if os.path.exists(f"{self.raw_dir}/{path}")})
+        paths = [f"{self.raw_dir}/{path}" for _, path in files]
+        partials = []
+        for (date_str, _), partial in zip(files, self._map(_parse_stock_file, paths)):
+            # A file may hold other warehouses, which use another snapshot
+            keys, available, reserved, safety = partial
+            keep = np.array([snapshots.get(warehouse_id, {}).get('date') == date_str
+                             for warehouse_id, _ in _split_keys(keys.tolist())], dtype=bool)
+            if keep.any():
+                partials.append((keys[keep], available[keep], reserved[keep], safety[keep]))
+        return self._merge_stock(partials, _total_size(paths))
+
+    @staticmethod
+    def _merge_stock(partials, bytes_read=0):
+        """Merge per-file stock partials by (warehouse_id, sku)"""
+        if not partials:
+            return QueryRows(bytes_read=bytes_read)
+
+        unique, inverse = np.unique(np.concatenate([p[0] for p in partials]), return_inverse=True)
+        available = np.bincount(inverse, weights=np.concatenate([p[1] for p in partials]), minlength=len(unique))
+        reserved = np.bincount(inverse, weights=np.concatenate([p[2] for p in partials]), minlength=len(unique))
+        safety = np.full(len(unique), np.iinfo(np.int64).min)
+        np.maximum.at(safety, inverse, np.concatenate([p[3] for p in partials]))
+        return QueryRows([(warehouse_id, sku, int(a), int(r), int(m)) for (warehouse_id, sku), a, r, m in
+                          zip(_split_keys(unique.tolist()), available, reserved, safety)], bytes_read=bytes_read)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Streaming Exception Log
+Appends each exception of a run to an NDJSON stream as it is raised and keeps
+only per-type counts and a few samples per type in memory. The report is the
+full stream plus a small summary file that dashboards can load directly
+"""
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+from engines import DATA_DIR
+
+# Configuration
+EXCEPTION_LOG_DIR = os.getenv('EXCEPTION_LOG_DIR', f"{DATA_DIR}/logs/exceptions")
+EXCEPTION_SAMPLE_SIZE = int(os.getenv('EXCEPTION_SAMPLE_SIZE', '20'))
+
+
+def _json_default(value):
+    # NumPy scalars from the net demand engine
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _line(item):
+    return json.dumps(item, separators=(',', ':'), default=_json_default) + '\n'
+
+
+class CapturedExceptions:
+    """Exceptions appended by one thread inside ExceptionLog.capture(), spilled to a file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        self._file = None
+
+    def append(self, item):
+        if self._file is None:
+            self._file = open(self.path, 'w')
+        self._file.write(_line(item))
+        self.counts[item['type']] = self.counts.get(item['type'], 0) + 1
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __iter__(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        with open(self.path) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path)
+            self._file = None
+
+
+class ExceptionLog:
+    """
+    Exception dicts of one run for one date: streamed to <date>_exceptions.ndjson.part
+    while the run goes on, published with the <date>_exceptions.json summary by save()
+    """
+
+    def __init__(self, date_str, log_dir=EXCEPTION_LOG_DIR, sample_size=EXCEPTION_SAMPLE_SIZE):
+        self.date_str = date_str
+        self.log_dir = log_dir
+        self.sample_size = sample_size
+        self.stream_path = f"{log_dir}/{date_str}_exceptions.ndjson"
+        self.summary_path = f"{log_dir}/{date_str}_exceptions.json"
+        self.counts = {}
+        self.samples = {}
+        self._file = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._captures = 0
+
+    def append(self, item):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.log_dir, exist_ok=True)
+                self._file = open(f"{self.stream_path}.part", 'w')
+            self._file.write(_line(item))
+            kind = item['type']
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            samples = self.samples.setdefault(kind, [])
+            if len(samples) < self.sample_size:
+                samples.append(item)
+        for captured in getattr(self._local, 'captures', ()):
+            captured.append(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    @contextmanager
+    def capture(self):
+        """Also collect the exceptions appended by the current thread (spilled next to the stream)"""
+        with self._lock:
+            self._captures += 1
+            path = f"{self.log_dir}/.{self.date_str}_capture_{os.getpid()}_{id(self)}_{self._captures}.ndjson"
+        os.makedirs(self.log_dir, exist_ok=True)
+        captured = CapturedExceptions(path)
+        if not hasattr(self._local, 'captures'):
+            self._local.captures = []
+        self._local.captures.append(captured)
+        try:
+            yield captured
+        finally:
+            self._local.captures.remove(captured)
+            captured.discard()
+
+    def summary(self):
+        return {
+            'date': self.date_str,
+            'exception_count': len(self),
+            'counts': dict(sorted(self.counts.items())),
+            'sample_size': self.sample_size,
+            'samples': self.samples,
+            'stream': os.path.basename(self.stream_path) if self.counts else None,
+        }
+
+    def save(self):
+        """Publish the stream and write the summary; returns the summary path"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            os.makedirs(self.log_dir, exist_ok=True)
+            if self.counts:
+                os.replace(f"{self.stream_path}.part", self.stream_path)
+            else:
+                # No exceptions this time: drop the stream of an earlier run of the date and
+                # the .part file a crashed run may have left behind
+                for path in (self.stream_path, f"{self.stream_path}.part"):
+                    if os.path.exists(path):
+                        os.remove(path)
+            with open(f"{self.summary_path}.tmp", 'w') as f:
+                json.dump(self.summary(), f, indent=2, default=_json_default)
+            os.replace(f"{self.summary_path}.tmp", self.summary_path)
+        return self.summary_path
+
+    def close(self):
+        """Close the stream of a run that was not saved (its .part file is left for inspection)"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
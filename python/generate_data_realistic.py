@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
-"""REALISTIC Data Generator - Creates actual shortages"""
+"""REALISTIC Data Generator - Creates actual shortages
+
+Also has a --scale mode for load testing: configurable SKUs / POS / warehouses /
+volume / days with skewed SKU popularity and weekly seasonality, sampled in NumPy
+batches and written per POS in parallel
+"""
 import random
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
 import json
 import csv
 import os
+import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 SKUS = [f'SKU{str(i).zfill(3)}' for i in range(1, 26)]
 POS_SYSTEMS = ['POS001', 'POS002', 'POS003', 'POS004', 'POS005']
 WAREHOUSES = ['WH001', 'WH002', 'WH003']
+RAW_DATA_DIR = f"{os.getenv('DATA_DIR', '/data')}/raw"
 
 def generate_realistic_orders(date_str):
     """Generate orders with HIGH demand"""
@@ -21,7 +32,7 @@ def generate_realistic_orders(date_str):
             quantity = random.randint(1, 15)
             
             orders.append({
-                'order_id': f'ORD{random.randint(10000, 99999)}',
+                'order_id': str(uuid.uuid4()),
                 'pos_id': pos_id,
                 'sku': sku,
                 'quantity': quantity,
@@ -30,7 +41,7 @@ def generate_realistic_orders(date_str):
                 'customer_id': f'CUST{random.randint(1000,9999)}'
             })
         
-        output_dir = f'/data/raw/orders/{date_str}'
+        output_dir = f'{RAW_DATA_DIR}/orders/{date_str}'
         os.makedirs(output_dir, exist_ok=True)
         with open(f'{output_dir}/{pos_id}_orders.json', 'w') as f:
            for order in orders:
@@ -57,7 +68,7 @@ def generate_realistic_stock(date_str):
                 'snapshot_time': '23:59:59'
             })
         
-        output_dir = f'/data/raw/stock/{date_str}'
+        output_dir = f'{RAW_DATA_DIR}/stock/{date_str}'
         os.makedirs(output_dir, exist_ok=True)
         with open(f'{output_dir}/{warehouse_id}_stock.csv', 'w', newline='') as f:
             writer = csv.DictWriter(f, fieldnames=stock_data[0].keys())
@@ -65,10 +76,183 @@ def generate_realistic_stock(date_str):
             writer.writerows(stock_data)
         print(f"Generated stock for {warehouse_id}")
 
+
+# ============================================
+# SCALE MODE (vectorized, for load testing)
+# ============================================
+
+ORDER_LINE = ('{"order_id": "%s", "pos_id": "%s", "sku": "%s", "quantity": %d, '
+              '"order_date": "%s", "order_time": "%s", "customer_id": "CUST%d"}')
+STOCK_FIELDS = ['warehouse_id', 'sku', 'available_stock', 'reserved_stock', 'safety_stock',
+                'snapshot_date', 'snapshot_time']
+WRITE_BATCH = 500000
+
+
+def _ids(prefix, count):
+    """SKU001.. / POS001.. style ids, widened past 999"""
+    width = max(3, len(str(count)))
+    return [f'{prefix}{str(i).zfill(width)}' for i in range(1, count + 1)]
+
+
+def _uuids(rng, count):
+    """count random UUID4-formatted strings without a Python call per id"""
+    raw = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hex_digits = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+    chars = np.empty((count, 36), dtype=np.uint8)
+    nibbles = np.stack([raw >> 4, raw & 0x0F], axis=2).reshape(count, 32)
+    dashes = [8, 13, 18, 23]
+    columns = [i for i in range(36) if i not in dashes]
+    chars[:, columns] = hex_digits[nibbles]
+    chars[:, dashes] = ord('-')
+    return chars.view('S36').ravel().astype(str)
+
+
+def sku_weights(num_skus, skew):
+    """Zipf-like popularity: weight of the k-th SKU ∝ 1 / k^skew"""
+    weights = 1.0 / np.arange(1, num_skus + 1) ** skew
+    return weights / weights.sum()
+
+
+def season_factor(date, seasonality):
+    """Weekly demand multiplier peaking on Saturdays"""
+    return max(0.0, 1 + seasonality * math.cos(2 * math.pi * (date.weekday() - 5) / 7))
+
+
+def _generate_pos(task):
+    """Write every day's order file for one POS, returns the number of orders"""
+    pos_index, pos_id, dates, config = task
+    rng = np.random.default_rng([config['seed'], pos_index])
+    skus = np.array(_ids('SKU', config['skus']))
+    weights = sku_weights(config['skus'], config['skew'])
+    # Some stores are busier than others
+    share = config['pos_shares'][pos_index]
+
+    total = 0
+    for date_str in dates:
+        date = datetime.strptime(date_str, '%Y-%m-%d')
+        expected = config['orders_per_day'] * share * season_factor(date, config['seasonality'])
+        count = int(rng.poisson(expected))
+        output_dir = f"{config['output_dir']}/orders/{date_str}"
+        os.makedirs(output_dir, exist_ok=True)
+
+        with open(f'{output_dir}/{pos_id}_orders.json', 'w') as f:
+            for start in range(0, count, WRITE_BATCH):
+                n = min(WRITE_BATCH, count - start)
+                order_ids = _uuids(rng, n)
+                sku_col = skus[rng.choice(len(skus), size=n, p=weights)].tolist()
+                quantities = rng.integers(1, 16, size=n).tolist()
+                seconds = np.sort(rng.integers(8 * 3600, 23 * 3600, size=n))
+                times = [f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in seconds.tolist()]
+                customers = rng.integers(1000, 100000, size=n).tolist()
+                f.write('\n'.join(ORDER_LINE % row for row in zip(
+                    order_ids.tolist(), [pos_id] * n, sku_col, quantities, [date_str] * n, times, customers)))
+                f.write('\n')
+        total += count
+    return total
+
+
+def _generate_stock(task):
+    """Write every day's stock snapshot for one warehouse"""
+    wh_index, warehouse_id, dates, config = task
+    rng = np.random.default_rng([config['seed'], 1000000 + wh_index])
+    skus = _ids('SKU', config['skus'])
+    for date_str in dates:
+        available = rng.integers(20, 101, size=len(skus))
+        reserved = (rng.random(len(skus)) * (available * 0.2 + 1)).astype(int)
+        safety = rng.integers(80, 151, size=len(skus))
+        output_dir = f"{config['output_dir']}/stock/{date_str}"
+        os.makedirs(output_dir, exist_ok=True)
+        with open(f'{output_dir}/{warehouse_id}_stock.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(STOCK_FIELDS)
+            writer.writerows(zip([warehouse_id] * len(skus), skus, available.tolist(), reserved.tolist(),
+                                 safety.tolist(), [date_str] * len(skus), ['23:59:59'] * len(skus)))
+    return len(skus) * len(dates)
+
+
+def write_master_data_sql(path, num_skus, num_pos, num_warehouses):
+    """PostgreSQL script adding the generated SKUs, POS and warehouses to the master data"""
+    sku_width = max(3, len(str(num_skus)))
+    pos_width = max(3, len(str(num_pos)))
+    wh_width = max(3, len(str(num_warehouses)))
+    with open(path, 'w') as f:
+        f.write(f"""-- Master data for generated load-test data ({num_skus} SKUs, {num_pos} POS, {num_warehouses} warehouses)
+INSERT INTO warehouses (warehouse_id, warehouse_name, capacity)
+SELECT 'WH' || lpad(i::text, {wh_width}, '0'), 'Load Test Warehouse ' || i, 50000
+FROM generate_series(1, {num_warehouses}) i
+ON CONFLICT (warehouse_id) DO NOTHING;
+
+INSERT INTO points_of_sale (pos_id, pos_name, warehouse_id)
+SELECT 'POS' || lpad(i::text, {pos_width}, '0'), 'Load Test POS ' || i,
+       'WH' || lpad((1 + (i - 1) % {num_warehouses})::text, {wh_width}, '0')
+FROM generate_series(1, {num_pos}) i
+ON CONFLICT (pos_id) DO NOTHING;
+
+INSERT INTO products (sku, product_name, category, supplier_id, unit_price, pack_size, case_size)
+SELECT 'SKU' || lpad(i::text, {sku_width}, '0'), 'Load Test Product ' || i, 'Load Test',
+       'SUP' || lpad((1 + (i - 1) % 8)::text, 3, '0'), 1.00 + (i % 50) / 10.0, 1, (ARRAY[6, 10, 12, 24])[1 + i % 4]
+FROM generate_series(1, {num_skus}) i
+ON CONFLICT (sku) DO NOTHING;
+
+INSERT INTO replenishment_rules (sku, warehouse_id, safety_stock, minimum_order_quantity)
+SELECT 'SKU' || lpad(s::text, {sku_width}, '0'), 'WH' || lpad(w::text, {wh_width}, '0'), 100, 12
+FROM generate_series(1, {num_skus}) s, generate_series(1, {num_warehouses}) w
+ON CONFLICT (sku, warehouse_id) DO NOTHING;
+""")
+
+
+def generate_scaled(start_date, days=1, skus=25, pos=5, warehouses=3, orders_per_day=750,
+                    skew=1.0, seasonality=0.2, seed=42, workers=None, output_dir=RAW_DATA_DIR):
+    """Generate `days` days of orders and stock at the requested scale, one process per POS"""
+    first = datetime.strptime(start_date, '%Y-%m-%d')
+    dates = [(first + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    shares = np.random.default_rng(seed).lognormal(0, 0.5, size=pos)
+    config = {
+        'skus': skus, 'orders_per_day': orders_per_day, 'skew': skew, 'seasonality': seasonality,
+        'seed': seed, 'output_dir': output_dir, 'pos_shares': (shares / shares.sum()).tolist()
+    }
+    pos_ids = _ids('POS', pos)
+    warehouse_ids = _ids('WH', warehouses)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        order_counts = list(executor.map(_generate_pos, [(i, p, dates, config) for i, p in enumerate(pos_ids)]))
+        stock_rows = list(executor.map(_generate_stock,
+                                       [(i, w, dates, config) for i, w in enumerate(warehouse_ids)]))
+
+    for pos_id, count in zip(pos_ids, order_counts):
+        print(f"Generated {count} orders for {pos_id}")
+    print(f"Generated {sum(stock_rows)} stock rows for {warehouses} warehouses")
+    write_master_data_sql(f'{output_dir}/master_data.sql', skus, pos, warehouses)
+    print(f"Master data script: {output_dir}/master_data.sql")
+    return sum(order_counts)
+
+
 if __name__ == '__main__':
-    import sys
-    date_str = sys.argv[1] if len(sys.argv) > 1 else datetime.now().strftime('%Y-%m-%d')
-    print(f"Generating REALISTIC data for {date_str}...")
-    generate_realistic_orders(date_str)
-    generate_realistic_stock(date_str)
+    parser = argparse.ArgumentParser(description='Generate synthetic POS orders and stock snapshots')
+    parser.add_argument('date', nargs='?', default=datetime.now().strftime('%Y-%m-%d'),
+                        help='(First) date to generate (YYYY-MM-DD)')
+    parser.add_argument('--scale', action='store_true', help='Vectorized load-test mode')
+    parser.add_argument('--days', type=int, default=1, help='Number of consecutive days')
+    parser.add_argument('--skus', type=int, default=25)
+    parser.add_argument('--pos', type=int, default=5)
+    parser.add_argument('--warehouses', type=int, default=3)
+    parser.add_argument('--orders-per-day', type=int, default=750, help='Orders per day across all POS')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of SKU popularity (0 = uniform)')
+    parser.add_argument('--seasonality', type=float, default=0.2, help='Weekly demand amplitude (0 = flat)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None, help='Parallel writer processes')
+    parser.add_argument('--output-dir', default=RAW_DATA_DIR)
+    args = parser.parse_args()
+
+    if args.scale:
+        print(f"Generating SCALED data: {args.days} day(s) from {args.date}, {args.orders_per_day} orders/day, "
+              f"{args.skus} SKUs, {args.pos} POS, {args.warehouses} warehouses...")
+        generate_scaled(args.date, args.days, args.skus, args.pos, args.warehouses, args.orders_per_day,
+                        args.skew, args.seasonality, args.seed, args.workers, args.output_dir)
+    else:
+        print(f"Generating REALISTIC data for {args.date}...")
+        generate_realistic_orders(args.date)
+        generate_realistic_stock(args.date)
     print("Done!")
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+WebHDFS Client
+Shared by the scheduler and the pipeline: keep-alive sessions per host,
+parallel uploads and retry with exponential backoff
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configuration
+HDFS_UPLOAD_WORKERS = int(os.getenv('HDFS_UPLOAD_WORKERS', '8'))
+HDFS_MAX_RETRIES = int(os.getenv('HDFS_MAX_RETRIES', '3'))
+HDFS_RETRY_BACKOFF = float(os.getenv('HDFS_RETRY_BACKOFF', '0.5'))
+HDFS_TIMEOUT = int(os.getenv('HDFS_TIMEOUT', '60'))
+HDFS_CHUNK_SIZE = int(os.getenv('HDFS_CHUNK_SIZE', str(1024 * 1024)))
+HDFS_APPEND_THRESHOLD = int(os.getenv('HDFS_APPEND_THRESHOLD', str(128 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+class FileSegment:
+    """File-like view over [offset, offset + length) of an open file, read in bounded chunks"""
+
+    def __init__(self, f, offset, length, chunk_size=HDFS_CHUNK_SIZE):
+        self._f = f
+        self._remaining = length
+        self._length = length
+        self._chunk_size = chunk_size
+        f.seek(offset)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._chunk_size:
+            size = self._chunk_size
+        data = self._f.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+
+class WebHDFSClient:
+    """WebHDFS operations over pooled HTTP sessions"""
+
+    def __init__(self, namenode_url, user=None, max_workers=HDFS_UPLOAD_WORKERS,
+                 max_retries=HDFS_MAX_RETRIES, backoff=HDFS_RETRY_BACKOFF, timeout=HDFS_TIMEOUT,
+                 chunk_size=HDFS_CHUNK_SIZE, append_threshold=HDFS_APPEND_THRESHOLD):
+        self.namenode_url = namenode_url.rstrip('/')
+        self.webhdfs_url = f"{self.namenode_url}/webhdfs/v1"
+        self.user = user
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.append_threshold = append_threshold
+        self._created_dirs = set()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # Optional metrics.RunMetrics recording every request
+        self.metrics = None
+
+    def _session(self, url):
+        """Keep-alive session for the host of url (NameNode or a DataNode)"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+        return session
+
+    def _url(self, path, op, **params):
+        query = f"op={op}"
+        if self.user:
+            query += f"&user.name={self.user}"
+        for key, value in params.items():
+            query += f"&{key}={value}"
+        return f"{self.webhdfs_url}{path}?{query}"
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            return self._session(url).request(method, url, **kwargs)
+        finally:
+            if self.metrics:
+                data = kwargs.get('data')
+                if isinstance(data, str):
+                    data = data.encode()
+                self.metrics.record_call('hdfs', time.perf_counter() - start,
+                                         bytes_written=len(data) if data is not None else 0)
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code >= 500
+        return False
+
+    def _with_retry(self, description, func):
+        """Run func, retrying transient failures with exponential backoff"""
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except requests.RequestException as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(f"  ↻ {description} failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _write(self, method, path, op, data, **params):
+        """Two-step WebHDFS write: NameNode redirect, then send data to the DataNode"""
+        response = self._request(method, self._url(path, op, **params), allow_redirects=False)
+        if response.status_code != 307:
+            response.raise_for_status()
+            raise requests.HTTPError(f"Unexpected status {response.status_code} for {op} {path}",
+                                     response=response)
+        upload_response = self._request(method, response.headers['Location'], data=data)
+        upload_response.raise_for_status()
+
+    def _create(self, path, data):
+        self._write('PUT', path, 'CREATE', data, overwrite='true')
+
+    def list_status(self, path):
+        """FileStatus dicts of the entries of an HDFS directory ([] if it does not exist)"""
+        def _list():
+            response = self._request('GET', self._url(path, 'LISTSTATUS'))
+            if response.status_code == 404:
+                return []
+            response.raise_for_status()
+            return response.json()['FileStatuses']['FileStatus']
+
+        return self._with_retry(f"LISTSTATUS {path}", _list)
+
+    def exists(self, path):
+        def _status():
+            response = self._request('GET', self._url(path, 'GETFILESTATUS'))
+            if response.status_code == 404:
+                return False
+            response.raise_for_status()
+            return True
+
+        return self._with_retry(f"GETFILESTATUS {path}", _status)
+
+    def file_length(self, path):
+        """Current length of an HDFS file in bytes"""
+        response = self._request('GET', self._url(path, 'GETFILESTATUS'))
+        response.raise_for_status()
+        return response.json()['FileStatus']['length']
+
+    def read_file(self, path):
+        """Contents of an HDFS file (OPEN is redirected to a DataNode)"""
+        def _open():
+            response = self._request('GET', self._url(path, 'OPEN'))
+            response.raise_for_status()
+            return response.content
+
+        return self._with_retry(f"OPEN {path}", _open)
+
+    def read_range(self, path, offset, length):
+        """Up to length bytes of an HDFS file starting at offset"""
+        def _open():
+            response = self._request('GET', self._url(path, 'OPEN', offset=offset, length=length))
+            response.raise_for_status()
+            return response.content
+
+        return self._with_retry(f"OPEN {path}@{offset}", _open)
+
+    def rename(self, source, destination):
+        """Atomic NameNode rename of a file or directory, False if HDFS refused it"""
+        def _rename():
+            response = self._request('PUT', self._url(source, 'RENAME', destination=destination))
+            response.raise_for_status()
+            return response.json()['boolean']
+
+        return self._with_retry(f"RENAME {source}", _rename)
+
+    def delete(self, path, recursive=False):
+        def _delete():
+            response = self._request('DELETE', self._url(path, 'DELETE', recursive=str(recursive).lower()))
+            response.raise_for_status()
+            return response.json()['boolean']
+
+        return self._with_retry(f"DELETE {path}", _delete)
+
+    def create_file(self, path, data):
+        """Write file to HDFS (overwrites existing file)"""
+        try:
+            self._with_retry(f"CREATE {path}", lambda: self._create(path, data))
+            return True
+        except Exception as e:
+            logger.error(f"  ✗ Error writing {path}: {e}")
+            return False
+
+    def mkdir(self, path):
+        """Create directory in HDFS (skipped if already created by this client)"""
+        path = path.rstrip('/') or '/'
+        with self._lock:
+            if path in self._created_dirs:
+                return True
+
+        def _mkdirs():
+            response = self._request('PUT', self._url(path, 'MKDIRS'))
+            response.raise_for_status()
+
+        try:
+            self._with_retry(f"MKDIRS {path}", _mkdirs)
+        except Exception as e:
+            logger.error(f"  ✗ Error creating directory {path}: {e}")
+            return False
+
+        # MKDIRS is recursive, so every ancestor now exists too
+        with self._lock:
+            while path not in self._created_dirs and path != '/':
+                self._created_dirs.add(path)
+                path = os.path.dirname(path)
+        return True
+
+    def reset_directory_cache(self):
+        """Forget created directories (call at the start of each run)"""
+        with self._lock:
+            self._created_dirs.clear()
+
+    def _append_segment(self, f, path, offset, length):
+        """APPEND one segment, resuming from whatever a failed attempt already wrote"""
+        written = self.file_length(path)
+        if written >= offset + length:
+            return
+        if written < offset:
+            raise IOError(f"{path} is {written} bytes, expected at least {offset}")
+        segment = FileSegment(f, written, offset + length - written, self.chunk_size)
+        self._write('POST', path, 'APPEND', segment)
+
+    def append_bytes(self, path, data, offset):
+        """APPEND data written at offset of an existing file (a retry skips what already landed)"""
+        def _append():
+            written = self.file_length(path)
+            if written >= offset + len(data):
+                return
+            if written < offset:
+                raise IOError(f"{path} is {written} bytes, expected at least {offset}")
+            self._write('POST', path, 'APPEND', data[written - offset:])
+
+        self._with_retry(f"APPEND {path}@{offset}", _append)
+
+    def upload_file(self, local_path, hdfs_path):
+        """
+        Stream a local file to HDFS in bounded chunks
+        Files above append_threshold are written as CREATE + APPEND segments
+        """
+        try:
+            size = os.path.getsize(local_path)
+            with open(local_path, 'rb') as f:
+                first = min(size, self.append_threshold)
+                self._with_retry(f"CREATE {hdfs_path}",
+                                 lambda: self._create(hdfs_path, FileSegment(f, 0, first, self.chunk_size)))
+                offset = first
+                while offset < size:
+                    length = min(self.append_threshold, size - offset)
+                    self._with_retry(f"APPEND {hdfs_path}@{offset}",
+                                     lambda: self._append_segment(f, hdfs_path, offset, length))
+                    offset += length
+            return True
+        except Exception as e:
+            logger.error(f"  ✗ Error uploading {local_path} to {hdfs_path}: {e}")
+            return False
+
+    def _run_parallel(self, func, items, paths):
+        """Apply func(*item) across the thread pool, returns {hdfs_path: success}"""
+        if not items:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda item: func(*item), items))
+        return dict(zip(paths, results))
+
+    def _mkdir_parents(self, hdfs_paths):
+        for directory in sorted({os.path.dirname(p) for p in hdfs_paths}):
+            self.mkdir(directory)
+
+    def create_files(self, files):
+        """Write many (hdfs_path, data) pairs concurrently, returns {hdfs_path: success}"""
+        paths = [hdfs_path for hdfs_path, _ in files]
+        self._mkdir_parents(paths)
+        return self._run_parallel(self.create_file, files, paths)
+
+    def upload_files(self, files):
+        """Upload many (local_path, hdfs_path) pairs concurrently, returns {hdfs_path: success}"""
+        paths = [hdfs_path for _, hdfs_path in files]
+        self._mkdir_parents(paths)
+        return self._run_parallel(self.upload_file, files, paths)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Master-Data Snapshot Cache
+Keeps products, replenishment rules and the POS mapping as memory-mapped NumPy
+structured arrays, invalidated by one small fingerprint query against PostgreSQL
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from collections.abc import Mapping
+from datetime import datetime
+import numpy as np
+from psycopg2 import errors as pg_errors
+from engines import DATA_DIR
+
+# Configuration
+MASTER_CACHE_DIR = os.getenv('MASTER_CACHE_DIR', f"{DATA_DIR}/cache/master_data")
+MASTER_CACHE_ENABLED = os.getenv('MASTER_CACHE_ENABLED', '1') == '1'
+
+KEY_SEPARATOR = '\x1f'
+FINGERPRINT_TABLES = ('products', 'suppliers', 'replenishment_rules', 'points_of_sale')
+
+PRODUCT_FIELDS = (('sku', str), ('product_name', str), ('supplier_id', str), ('pack_size', int),
+                  ('case_size', int), ('supplier_name', str), ('lead_time_days', int))
+RULE_FIELDS = (('sku', str), ('warehouse_id', str), ('safety_stock', int), ('minimum_order_quantity', int),
+               ('maximum_order_quantity', int), ('reorder_point', int))
+POS_FIELDS = (('pos_id', str), ('warehouse_id', str))
+
+# Integer NULLs are stored as -1
+NULL_INT = -1
+
+
+class ArrayMapping(Mapping):
+    """
+    Read-only {key: row dict} view over a structured array sorted by its 'key' field
+    Rows are only turned into dicts when looked up
+    """
+
+    def __init__(self, array, key_fields, value_field=None):
+        self.array = array
+        self.key_fields = key_fields
+        self.value_field = value_field
+
+    def _encode(self, key):
+        return KEY_SEPARATOR.join(key) if isinstance(key, tuple) else key
+
+    def _decode(self, key):
+        return tuple(key.split(KEY_SEPARATOR)) if len(self.key_fields) > 1 else key
+
+    def positions(self, keys):
+        """Row index for each key, -1 where missing (vectorized)"""
+        keys = np.asarray([self._encode(k) for k in keys] if len(self.key_fields) > 1 else keys)
+        stored = self.array['key']
+        if len(stored) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        idx = np.searchsorted(stored, keys)
+        idx = np.minimum(idx, len(stored) - 1)
+        return np.where(stored[idx] == keys, idx, -1)
+
+    def column(self, name):
+        return self.array[name]
+
+    def _row(self, i):
+        row = self.array[i]
+        if self.value_field:
+            return str(row[self.value_field])
+        result = {}
+        for name in self.array.dtype.names:
+            if name == 'key':
+                continue
+            value = row[name].item()
+            result[name] = None if isinstance(value, int) and value == NULL_INT else value
+        return result
+
+    def __getitem__(self, key):
+        i = self.positions([key])[0]
+        if i < 0:
+            raise KeyError(key)
+        return self._row(i)
+
+    def __contains__(self, key):
+        return self.positions([key])[0] >= 0
+
+    def __iter__(self):
+        for key in self.array['key']:
+            yield self._decode(str(key))
+
+    def __len__(self):
+        return len(self.array)
+
+
+def _to_array(rows, fields, key_fields):
+    """Structured array with a sorted 'key' column from a list of row dicts"""
+    keys = [KEY_SEPARATOR.join(str(row[f]) for f in key_fields) for row in rows]
+    dtype = [('key', f"U{max([len(k) for k in keys] + [1])}")]
+    for name, kind in fields:
+        if kind is str:
+            width = max([len(str(row[name] or '')) for row in rows] + [1])
+            dtype.append((name, f"U{width}"))
+        else:
+            dtype.append((name, np.int64))
+    array = np.empty(len(rows), dtype=dtype)
+    array['key'] = keys
+    for name, kind in fields:
+        if kind is str:
+            array[name] = [str(row[name] or '') for row in rows]
+        else:
+            array[name] = [NULL_INT if row[name] is None else row[name] for row in rows]
+    return np.sort(array, order='key')
+
+
+class MasterDataCache:
+    """Snapshot directory per fingerprint: products.npy, rules.npy, pos.npy, meta.json"""
+
+    def __init__(self, cache_dir=MASTER_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def fingerprint(self, db_conn):
+        """
+        Row count and max created_at per master table plus the insert/update/delete counters
+        PostgreSQL keeps in pg_stat_user_tables, in one query (the tables have no updated_at, so
+        in-place updates are only visible through the counters)
+        """
+        tables = list(FINGERPRINT_TABLES)
+        cursor = db_conn.cursor()
+        try:
+            while True:
+                parts = [f"(SELECT COUNT(*) || ':' || COALESCE(MAX(created_at)::text, '') FROM {table})"
+                         for table in tables]
+                try:
+                    cursor.execute(f"""
+                        SELECT {', '.join(parts)},
+                               (SELECT string_agg(relname || ':' || n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del,
+                                                  ',' ORDER BY relname)
+                                FROM pg_stat_user_tables WHERE relname = ANY(%s))
+                    """, (tables,))
+                    values = cursor.fetchone()
+                    break
+                except pg_errors.UndefinedTable:
+                    # Older schemas have no points_of_sale table
+                    db_conn.rollback()
+                    if 'points_of_sale' not in tables:
+                        raise
+                    tables.remove('points_of_sale')
+        finally:
+            cursor.close()
+        raw = json.dumps(dict(zip(tables + ['changes'], values)), sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+    def _snapshot_dir(self, fingerprint):
+        return f"{self.cache_dir}/{fingerprint}"
+
+    def load(self, fingerprint):
+        """(products, rules, pos_warehouses) mappings, or None if no snapshot matches"""
+        path = self._snapshot_dir(fingerprint)
+        if not os.path.exists(f"{path}/meta.json"):
+            return None
+        products = np.load(f"{path}/products.npy", mmap_mode='r')
+        rules = np.load(f"{path}/rules.npy", mmap_mode='r')
+        pos = np.load(f"{path}/pos.npy", mmap_mode='r')
+        return (ArrayMapping(products, ('sku',)),
+                ArrayMapping(rules, ('sku', 'warehouse_id')),
+                ArrayMapping(pos, ('pos_id',), value_field='warehouse_id'))
+
+    def save(self, fingerprint, products, rules, pos_warehouses):
+        """Write a new snapshot (meta.json last, so partial snapshots are never loaded) and prune old ones"""
+        path = self._snapshot_dir(fingerprint)
+        os.makedirs(path, exist_ok=True)
+        np.save(f"{path}/products.npy", _to_array(list(products.values()), PRODUCT_FIELDS, ('sku',)))
+        np.save(f"{path}/rules.npy", _to_array(list(rules.values()), RULE_FIELDS, ('sku', 'warehouse_id')))
+        pos_rows = [{'pos_id': pos_id, 'warehouse_id': wh} for pos_id, wh in pos_warehouses.items()]
+        np.save(f"{path}/pos.npy", _to_array(pos_rows, POS_FIELDS, ('pos_id',)))
+        with open(f"{path}/meta.json", 'w') as f:
+            json.dump({
+                'fingerprint': fingerprint,
+                'created_at': datetime.now().isoformat(),
+                'products': len(products),
+                'rules': len(rules),
+                'points_of_sale': len(pos_warehouses)
+            }, f)
+
+        for name in os.listdir(self.cache_dir):
+            if name != fingerprint:
+                shutil.rmtree(f"{self.cache_dir}/{name}", ignore_errors=True)
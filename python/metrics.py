@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Run Metrics
+Per-stage wall time, rows in/out, bytes read/written and HDFS/Trino call counts
+and latencies for pipeline and scheduler runs. Every run is written as a JSON
+record, appended to history.ndjson and exported as a Prometheus textfile
+"""
+
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from engines import DATA_DIR
+
+# Configuration
+METRICS_DIR = os.getenv('METRICS_DIR', f"{DATA_DIR}/metrics")
+PROMETHEUS_TEXTFILE_DIR = os.getenv('PROMETHEUS_TEXTFILE_DIR', f"{METRICS_DIR}/prometheus")
+
+COUNTERS = ('rows_in', 'rows_out', 'bytes_read', 'bytes_written')
+
+# history.ndjson is appended to by concurrent backfill runs
+_history_lock = threading.Lock()
+
+
+def _new_stage():
+    stage = {'wall_s': 0.0, 'status': 'ok', 'calls': {}}
+    stage.update({counter: 0 for counter in COUNTERS})
+    return stage
+
+
+class RunMetrics:
+    """Metrics of one run (component = 'pipeline', 'scheduler', ...), grouped by stage"""
+
+    def __init__(self, component, date_str, metrics_dir=METRICS_DIR, textfile_dir=PROMETHEUS_TEXTFILE_DIR):
+        self.component = component
+        self.date_str = date_str
+        self.metrics_dir = metrics_dir
+        self.textfile_dir = textfile_dir
+        self.run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.stages = {}
+        # Stages run concurrently (stage_graph): each thread has its own current stage, threads
+        # outside any stage (e.g. upload pools) are attributed to the latest stage still running
+        self._local = threading.local()
+        self._active = []
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = _new_stage()
+        return self.stages[name]
+
+    @property
+    def current(self):
+        stage = getattr(self._local, 'stage', None)
+        if stage is None and self._active:
+            stage = self._active[-1]
+        return stage
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage; calls and counters recorded meanwhile by this thread (or its helper pools) belong to it"""
+        previous = getattr(self._local, 'stage', None)
+        self._local.stage = name
+        with self._lock:
+            stage = self._stage(name)
+            self._active.append(name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        except Exception:
+            stage['status'] = 'error'
+            raise
+        finally:
+            stage['wall_s'] += time.perf_counter() - start
+            self._local.stage = previous
+            with self._lock:
+                self._active.remove(name)
+
+    def add(self, stage=None, **counters):
+        """Add to rows_in / rows_out / bytes_read / bytes_written of a stage (default: current)"""
+        with self._lock:
+            target = self._stage(stage or self.current or 'other')
+            for name, value in counters.items():
+                target[name] += value or 0
+
+    def fail(self, stage=None, status='error'):
+        """Mark a stage as failed ('error', 'timeout' or 'skipped' after a failed dependency)"""
+        with self._lock:
+            self._stage(stage or self.current or 'other')['status'] = status
+
+    def skip(self, stage=None):
+        """The stage's output was restored from a checkpoint instead of recomputed"""
+        with self._lock:
+            self._stage(stage or self.current or 'other')['status'] = 'resumed'
+
+    def record_call(self, kind, seconds, **counters):
+        """One HDFS / Trino / ... request and its latency, attributed to the current stage"""
+        with self._lock:
+            target = self._stage(self.current or 'other')
+            calls = target['calls'].setdefault(kind, {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+            calls['count'] += 1
+            calls['total_s'] += seconds
+            calls['max_s'] = max(calls['max_s'], seconds)
+            for name, value in counters.items():
+                target[name] += value or 0
+
+    def to_dict(self, status):
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage, wall_s=round(stage['wall_s'], 6), calls={
+                kind: {'count': c['count'], 'total_s': round(c['total_s'], 6), 'max_s': round(c['max_s'], 6)}
+                for kind, c in stage['calls'].items()
+            })
+        return {
+            'run_id': self.run_id,
+            'component': self.component,
+            'date': self.date_str,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': datetime.now().isoformat(),
+            'duration_s': round(time.perf_counter() - self._start, 6),
+            'status': status,
+            'stages': stages
+        }
+
+    def _prometheus(self, record):
+        labels = f'component="{self.component}"'
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP procurement_{name} {help_text}")
+            lines.append(f"# TYPE procurement_{name} gauge")
+            for extra, value in samples:
+                lines.append(f"procurement_{name}{{{labels}{extra}}} {value}")
+
+        metric('run_duration_seconds', 'Wall time of the last run', [('', record['duration_s'])])
+        metric('run_success', '1 if the last run succeeded', [('', int(record['status'] == 'ok'))])
+        metric('run_timestamp_seconds', 'Unix time the last run finished', [('', int(time.time()))])
+        stages = record['stages'].items()
+        metric('stage_duration_seconds', 'Wall time per stage of the last run',
+               [(f',stage="{name}"', s['wall_s']) for name, s in stages])
+        for counter in COUNTERS:
+            metric(f'stage_{counter}', f'{counter} per stage of the last run',
+                   [(f',stage="{name}"', s[counter]) for name, s in stages])
+        metric('stage_calls', 'External calls per stage of the last run',
+               [(f',stage="{name}",kind="{kind}"', c['count']) for name, s in stages for kind, c in s['calls'].items()])
+        metric('stage_call_seconds', 'Total latency of external calls per stage of the last run',
+               [(f',stage="{name}",kind="{kind}"', c['total_s']) for name, s in stages
+                for kind, c in s['calls'].items()])
+        return '\n'.join(lines) + '\n'
+
+    def finish(self, status='ok'):
+        """Write the run record, history line and Prometheus textfile; returns the record"""
+        record = self.to_dict(status)
+        try:
+            run_dir = f"{self.metrics_dir}/runs/{self.date_str}"
+            os.makedirs(run_dir, exist_ok=True)
+            with open(f"{run_dir}/{self.component}_{self.run_id}.json", 'w') as f:
+                json.dump(record, f, indent=2)
+
+            with _history_lock:
+                with open(f"{self.metrics_dir}/history.ndjson", 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+            # Written under a temp name and renamed, as the textfile collector requires
+            os.makedirs(self.textfile_dir, exist_ok=True)
+            prom_path = f"{self.textfile_dir}/procurement_{self.component}.prom"
+            with open(f"{prom_path}.{self.run_id}.tmp", 'w') as f:
+                f.write(self._prometheus(record))
+            os.replace(f"{prom_path}.{self.run_id}.tmp", prom_path)
+        except Exception as e:
+            print(f"⚠ Could not write run metrics: {e}")
+        return record
+
+
+class InstrumentedCursor:
+    """DB-API cursor proxy recording executes as `kind` calls and fetches as `kind`_fetch calls"""
+
+    def __init__(self, cursor, metrics, kind='trino'):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._kind = kind
+
+    def _timed(self, kind, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._metrics.record_call(kind, time.perf_counter() - start)
+
+    def execute(self, *args):
+        return self._timed(self._kind, self._cursor.execute, *args)
+
+    def _fetched(self, rows):
+        # Trino reports the bytes scanned by the query once its results are consumed
+        stats = getattr(self._cursor, 'stats', None)
+        processed = stats.get('processedBytes', 0) if isinstance(stats, dict) else 0
+        if processed:
+            self._metrics.add(bytes_read=processed)
+        return rows
+
+    def fetchone(self):
+        return self._fetched(self._timed(f"{self._kind}_fetch", self._cursor.fetchone))
+
+    def fetchall(self):
+        return self._fetched(self._timed(f"{self._kind}_fetch", self._cursor.fetchall))
+
+    def fetchmany(self, size=None):
+        size = size or self._cursor.arraysize
+        rows = self._timed(f"{self._kind}_fetch", self._cursor.fetchmany, size)
+        # Scanned bytes are final once the last (short) batch is read
+        return self._fetched(rows) if len(rows) < size else rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def load_history(metrics_dir=METRICS_DIR, component=None, since=None):
+    """Run records from history.ndjson, optionally filtered by component and date (>= since)"""
+    path = f"{metrics_dir}/history.ndjson"
+    if not os.path.exists(path):
+        return []
+    runs = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            run = json.loads(line)
+            if component and run['component'] != component:
+                continue
+            if since and run['date'] < since:
+                continue
+            runs.append(run)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show stage timings from the run history')
+    parser.add_argument('--component', default='pipeline', help='pipeline, scheduler, ...')
+    parser.add_argument('--since', help='Only runs for dates on or after this one (YYYY-MM-DD)')
+    parser.add_argument('--last', type=int, default=10, help='Number of most recent runs to show')
+    parser.add_argument('--stage', help='Show rows and calls for this stage only')
+    args = parser.parse_args()
+
+    runs = load_history(component=args.component, since=args.since)[-args.last:]
+    if not runs:
+        print(f"No {args.component} runs recorded in {METRICS_DIR}/history.ndjson")
+        return
+
+    if args.stage:
+        print(f"{'date':<12} {'started':<20} {'wall_s':>9} {'rows_in':>10} {'rows_out':>10} calls")
+        for run in runs:
+            stage = run['stages'].get(args.stage)
+            if not stage:
+                continue
+            calls = ', '.join(f"{kind}={c['count']} ({c['total_s']:.2f}s)" for kind, c in stage['calls'].items())
+            print(f"{run['date']:<12} {run['started_at'][:19]:<20} {stage['wall_s']:>9.2f} "
+                  f"{stage['rows_in']:>10} {stage['rows_out']:>10} {calls}")
+        return
+
+    stages = []
+    for run in runs:
+        stages.extend(name for name in run['stages'] if name not in stages)
+    print(f"{'date':<12} {'status':<7} {'total_s':>8} " + ' '.join(f"{name[:14]:>14}" for name in stages))
+    for run in runs:
+        print(f"{run['date']:<12} {run['status']:<7} {run['duration_s']:>8.2f} " +
+              ' '.join(f"{run['stages'][name]['wall_s']:>14.2f}" if name in run['stages'] else f"{'-':>14}"
+                       for name in stages))
+
+
+if __name__ == '__main__':
+    main()
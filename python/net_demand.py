@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Vectorized Net-Demand Engine
+Builds dense SKU × warehouse arrays from stock, orders and replenishment rules
+and applies safety stock, reorder point, case rounding, MOQ and max order
+quantity as NumPy operations
+"""
+
+import os
+import numpy as np
+
+DEFAULT_WAREHOUSE = os.getenv('DEFAULT_WAREHOUSE', 'WH001')
+DEFAULT_SAFETY_STOCK = 50
+SPIKE_FACTOR = 5
+
+
+def _index(keys):
+    """Sorted key list and {key: position}"""
+    keys = sorted(keys)
+    return keys, {key: i for i, key in enumerate(keys)}
+
+
+def _lookup(axis, values):
+    """Position of each value on a sorted axis array, -1 where absent"""
+    if len(axis) == 0 or len(values) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    idx = np.minimum(np.searchsorted(axis, values), len(axis) - 1)
+    return np.where(axis[idx] == values, idx, -1)
+
+
+class NetDemandEngine:
+    """
+    Per-warehouse net demand:
+        net_demand = max(0, orders + safety_stock - (available - reserved))
+    where orders are attributed to the warehouse serving each POS
+
+    products / rules / pos_warehouses are plain dicts or the memory-mapped
+    master_cache.ArrayMapping views, whose columns are used without building dicts
+    """
+
+    def __init__(self, products, rules, pos_warehouses, default_warehouse=DEFAULT_WAREHOUSE):
+        self.products = products
+        self.rules = rules
+        self.pos_warehouses = pos_warehouses
+        self.default_warehouse = default_warehouse
+
+    def _rule_columns(self):
+        """(sku, warehouse_id, safety_stock, moq, max_order_quantity, reorder_point) arrays, -1 = not set"""
+        if hasattr(self.rules, 'column'):
+            column = self.rules.column
+            moq = column('minimum_order_quantity')
+            return (column('sku'), column('warehouse_id'), column('safety_stock'),
+                    np.where(moq > 0, moq, 1), column('maximum_order_quantity'), column('reorder_point'))
+
+        keys = list(self.rules.keys())
+        rows = list(self.rules.values())
+        unset = lambda value: -1 if value is None else value
+        return (np.array([sku for sku, _ in keys], dtype=str),
+                np.array([wh for _, wh in keys], dtype=str),
+                np.array([r['safety_stock'] for r in rows], dtype=np.int64),
+                np.array([r['minimum_order_quantity'] or 1 for r in rows], dtype=np.int64),
+                np.array([unset(r.get('maximum_order_quantity')) for r in rows], dtype=np.int64),
+                np.array([unset(r.get('reorder_point')) for r in rows], dtype=np.int64))
+
+    def _product_columns(self, skus):
+        """(known, case_size) per SKU on the axis"""
+        if hasattr(self.products, 'positions'):
+            positions = self.products.positions(skus)
+            known = positions >= 0
+            if len(self.products):
+                case_size = np.where(known, self.products.column('case_size')[np.maximum(positions, 0)], 1)
+            else:
+                case_size = np.ones(len(skus), dtype=np.int64)
+        else:
+            known = np.array([sku in self.products for sku in skus], dtype=bool)
+            case_size = np.array([self.products[sku]['case_size'] or 1 if sku in self.products else 1
+                                  for sku in skus], dtype=np.int64)
+        return known, np.maximum(case_size, 1).astype(np.int64)
+
+    @staticmethod
+    def _scatter(shape, rows, cols, values, dtype, fill=0, accumulate=False):
+        """Dense array from (row, col, value) columns"""
+        array = np.full(shape, fill, dtype=dtype)
+        if len(rows):
+            if accumulate:
+                np.add.at(array, (rows, cols), np.asarray(values, dtype=dtype))
+            else:
+                array[rows, cols] = values
+        return array
+
+    def compute(self, orders, stock):
+        """
+        orders: {(sku, pos_id): quantity}
+        stock: {(sku, warehouse_id): {'available', 'reserved', 'safety_stock'}}
+        Returns (net_demand {(sku, warehouse_id): item}, exceptions, top calculations)
+        """
+        rule_sku, rule_wh, rule_safety_col, moq_col, max_oq_col, reorder_col = self._rule_columns()
+
+        # SKU and warehouse axes covering every input
+        order_wh = {(sku, pos): self.pos_warehouses.get(pos, self.default_warehouse) for sku, pos in orders}
+        skus, sku_pos = _index({sku for sku, _ in orders} | {sku for sku, _ in stock})
+        warehouses, wh_pos = _index({wh for _, wh in stock} | set(order_wh.values()) |
+                                    set(np.unique(rule_wh).tolist()))
+        sku_axis = np.array(skus, dtype=str)
+        wh_axis = np.array(warehouses, dtype=str)
+        shape = (len(skus), len(warehouses))
+        exceptions = []
+
+        # Orders → warehouse serving the POS
+        order_rows = np.array([sku_pos[sku] for sku, _ in orders], dtype=np.int64)
+        order_cols = np.array([wh_pos[order_wh[key]] for key in orders], dtype=np.int64)
+        demand = self._scatter(shape, order_rows, order_cols, list(orders.values()), np.int64, accumulate=True)
+
+        # Stock snapshot
+        stock_rows = np.array([sku_pos[sku] for sku, _ in stock], dtype=np.int64)
+        stock_cols = np.array([wh_pos[wh] for _, wh in stock], dtype=np.int64)
+        levels = list(stock.values())
+        has_stock = self._scatter(shape, stock_rows, stock_cols, True, bool, fill=False)
+        available = self._scatter(shape, stock_rows, stock_cols, [s['available'] or 0 for s in levels], np.int64)
+        reserved = self._scatter(shape, stock_rows, stock_cols, [s['reserved'] or 0 for s in levels], np.int64)
+        stock_safety = self._scatter(shape, stock_rows, stock_cols,
+                                     [s['safety_stock'] or 0 for s in levels], np.int64)
+
+        # Replenishment rules on the axes (-1 = not set)
+        rule_rows = _lookup(sku_axis, rule_sku)
+        rule_cols = _lookup(wh_axis, rule_wh)
+        keep = (rule_rows >= 0) & (rule_cols >= 0)
+        rule_rows, rule_cols = rule_rows[keep], rule_cols[keep]
+        has_rule = self._scatter(shape, rule_rows, rule_cols, True, bool, fill=False)
+        rule_safety = self._scatter(shape, rule_rows, rule_cols, rule_safety_col[keep], np.int64)
+        moq = self._scatter(shape, rule_rows, rule_cols, moq_col[keep], np.int64, fill=1)
+        max_oq = self._scatter(shape, rule_rows, rule_cols, max_oq_col[keep], np.int64, fill=-1)
+        reorder_point = self._scatter(shape, rule_rows, rule_cols, reorder_col[keep], np.int64, fill=-1)
+
+        # Product master data per SKU
+        known, case_size = self._product_columns(sku_axis)
+        case_size = case_size[:, None]
+        for sku in sku_axis[~known].tolist():
+            exceptions.append({
+                'type': 'missing_product',
+                'sku': sku,
+                'message': f'SKU {sku} not in product catalog'
+            })
+
+        # Net demand per cell with orders or stock
+        active = (has_stock | (demand > 0)) & known[:, None]
+        safety = np.where(has_stock, stock_safety, np.where(has_rule, rule_safety, DEFAULT_SAFETY_STOCK))
+        available_stock = available - reserved
+        required = demand + safety
+        net = np.maximum(0, required - available_stock)
+
+        # Only order when the projected position has fallen to the reorder point
+        position = available_stock - demand
+        net = np.where((reorder_point >= 0) & (position > reorder_point), 0, net)
+        net = np.where(active, net, 0)
+
+        rounded = -(-net // case_size) * case_size
+        final = np.maximum(rounded, moq)
+        final = np.where(max_oq > 0, np.minimum(final, max_oq), final)
+
+        spikes = np.argwhere(active & (net > safety * SPIKE_FACTOR))
+        for i, j in spikes:
+            exceptions.append({
+                'type': 'demand_spike',
+                'sku': skus[i],
+                'warehouse_id': warehouses[j],
+                'net_demand': int(net[i, j]),
+                'safety_stock': int(safety[i, j])
+            })
+
+        net_demand = {}
+        for i, j in np.argwhere(net > 0):
+            sku = skus[i]
+            product = self.products[sku]
+            net_demand[(sku, warehouses[j])] = {
+                'sku': sku,
+                'warehouse_id': warehouses[j],
+                'product_name': product['product_name'],
+                'supplier_id': product['supplier_id'],
+                'historical_orders': int(demand[i, j]),
+                'current_stock': int(available_stock[i, j]),
+                'safety_stock': int(safety[i, j]),
+                'raw_demand': int(net[i, j]),
+                'rounded_demand': int(rounded[i, j]),
+                'final_quantity': int(final[i, j]),
+                'case_size': int(case_size[i, 0]),
+                'moq': int(moq[i, j]),
+                'max_order_quantity': int(max_oq[i, j]) if max_oq[i, j] > 0 else None
+            }
+
+        # Top calculations for the run log
+        flat = np.flatnonzero(active)
+        top = flat[np.argsort(-net.ravel()[flat], kind='stable')[:5]]
+        details = []
+        for i, j in zip(*np.unravel_index(top, shape)):
+            details.append({
+                'sku': skus[i],
+                'warehouse_id': warehouses[j],
+                'total_orders': int(demand[i, j]),
+                'available_stock': int(available_stock[i, j]),
+                'safety_stock': int(safety[i, j]),
+                'net_demand': int(net[i, j])
+            })
+
+        return net_demand, exceptions, details
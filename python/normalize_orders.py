@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Streaming Raw-Order Normalizer
+Rewrites data/raw/orders/<date>/*.json (JSON arrays, pretty-printed or NDJSON)
+as newline-delimited JSON in bounded memory, validating every record and routing
+bad ones (and order_ids already ingested, see dedup_index.py) to a quarantine file
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime
+from collections import Counter
+from engines import DATA_DIR
+from dedup_index import OrderIdIndex
+
+# Configuration
+RAW_ORDERS_DIR = f"{DATA_DIR}/raw/orders"
+QUARANTINE_DIR = f"{DATA_DIR}/quarantine/orders"
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_BYTES = int(os.getenv('MAX_RECORD_BYTES', str(1024 * 1024)))
+
+_decoder = json.JSONDecoder()
+
+
+def _first_char(f):
+    """First non-whitespace character of a text file, leaving the position unchanged"""
+    start = f.tell()
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        stripped = chunk.lstrip()
+        if stripped or not chunk:
+            f.seek(start)
+            return stripped[:1]
+
+
+def _iter_array(f, chunk_size):
+    """Stream the elements of a top-level JSON array; stops at the first unreadable element"""
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        # Skip separators between records: whitespace, array brackets and commas
+        i = 0
+        while i < len(buffer) and buffer[i] in ' \t\r\n,[]':
+            i += 1
+        buffer = buffer[i:]
+
+        if buffer:
+            try:
+                record, end = _decoder.raw_decode(buffer)
+            except json.JSONDecodeError as e:
+                # Either the record is incomplete (read more) or it is broken
+                if eof or len(buffer) > MAX_RECORD_BYTES:
+                    yield position, None, f"malformed element: {e.msg}"
+                    return
+            else:
+                yield position, record, None
+                position += 1
+                buffer = buffer[end:]
+                continue
+        elif eof:
+            return
+
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+
+def _iter_lines(f):
+    """Stream newline-delimited JSON; a broken line only loses that line"""
+    position = 0
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield position, json.loads(line), None
+        except json.JSONDecodeError as e:
+            yield position, None, f"malformed line: {e.msg}"
+        position += 1
+
+
+def iter_json_records(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield (position, record, error) for every record of a JSON array or NDJSON file
+    Only one record plus one chunk is buffered at a time
+    """
+    if _first_char(f) == '[':
+        return _iter_array(f, chunk_size)
+    return _iter_lines(f)
+
+
+def _is_date(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_order(record, date_str, known_skus=None):
+    """Return None if the order is valid, otherwise the rejection reason"""
+    if not isinstance(record, dict):
+        return 'not_an_object'
+    for field in ('order_id', 'pos_id', 'sku'):
+        if not isinstance(record.get(field), str) or not record[field]:
+            return f'invalid_{field}'
+    quantity = record.get('quantity')
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+        return 'invalid_quantity'
+    if not _is_date(record.get('order_date')):
+        return 'invalid_order_date'
+    if record['order_date'] != date_str:
+        return 'date_mismatch'
+    if known_skus is not None and record['sku'] not in known_skus:
+        return 'unknown_sku'
+    return None
+
+
+def normalize_file(path, date_str, known_skus=None, quarantine=None, dedup=None):
+    """
+    Rewrite one order file as validated, de-duplicated NDJSON (atomically, via a temp file)
+    Rejected records are appended to the open quarantine file; returns a Counter of outcomes
+    """
+    stats = Counter()
+    filename = os.path.basename(path)
+    tmp_path = f"{path}.normalizing"
+
+    def reject(position, reason, record):
+        stats[reason] += 1
+        if quarantine:
+            quarantine.write(json.dumps({'file': filename, 'record': position,
+                                         'reason': reason, 'data': record}) + '\n')
+
+    with open(path) as src, open(tmp_path, 'w') as dst:
+        for position, record, error in iter_json_records(src):
+            if error:
+                reject(position, 'malformed_json', error)
+                continue
+            reason = validate_order(record, date_str, known_skus)
+            if reason:
+                reject(position, reason, record)
+                continue
+            if dedup is not None and dedup.is_duplicate(record['order_id'], date_str, filename):
+                reject(position, 'duplicate_order_id', record)
+                continue
+            dst.write(json.dumps(record) + '\n')
+            stats['valid'] += 1
+
+    os.replace(tmp_path, path)
+    return stats
+
+
+def normalize_day(date_str, known_skus=None, dedup=None, orders_dir=RAW_ORDERS_DIR,
+                  quarantine_dir=QUARANTINE_DIR, filenames=None):
+    """
+    Normalize every order file for date_str, or only `filenames` (a micro-batch, merged into the
+    day's existing report); returns the report dict (also written to report.json)
+    New order_ids are committed to the dedup index only after all files were rewritten
+    """
+    day_dir = f"{orders_dir}/{date_str}"
+    report = {'date': date_str, 'files': {}, 'totals': Counter()}
+    if not os.path.isdir(day_dir):
+        return report
+
+    quarantine_day = f"{quarantine_dir}/{date_str}"
+    os.makedirs(quarantine_day, exist_ok=True)
+    quarantine_path = f"{quarantine_day}/rejected.ndjson"
+    report_path = f"{quarantine_day}/report.json"
+
+    if filenames is None:
+        filenames = [name for name in os.listdir(day_dir) if name.endswith('.json')]
+    elif os.path.exists(report_path):
+        with open(report_path) as f:
+            report['files'] = json.load(f).get('files', {})
+
+    with open(quarantine_path, 'a' if report['files'] else 'w') as quarantine:
+        for filename in sorted(filenames):
+            stats = normalize_file(f"{day_dir}/{filename}", date_str, known_skus, quarantine, dedup)
+            report['files'][filename] = dict(stats)
+
+    if dedup is not None:
+        report['new_order_ids'] = dedup.commit()
+    for stats in report['files'].values():
+        report['totals'].update(stats)
+    report['totals'] = dict(report['totals'])
+    report['rejected'] = sum(v for k, v in report['totals'].items() if k != 'valid')
+    if os.path.getsize(quarantine_path) == 0:
+        os.remove(quarantine_path)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def load_known_skus(db_conn=None):
+    """Active SKUs from PostgreSQL (over db_conn if given), or None if the database is unreachable"""
+    try:
+        conn = db_conn
+        if conn is None:
+            import psycopg2
+            conn = psycopg2.connect(
+                host=os.getenv('POSTGRES_HOST', 'postgres'),
+                port=os.getenv('POSTGRES_PORT', '5432'),
+                database=os.getenv('POSTGRES_DB', 'procurement'),
+                user=os.getenv('POSTGRES_USER', 'admin'),
+                password=os.getenv('POSTGRES_PASSWORD', 'admin123')
+            )
+        cursor = conn.cursor()
+        cursor.execute("SELECT sku FROM products WHERE active = TRUE")
+        skus = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        if db_conn is None:
+            conn.close()
+        else:
+            conn.rollback()
+        return skus
+    except Exception as e:
+        print(f"⚠ Could not load known SKUs, skipping SKU validation: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize raw POS order files to validated NDJSON')
+    parser.add_argument('--date', type=str,
+                        default=datetime.now().strftime('%Y-%m-%d'),
+                        help='Date to normalize (YYYY-MM-DD)')
+    parser.add_argument('--skip-sku-check', action='store_true',
+                        help='Do not validate SKUs against the product catalog')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Do not drop order_ids already ingested on another day or from another file')
+    args = parser.parse_args()
+
+    known_skus = None if args.skip_sku_check else load_known_skus()
+    dedup = None if args.no_dedup else OrderIdIndex()
+    report = normalize_day(args.date, known_skus, dedup)
+    print(f"Normalized {len(report['files'])} files for {args.date}: "
+          f"{report['totals'].get('valid', 0)} valid, {report.get('rejected', 0)} quarantined")
+    for reason, count in sorted(report['totals'].items()):
+        if reason != 'valid':
+            print(f"  ✗ {reason}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Supplier Order Output Writer
+Serializes each supplier order document once (compact JSON, optionally gzip or
+zstd compressed) for both the local copy and HDFS, and writes one consolidated
+line-item file (NDJSON or Parquet) plus a manifest per date. The manifest keeps
+a content hash per document, so re-runs only publish what actually changed
+"""
+
+import os
+import io
+import gzip
+import json
+import hashlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configuration
+SUPPLIER_ORDER_FORMAT = os.getenv('SUPPLIER_ORDER_FORMAT', 'json')
+LINE_ITEMS_FORMAT = os.getenv('LINE_ITEMS_FORMAT', 'ndjson')
+# Per-supplier documents can be kept local only, leaving one line-item file per day on HDFS
+SUPPLIER_DOCUMENTS_TO_HDFS = os.getenv('SUPPLIER_DOCUMENTS_TO_HDFS', '1') == '1'
+# Skip rewriting and re-uploading documents whose content is unchanged since the last run of the date
+SUPPLIER_ORDERS_INCREMENTAL = os.getenv('SUPPLIER_ORDERS_INCREMENTAL', '1') == '1'
+
+# format -> (file extension, compression)
+DOCUMENT_FORMATS = {
+    'json': ('.json', None),
+    'json-pretty': ('.json', None),
+    'json.gz': ('.json.gz', 'gzip'),
+    'json.zst': ('.json.zst', 'zstd'),
+}
+# format -> (file name, compression)
+LINE_ITEM_FORMATS = {
+    'ndjson': ('line_items.ndjson', None),
+    'ndjson.gz': ('line_items.ndjson.gz', 'gzip'),
+    'ndjson.zst': ('line_items.ndjson.zst', 'zstd'),
+    'parquet': ('line_items.parquet', None),
+}
+MANIFEST_NAME = '_manifest.json'
+
+
+def compress(data, compression):
+    """Deterministic bytes for a compression (gzip without a timestamp), so retries write identical files"""
+    if compression == 'gzip':
+        return gzip.compress(data, mtime=0)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def content_hash(document):
+    """Canonical hash of a document's content, ignoring when it was generated"""
+    content = {key: value for key, value in document.items() if key != 'generated_at'}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _same_content(manifest, other):
+    """Whether two manifests list the same files, whenever they were generated"""
+    strip = lambda m: {key: value for key, value in m.items() if key != 'generated_at'}
+    return other is not None and strip(manifest) == strip(other)
+
+
+def _require(feature, setting):
+    if feature == 'zstd' and zstandard is None:
+        raise ValueError(f"{setting} needs the zstandard package")
+    if feature == 'parquet':
+        try:
+            import pyarrow  # noqa: F401 (pandas' default Parquet engine)
+        except ImportError:
+            raise ValueError(f"{setting} needs the pyarrow package")
+
+
+class SupplierOrderWriter:
+    """Writes a day's supplier order documents, line items and manifest locally and to HDFS"""
+
+    def __init__(self, date_str, local_dir, hdfs_dir, hdfs, document_format=SUPPLIER_ORDER_FORMAT,
+                 line_items_format=LINE_ITEMS_FORMAT, documents_to_hdfs=SUPPLIER_DOCUMENTS_TO_HDFS,
+                 incremental=SUPPLIER_ORDERS_INCREMENTAL):
+        if document_format not in DOCUMENT_FORMATS:
+            raise ValueError(f"Unknown supplier order format {document_format}")
+        if line_items_format not in LINE_ITEM_FORMATS:
+            raise ValueError(f"Unknown line item format {line_items_format}")
+        self.extension, self.compression = DOCUMENT_FORMATS[document_format]
+        _require(self.compression, f"SUPPLIER_ORDER_FORMAT={document_format}")
+        self.line_items_name, self.line_items_compression = LINE_ITEM_FORMATS[line_items_format]
+        _require('parquet' if line_items_format == 'parquet' else self.line_items_compression,
+                           f"LINE_ITEMS_FORMAT={line_items_format}")
+        self.date_str = date_str
+        self.local_dir = local_dir
+        self.hdfs_dir = hdfs_dir
+        self.hdfs = hdfs
+        self.document_format = document_format
+        self.line_items_format = line_items_format
+        self.documents_to_hdfs = documents_to_hdfs
+        self.incremental = incremental
+        # Outcome of the last write(): local bytes written, suppliers whose document was
+        # unchanged, files of suppliers no longer ordered from, HDFS deletes that failed
+        self.bytes_written = 0
+        self.unchanged = set()
+        self.removed = []
+        self.failed_deletes = []
+
+    def document_name(self, supplier_id):
+        return f"{supplier_id}_order{self.extension}"
+
+    def encode_document(self, document):
+        """The one serialization of a document, used for the local file and the HDFS upload"""
+        if self.document_format == 'json-pretty':
+            text = json.dumps(document, indent=2)
+        else:
+            text = json.dumps(document, separators=(',', ':'))
+        return compress(text.encode(), self.compression)
+
+    def encode_line_items(self, documents):
+        """(file name, bytes, row count) of every item of every document, one row per item"""
+        rows = [dict(item, order_date=document['order_date'])
+                for document in documents.values() for item in document['items']]
+        if self.line_items_format == 'parquet':
+            import pandas as pd
+            buffer = io.BytesIO()
+            pd.DataFrame(rows).to_parquet(buffer, index=False)
+            return self.line_items_name, buffer.getvalue(), len(rows)
+        text = ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in rows)
+        return self.line_items_name, compress(text.encode(), self.line_items_compression), len(rows)
+
+    def _write_local(self, name, data):
+        path = f"{self.local_dir}/{name}"
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+        self.bytes_written += len(data)
+
+    @staticmethod
+    def _entry(name, data, **extra):
+        return dict(name=name, bytes=len(data), sha256=hashlib.sha256(data).hexdigest(), **extra)
+
+    def _local_manifest(self):
+        try:
+            with open(f"{self.local_dir}/{MANIFEST_NAME}") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _published_manifest(self):
+        """The manifest on HDFS, None if missing or unreadable (then everything is uploaded)"""
+        try:
+            manifest = json.loads(self.hdfs.read_file(f"{self.hdfs_dir}/{MANIFEST_NAME}"))
+        except Exception:
+            return None
+        return manifest if isinstance(manifest, dict) and 'documents' in manifest else None
+
+    @staticmethod
+    def _hdfs_names(manifest):
+        """Files a manifest's run put on HDFS"""
+        names = {manifest['line_items']['name']} if 'line_items' in manifest else set()
+        if manifest.get('documents_to_hdfs', True):
+            names.update(entry['name'] for entry in manifest['documents'].values())
+        return names
+
+    def _unchanged_locally(self, previous, entry):
+        """Whether the local file of a manifest entry is already there as listed"""
+        if not self.incremental or not previous or previous.get('name') != entry['name']:
+            return False
+        if any(previous.get(key) != entry[key] for key in entry if key not in ('bytes', 'sha256')):
+            return False
+        path = f"{self.local_dir}/{entry['name']}"
+        return os.path.exists(path) and os.path.getsize(path) == previous['bytes']
+
+    def _published(self, published, entry, supplier_id=None):
+        """Whether HDFS already has this exact file according to the published manifest"""
+        if not self.incremental or published is None:
+            return False
+        if supplier_id is None:
+            listed = published.get('line_items')
+        elif published.get('documents_to_hdfs', True):
+            listed = published['documents'].get(supplier_id)
+        else:
+            listed = None
+        return bool(listed) and listed['name'] == entry['name'] and listed.get('sha256') == entry['sha256']
+
+    def write(self, documents, generated_at=None):
+        """
+        Write {supplier_id: document} for the day; returns {hdfs_path: uploaded} for the
+        uploaded files. The manifest is uploaded last, once everything it lists is on HDFS
+
+        Documents with the same content hash as in the previous manifest of the date are
+        neither rewritten nor re-uploaded, files of suppliers that dropped out are deleted
+        """
+        os.makedirs(self.local_dir, exist_ok=True)
+        self.bytes_written = 0
+        self.unchanged = set()
+        self.removed = []
+        self.failed_deletes = []
+        previous = self._local_manifest() or {'documents': {}}
+        published = self._published_manifest()
+        uploads = []
+        manifest = {
+            'date': self.date_str,
+            'generated_at': generated_at or datetime.now().isoformat(),
+            'document_format': self.document_format,
+            'documents_to_hdfs': self.documents_to_hdfs,
+            'documents': {},
+        }
+
+        for supplier_id, document in sorted(documents.items()):
+            name = self.document_name(supplier_id)
+            fields = {'content_hash': content_hash(document),
+                      'items': document['total_items'], 'quantity': document['total_quantity']}
+            old = previous['documents'].get(supplier_id)
+            if self._unchanged_locally(old, dict(fields, name=name)):
+                # Same content: the file keeps the generated_at of the run that wrote it
+                manifest['documents'][supplier_id] = old
+                self.unchanged.add(supplier_id)
+                data = None
+            else:
+                data = self.encode_document(document)
+                self._write_local(name, data)
+                manifest['documents'][supplier_id] = self._entry(name, data, **fields)
+            if self.documents_to_hdfs and not self._published(published, manifest['documents'][supplier_id],
+                                                              supplier_id):
+                if data is None:
+                    with open(f"{self.local_dir}/{name}", 'rb') as f:
+                        data = f.read()
+                uploads.append((f"{self.hdfs_dir}/{name}", data))
+
+        name, data, rows = self.encode_line_items(documents)
+        manifest['line_items'] = self._entry(name, data, format=self.line_items_format, rows=rows)
+        old = previous.get('line_items')
+        if not (old and old == manifest['line_items'] and self._unchanged_locally(old, manifest['line_items'])):
+            self._write_local(name, data)
+        if not self._published(published, manifest['line_items']):
+            uploads.append((f"{self.hdfs_dir}/{name}", data))
+
+        # Files of suppliers (or formats) no longer in the manifest
+        current = {entry['name'] for entry in manifest['documents'].values()} | {name}
+        listed = {entry['name'] for entry in previous['documents'].values()}
+        if 'line_items' in previous:
+            listed.add(previous['line_items']['name'])
+        for stale in sorted(listed - current):
+            path = f"{self.local_dir}/{stale}"
+            if os.path.exists(path):
+                os.remove(path)
+            self.removed.append(stale)
+        if published is not None:
+            for stale in sorted(self._hdfs_names(published) - self._hdfs_names(manifest)):
+                try:
+                    # A file that is already gone counts as deleted
+                    deleted = (self.hdfs.delete(f"{self.hdfs_dir}/{stale}")
+                               or not self.hdfs.exists(f"{self.hdfs_dir}/{stale}"))
+                except Exception:
+                    deleted = False
+                if not deleted:
+                    self.failed_deletes.append(f"{self.hdfs_dir}/{stale}")
+                if stale not in self.removed:
+                    self.removed.append(stale)
+
+        # An unchanged day keeps its manifest (and generated_at) as it is
+        if _same_content(manifest, previous):
+            manifest['generated_at'] = previous['generated_at']
+        manifest_data = json.dumps(manifest, indent=2).encode()
+        if manifest != previous:
+            self._write_local(MANIFEST_NAME, manifest_data)
+
+        results = self.hdfs.create_files(uploads) if uploads else {}
+        manifest_path = f"{self.hdfs_dir}/{MANIFEST_NAME}"
+        if not all(results.values()) or self.failed_deletes:
+            results[manifest_path] = False
+        elif manifest != published:
+            results.update(self.hdfs.create_files([(manifest_path, manifest_data)]))
+        return results
@@ -2,144 +2,368 @@
 """
 FULL Procurement Pipeline with Trino Integration
 Uses Trino to query historical HDFS data via SQL
+(or the local engine to aggregate data/raw files without any services)
 """
 
 import os
-import json
 import argparse
+import threading
 from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+from psycopg2 import errors as pg_errors
 from psycopg2.extras import RealDictCursor
 import trino
-import requests
+from hdfs_client import WebHDFSClient
+from columnar import ColumnarConverter, ORDERS_TABLE, STOCK_TABLE, WAREHOUSE_DIR, HDFS_FS_URI, raw_path
+from aggregates import DailyDemandAggregates, window_dates, date_range
+from engines import TrinoEngine, LocalEngine, ENGINES, DATA_DIR
+from net_demand import NetDemandEngine
+from master_cache import MasterDataCache, MASTER_CACHE_ENABLED
+from metrics import RunMetrics, InstrumentedCursor
+from checkpoints import RunCheckpoint, IngestState, input_fingerprint, raw_files, added_files
+from output_writer import SupplierOrderWriter
+from stage_graph import StageGraph, StageError
+from query_cache import QueryResultCache, CachedEngine, QUERY_CACHE_ENABLED
+from pushdown import PushdownNetDemand
+from exception_log import ExceptionLog
+from snapshot_catalog import SnapshotCatalog, index_unrecorded, STOCK_MAX_AGE_DAYS
 
 # Configuration
 HDFS_NAMENODE_URL = os.getenv('HDFS_URL', 'http://namenode:9870')
-LOCAL_OUTPUT_DIR = '/data/output/supplier_orders'
-LOCAL_LOGS_DIR = '/data/logs'
+HDFS_USER = os.getenv('HDFS_USER')
+LOCAL_OUTPUT_DIR = f"{DATA_DIR}/output/supplier_orders"
 HDFS_OUTPUT_DIR = '/data/output/supplier_orders'
+DEMAND_WINDOW_DAYS = int(os.getenv('DEMAND_WINDOW_DAYS', '1'))
+PIPELINE_ENGINE = os.getenv('PIPELINE_ENGINE', 'trino')
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', '4'))
+# Compute net demand inside Trino (federated with PostgreSQL) instead of in Python
+PIPELINE_PUSHDOWN = os.getenv('PIPELINE_PUSHDOWN', '0') == '1'
+PIPELINE_STAGE_WORKERS = int(os.getenv('PIPELINE_STAGE_WORKERS', '4'))
+# Per-stage limits in seconds, e.g. "orders=600,stock=600,connect_engine=120" (unset = no limit)
+STAGE_TIMEOUTS = {name.strip(): float(seconds) for name, _, seconds in
+                  (item.partition('=') for item in os.getenv('STAGE_TIMEOUTS', '').split(',') if '=' in item)}
 
 
-class WebHDFSHelper:
-    """Helper for HDFS file operations"""
-    
-    def __init__(self, namenode_url):
-        self.namenode_url = namenode_url.rstrip('/')
-        self.webhdfs_url = f"{self.namenode_url}/webhdfs/v1"
-    
-    def create_file(self, path, data):
-        """Write file to HDFS"""
-        url = f"{self.webhdfs_url}{path}?op=CREATE&overwrite=true"
-        try:
-            response = requests.put(url, allow_redirects=False, timeout=60)
-            if response.status_code == 307:
-                redirect_url = response.headers['Location']
-                upload_response = requests.put(redirect_url, data=data, timeout=60)
-                upload_response.raise_for_status()
-                return True
-            return False
-        except Exception as e:
-            print(f"  ✗ Error writing {path}: {e}")
-            return False
-    
-    def mkdir(self, path):
-        """Create directory in HDFS"""
-        url = f"{self.webhdfs_url}{path}?op=MKDIRS"
-        try:
-            response = requests.put(url, timeout=30)
-            response.raise_for_status()
-            return True
-        except Exception as e:
-            print(f"  ✗ Error creating directory {path}: {e}")
-            return False
+def create_db_connection():
+    """New PostgreSQL connection to the master-data database"""
+    return psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST', 'postgres'),
+        port=os.getenv('POSTGRES_PORT', '5432'),
+        database=os.getenv('POSTGRES_DB', 'procurement'),
+        user=os.getenv('POSTGRES_USER', 'admin'),
+        password=os.getenv('POSTGRES_PASSWORD', 'admin123')
+    )
+
+
+def create_trino_connection(insert_behavior='OVERWRITE'):
+    """
+    New Trino connection to the hive.warehouse schema
+    insert_behavior='APPEND' for connections that add files to existing partitions
+    """
+    return trino.dbapi.connect(
+        host=os.getenv('TRINO_HOST', 'trino'),
+        port=int(os.getenv('TRINO_PORT', '8080')),
+        user='trino',  # Use 'trino' user to match table ownership
+        catalog='hive',
+        schema='warehouse',
+        # Columnar conversion rewrites whole day partitions
+        session_properties={'hive.insert_existing_partitions_behavior': insert_behavior}
+    )
 
 
 class ProcurementPipeline:
-    def __init__(self, date_str):
+    def __init__(self, date_str, window_days=DEMAND_WINDOW_DAYS, engine=PIPELINE_ENGINE,
+                 master_data=None, trino_conn=None, hdfs=None, metrics=None, db_conn=None,
+                 ensure_tables=None, resume=False, query_cache=QUERY_CACHE_ENABLED, pushdown=PIPELINE_PUSHDOWN,
+                 master_fingerprint=None):
         self.date_str = date_str
-        self.exceptions = []
-        self.db_conn = None
-        self.trino_conn = None
+        self.window_days = window_days
+        self.engine_name = engine
+        self.engine = None
+        self.exceptions = ExceptionLog(date_str)
+        # Shared resources passed in by a backfill or the scheduler are not closed by this pipeline
+        self.db_conn = db_conn
+        self.owns_db = db_conn is None
+        self.master_data = master_data
+        # Fingerprint of the master tables master_data was loaded from (computed when not passed in)
+        self.master_fingerprint = master_fingerprint
+        self.trino_conn = trino_conn
+        self.owns_trino = trino_conn is None
+        # Trino tables are created by the connection owner unless told otherwise
+        self.ensure_tables = self.owns_trino if ensure_tables is None else ensure_tables
         self.trino_cursor = None
-        self.hdfs = WebHDFSHelper(HDFS_NAMENODE_URL)
+        self.stock_cursor = None
+        self.columnar = None
+        self.aggregates = None
+        self.hdfs = hdfs or WebHDFSClient(HDFS_NAMENODE_URL, user=HDFS_USER)
+        self.owns_hdfs = hdfs is None
+        self.metrics = metrics or RunMetrics('pipeline', date_str)
+        if self.owns_hdfs:
+            self.hdfs.metrics = self.metrics
+        # Stage outputs are always checkpointed, but only reused with resume=True
+        self.resume = resume
+        self.checkpoint = None
+        # Stages whose result was restored from / saved to a checkpoint by this run
+        self.restored = set()
+        self.saved = set()
+        self.query_cache = query_cache
+        # Pushdown needs Trino; the local engine always computes net demand in Python
+        self.pushdown = pushdown and engine == 'trino'
         
     def connect_database(self):
-        """Connect to PostgreSQL"""
+        """Connect to PostgreSQL (no-op when a connection was passed in)"""
+        if self.db_conn is not None:
+            return True
         try:
-            self.db_conn = psycopg2.connect(
-                host=os.getenv('POSTGRES_HOST', 'postgres'),
-                port=os.getenv('POSTGRES_PORT', '5432'),
-                database=os.getenv('POSTGRES_DB', 'procurement'),
-                user=os.getenv('POSTGRES_USER', 'admin'),
-                password=os.getenv('POSTGRES_PASSWORD', 'admin123')
-            )
+            self.db_conn = create_db_connection()
             print("✓ Connected to PostgreSQL")
             return True
         except Exception as e:
             print(f"✗ Database connection failed: {e}")
             return False
     
-    def connect_trino(self):
+    def connect_trino(self, ensure_tables=True):
         """Connect to Trino for querying HDFS data"""
         try:
-            self.trino_conn = trino.dbapi.connect(
-                host=os.getenv('TRINO_HOST', 'trino'),
-                port=int(os.getenv('TRINO_PORT', '8080')),
-                user='trino',  # Use 'trino' user to match table ownership
-                catalog='hive',
-                schema='warehouse'
-            )
-            self.trino_cursor = self.trino_conn.cursor()
+            if self.trino_conn is None:
+                self.trino_conn = create_trino_connection()
+            self.trino_cursor = InstrumentedCursor(self.trino_conn.cursor(), self.metrics)
+            self.columnar = ColumnarConverter(self.trino_cursor)
+            self.aggregates = DailyDemandAggregates(self.trino_cursor)
+            # Stock queries get their own cursor so they can run alongside the orders query
+            self.stock_cursor = InstrumentedCursor(self.trino_conn.cursor(), self.metrics)
+            self.engine = TrinoEngine(self.stock_cursor, self.aggregates)
             
-            # Create schema if not exists
-            self.trino_cursor.execute("CREATE SCHEMA IF NOT EXISTS warehouse")
+            if ensure_tables:
+                self.create_trino_tables()
             
-            # Drop and recreate tables for this date
-            self.trino_cursor.execute("DROP TABLE IF EXISTS orders_data")
-            self.trino_cursor.execute(f"""
-                CREATE TABLE orders_data (
-                    order_id VARCHAR,
-                    pos_id VARCHAR,
-                    sku VARCHAR,
-                    quantity INTEGER,
-                    order_date VARCHAR,
-                    order_time VARCHAR,
-                    customer_id VARCHAR
-                ) WITH (
-                    format = 'JSON',
-                    external_location = 'hdfs://namenode:9000/data/raw/orders/{self.date_str}'
-                )
-            """)
-            
-            self.trino_cursor.execute("DROP TABLE IF EXISTS stock_data")
+            print("✓ Connected to Trino")
+            return True
+        except Exception as e:
+            print(f"✗ Trino connection failed: {e}")
+            print("  Make sure Trino tables are created (run setup_trino_tables.sql)")
+            return False
+    
+    def create_trino_tables(self):
+        """Create schema, raw partitioned tables, ORC tables and aggregates (no-op after first run)"""
+        self.trino_cursor.execute(f"""
+            CREATE SCHEMA IF NOT EXISTS warehouse
+            WITH (location = '{HDFS_FS_URI}{WAREHOUSE_DIR}')
+        """)
+        self.ensure_partitioned_table('orders_data', f"""
+            CREATE TABLE IF NOT EXISTS orders_data (
+                order_id VARCHAR,
+                pos_id VARCHAR,
+                sku VARCHAR,
+                quantity INTEGER,
+                order_time VARCHAR,
+                customer_id VARCHAR,
+                order_date VARCHAR
+            ) WITH (
+                format = 'JSON',
+                external_location = '{HDFS_FS_URI}/data/raw/orders',
+                partitioned_by = ARRAY['order_date']
+            )
+        """)
+        # CSV columns are positional: file_snapshot_date is the snapshot_date
+        # column inside the file, the partition key comes from the directory
+        self.ensure_partitioned_table('stock_data', f"""
+            CREATE TABLE IF NOT EXISTS stock_data (
+                warehouse_id VARCHAR,
+                sku VARCHAR,
+                available_stock VARCHAR,
+                reserved_stock VARCHAR,
+                safety_stock VARCHAR,
+                file_snapshot_date VARCHAR,
+                snapshot_time VARCHAR,
+                snapshot_date VARCHAR
+            ) WITH (
+                format = 'CSV',
+                external_location = '{HDFS_FS_URI}/data/raw/stock',
+                skip_header_line_count = 1,
+                partitioned_by = ARRAY['snapshot_date']
+            )
+        """)
+        
+        self.columnar.ensure_tables()
+        self.aggregates.ensure_table()
+    
+    def ingest(self, incremental=False):
+        """
+        Register today's raw partitions, convert them to ORC and refresh demand aggregates
+        Skipped when the raw files are unchanged since the date's last successful ingest; with
+        incremental=True, a day that only gained files gets just those appended
+        """
+        state = IngestState()
+        try:
+            files = raw_files(self.date_str, self.hdfs)
+        except Exception as e:
+            print(f"  ⚠ Could not list raw files, ingesting anyway: {e}")
+            files = None
+        recorded = state.get(self.date_str).get('files')
+        if files is not None and recorded == files:
+            print(f"\n↷ Raw files of {self.date_str} unchanged since the last ingest, skipping")
+            return True
+        added = added_files(recorded, files) if incremental and files is not None else None
+        state.forget(self.date_str)
+        
+        try:
+            self.register_partition('orders_data', 'order_date', f"/data/raw/orders/{self.date_str}")
+            self.register_partition('stock_data', 'snapshot_date', f"/data/raw/stock/{self.date_str}")
+        except Exception as e:
+            print(f"  ✗ Partition registration failed: {e}")
+            self.exceptions.append({
+                'type': 'ingest_error',
+                'message': str(e)
+            })
+            return False
+        if added is not None:
+            ingested = self.append_to_columnar(added)
+        else:
+            ingested = self.convert_to_columnar() and self.refresh_demand_aggregates()
+        if not ingested:
+            return False
+        if files is not None:
+            state.record(self.date_str, files)
+        return True
+    
+    def append_to_columnar(self, added):
+        """
+        Micro-batch ingest: append the rows of the raw files added since the last ingest to the
+        ORC tables and partial demand aggregates, on a connection that appends to partitions
+        """
+        print(f"\n➕ Appending {len(added['orders'])} order and {len(added['stock'])} stock files "
+              f"of {self.date_str}...")
+        orders = [raw_path('orders', self.date_str, name) for name in added['orders']]
+        stock = [raw_path('stock', self.date_str, name) for name in added['stock']]
+        conn = create_trino_connection(insert_behavior='APPEND')
+        cursor = InstrumentedCursor(conn.cursor(), self.metrics)
+        try:
+            columnar = ColumnarConverter(cursor)
+            order_rows = columnar.append_orders(self.date_str, orders)
+            stock_rows = columnar.append_stock(self.date_str, stock)
+            demand_rows = DailyDemandAggregates(cursor).append_files(self.date_str, orders)
+        except Exception as e:
+            # The day is rebuilt in full by the next ingest (its ingest state was cleared)
+            print(f"  ✗ Append failed: {e}")
+            self.exceptions.append({
+                'type': 'ingest_error',
+                'message': str(e)
+            })
+            return False
+        finally:
+            cursor.close()
+            conn.close()
+        self.metrics.add(rows_out=(order_rows or 0) + (stock_rows or 0) + (demand_rows or 0))
+        print(f"  ✓ {order_rows} order rows, {stock_rows} stock rows, {demand_rows} demand rows appended")
+        return True
+    
+    def ensure_partitioned_table(self, table, create_ddl):
+        """Create a partitioned table, replacing a legacy unpartitioned one"""
+        try:
+            self.trino_cursor.execute(f'SELECT 1 FROM "{table}$partitions" LIMIT 1')
+            self.trino_cursor.fetchall()
+            return
+        except trino.exceptions.TrinoUserError:
+            pass
+        
+        # Table missing or created by the old DROP/CREATE flow (external, so no data is lost)
+        self.trino_cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        self.trino_cursor.execute(create_ddl)
+        print(f"  ✓ Created partitioned table {table}")
+    
+    def register_partition(self, table, column, hdfs_dir):
+        """Register hdfs_dir as the partition column=date_str if not already known"""
+        self.trino_cursor.execute(
+            f"SELECT COUNT(*) FROM \"{table}$partitions\" WHERE {column} = '{self.date_str}'"
+        )
+        if self.trino_cursor.fetchone()[0] > 0:
+            return True
+        
+        try:
             self.trino_cursor.execute(f"""
-                CREATE TABLE stock_data (
-                    warehouse_id VARCHAR,
-                    sku VARCHAR,
-                    available_stock VARCHAR,
-                    reserved_stock VARCHAR,
-                    safety_stock VARCHAR,
-                    snapshot_date VARCHAR,
-                    snapshot_time VARCHAR
-                ) WITH (
-                    format = 'CSV',
-                    external_location = 'hdfs://namenode:9000/data/raw/stock/{self.date_str}',
-                    skip_header_line_count = 1
+                CALL system.register_partition(
+                    'warehouse', '{table}', ARRAY['{column}'], ARRAY['{self.date_str}'],
+                    '{HDFS_FS_URI}{hdfs_dir}'
                 )
             """)
+            self.trino_cursor.fetchall()
+            print(f"  ✓ Registered partition {table}/{column}={self.date_str}")
+            return True
+        except trino.exceptions.TrinoUserError as e:
+            # A concurrent run may have registered it first
+            if 'already exists' in str(e):
+                return True
+            print(f"  ⚠ Could not register {table}/{column}={self.date_str}: {e.message}")
+            self.exceptions.append({
+                'type': 'missing_partition',
+                'table': table,
+                'partition': self.date_str,
+                'message': e.message
+            })
+            return False
+    
+    def convert_to_columnar(self):
+        """Rewrite today's raw JSON/CSV partitions into the typed ORC tables"""
+        print(f"\n🗜  Converting raw data to ORC for {self.date_str}...")
+        try:
+            order_rows, stock_rows = self.columnar.convert_day(self.date_str)
+            self.metrics.add(rows_out=(order_rows or 0) + (stock_rows or 0))
+            print(f"  ✓ {ORDERS_TABLE}: {order_rows} rows")
+            print(f"  ✓ {STOCK_TABLE}: {stock_rows} rows")
+            return True
+        except Exception as e:
+            print(f"  ✗ Columnar conversion failed: {e}")
+            self.exceptions.append({
+                'type': 'conversion_error',
+                'message': str(e)
+            })
+            return False
+    
+    def refresh_demand_aggregates(self):
+        """Materialize today's daily_sku_demand partition and backfill gaps in the window"""
+        print(f"\n📈 Refreshing daily demand aggregates...")
+        try:
+            rows = self.aggregates.refresh_day(self.date_str)
+            self.metrics.add(rows_out=rows or 0)
+            print(f"  ✓ {self.date_str}: {rows} (sku, pos) rows")
             
-            print("✓ Connected to Trino and created tables")
+            start, end = window_dates(self.date_str, self.window_days)
+            backfilled = self.aggregates.backfill(start, end)
+            if backfilled:
+                print(f"  ✓ Backfilled {len(backfilled)} earlier days")
             return True
         except Exception as e:
-            print(f"✗ Trino connection failed: {e}")
-            print("  Make sure Trino tables are created (run setup_trino_tables.sql)")
+            print(f"  ✗ Aggregate refresh failed: {e}")
+            self.exceptions.append({
+                'type': 'aggregate_error',
+                'message': str(e)
+            })
             return False
     
     def load_master_data(self):
-        """Load products, suppliers, and replenishment rules from PostgreSQL"""
+        """Load products, suppliers, replenishment rules and POS → warehouse mapping from PostgreSQL"""
         print("\n📚 Loading master data from PostgreSQL...")
         
+        # Reuse the local snapshot while the master tables are unchanged
+        cache = MasterDataCache() if MASTER_CACHE_ENABLED else None
+        fingerprint = None
+        if cache:
+            try:
+                fingerprint = self.master_fingerprint or cache.fingerprint(self.db_conn)
+                snapshot = cache.load(fingerprint)
+                if snapshot:
+                    products, rules, pos_warehouses = snapshot
+                    print(f"  ✓ Master data unchanged, using snapshot {fingerprint} "
+                          f"({len(products)} products, {len(rules)} rules)")
+                    return snapshot
+            except Exception as e:
+                print(f"  ⚠ Master data cache unavailable: {e}")
+                self.db_conn.rollback()
+                fingerprint = None
+        
         cursor = self.db_conn.cursor(cursor_factory=RealDictCursor)
         
         # Load products with supplier mapping
@@ -155,7 +379,8 @@ class ProcurementPipeline:
         
         # Load replenishment rules
         cursor.execute("""
-            SELECT sku, warehouse_id, safety_stock, minimum_order_quantity
+            SELECT sku, warehouse_id, safety_stock, minimum_order_quantity,
+                   maximum_order_quantity, reorder_point
             FROM replenishment_rules
             WHERE active = TRUE
         """)
@@ -165,81 +390,135 @@ class ProcurementPipeline:
             rules[key] = dict(row)
         print(f"  ✓ Loaded {len(rules)} replenishment rules")
         
+        # Load which warehouse serves each point of sale
+        try:
+            cursor.execute("""
+                SELECT pos_id, warehouse_id
+                FROM points_of_sale
+                WHERE active = TRUE
+            """)
+            pos_warehouses = {row['pos_id']: row['warehouse_id'] for row in cursor.fetchall()}
+        except pg_errors.UndefinedTable:
+            self.db_conn.rollback()
+            pos_warehouses = {}
+        print(f"  ✓ Loaded {len(pos_warehouses)} POS → warehouse mappings")
+        
         cursor.close()
-        return products, rules
+        
+        if fingerprint:
+            try:
+                cache.save(fingerprint, products, rules, pos_warehouses)
+                print(f"  ✓ Saved master data snapshot {fingerprint}")
+            except Exception as e:
+                print(f"  ⚠ Could not save master data snapshot: {e}")
+        
+        return products, rules, pos_warehouses
     
     def get_historical_orders_via_trino(self):
         """
-        Query ALL orders from HDFS using Trino SQL
-        Works with newline-delimited JSON format
-        """
-        print(f"\n📦 Querying orders via Trino (up to {self.date_str})...")
-        
-        # SQL query to aggregate ALL orders up to target date
-        query = f"""
-        SELECT 
-            sku,
-            SUM(quantity) as total_quantity,
-            COUNT(*) as order_count
-        FROM orders_data
-        WHERE order_date = '{self.date_str}' 
-        GROUP BY sku
-        ORDER BY total_quantity DESC
+        Query demand over the window ending on the target date
+        Trino reads the small daily_sku_demand aggregates, not the raw orders
         """
+        start, end = window_dates(self.date_str, self.window_days)
+        print(f"\n📦 Querying orders via {self.engine.name} engine ({start} → {end})...")
         
         try:
-            self.trino_cursor.execute(query)
-            results = self.trino_cursor.fetchall()
+            results = self.engine.orders_by_sku_pos(start, end)
+            if results.cache_hit:
+                print("  ✓ Inputs unchanged, served from the query result cache")
             
-            # Convert to dictionary
+            # Convert to dictionary keyed by (sku, pos_id)
             historical_orders = {}
             total_demand = 0
             
             for row in results:
-                sku = row[0]
-                quantity = row[1]
-                historical_orders[sku] = quantity
+                sku, pos_id, quantity = row[0], row[1], row[2]
+                historical_orders[(sku, pos_id)] = quantity
                 total_demand += quantity
             
+            self.metrics.add(rows_in=len(results), rows_out=len(historical_orders),
+                             bytes_read=results.bytes_read)
             print(f"  ✓ Total demand: {total_demand} units")
-            print(f"  ✓ SKUs with demand: {len(historical_orders)}")
+            print(f"  ✓ SKUs with demand: {len({sku for sku, _ in historical_orders})}")
             
             if len(historical_orders) == 0:
                 self.exceptions.append({
                     'type': 'no_data',
-                    'message': 'No orders found in Trino tables'
+                    'message': f'No orders found by {self.engine.name} engine'
                 })
             
             return historical_orders
             
         except Exception as e:
-            print(f"  ✗ Trino query failed: {e}")
+            print(f"  ✗ {self.engine.name} query failed: {e}")
             self.exceptions.append({
-                'type': 'trino_error',
+                'type': f'{self.engine.name}_error',
                 'message': str(e)
             })
             return {}
     
-    def get_latest_stock_via_trino(self):
+    def stock_snapshots(self):
         """
-        Query LATEST stock levels from HDFS using Trino SQL
-        Gets the most recent snapshot for each SKU
+        Latest usable snapshot of each warehouse from the snapshot catalog, as
+        {warehouse_id: {'date', 'files', 'rows'}}; late or missing feeds are logged
+        None if the catalog is empty (then the latest snapshot date is queried)
         """
-        print(f"\n📊 Querying latest stock via Trino...")
+        try:
+            catalog = SnapshotCatalog()
+        except Exception as e:
+            print(f"  ⚠ Snapshot catalog unavailable: {e}")
+            return None
+        if not catalog:
+            return None
+        
+        # Only uploads by the scheduler update the catalog: before trusting an older snapshot,
+        # index stock files that reached HDFS (or data/raw) another way
+        latest = catalog.latest(self.date_str)
+        if any(snapshot is None or snapshot['date'] != self.date_str for snapshot in latest.values()):
+            try:
+                if self.engine_name == 'local':
+                    catalog, indexed = index_unrecorded(self.date_str, raw_dir=self.engine.raw_dir)
+                else:
+                    catalog, indexed = index_unrecorded(self.date_str, hdfs=self.hdfs)
+                if indexed:
+                    print(f"  ✓ Indexed {indexed} stock files missing from the snapshot catalog")
+                    latest = catalog.latest(self.date_str)
+            except Exception as e:
+                print(f"  ⚠ Could not check the stock partitions against the snapshot catalog: {e}")
         
-        # Find the latest snapshot date
-        date_query = f"""
-        SELECT MAX(snapshot_date) as latest_date
-        FROM stock_data
-        WHERE snapshot_date <= '{self.date_str}'
+        snapshots = {}
+        for warehouse_id, snapshot in sorted(latest.items()):
+            if snapshot is None:
+                print(f"  ⚠ {warehouse_id}: no stock snapshot in the last {STOCK_MAX_AGE_DAYS} days")
+                self.exceptions.append({
+                    'type': 'missing_stock_feed',
+                    'warehouse_id': warehouse_id,
+                    'message': f'No stock snapshot for {warehouse_id} in the last {STOCK_MAX_AGE_DAYS} days'
+                })
+                continue
+            if snapshot['date'] != self.date_str:
+                print(f"  ⚠ {warehouse_id}: no feed for {self.date_str}, using snapshot from {snapshot['date']}")
+                self.exceptions.append({
+                    'type': 'stale_stock',
+                    'warehouse_id': warehouse_id,
+                    'snapshot_date': snapshot['date'],
+                    'message': f'No stock feed for {warehouse_id} on {self.date_str}'
+                })
+            snapshots[warehouse_id] = snapshot
+        return snapshots
+    
+    def get_latest_stock_via_trino(self):
+        """
+        Query LATEST stock levels
+        Each warehouse's latest snapshot from the snapshot catalog, or the latest snapshot date
         """
+        print(f"\n📊 Querying latest stock via {self.engine.name} engine...")
         
         try:
-            self.trino_cursor.execute(date_query)
-            result = self.trino_cursor.fetchone()
-            latest_date = result[0] if result else None
+            snapshots = self.stock_snapshots()
+            latest_date = self.engine.latest_stock_date(self.date_str) if snapshots is None else None
             
-            if not latest_date:
+            if not snapshots and not latest_date:
                 print(f"  ✗ No stock data found before {self.date_str}")
                 self.exceptions.append({
                     'type': 'no_stock',
@@ -247,134 +526,108 @@ class ProcurementPipeline:
                 })
                 return {}
             
-            print(f"  → Using stock snapshot from: {latest_date}")
-            
-            # Query stock for that date (cast VARCHAR to INTEGER)
-            stock_query = f"""
-            SELECT 
-                sku,
-                SUM(CAST(available_stock AS INTEGER)) as total_available,
-                SUM(CAST(reserved_stock AS INTEGER)) as total_reserved,
-                MAX(CAST(safety_stock AS INTEGER)) as max_safety_stock
-            FROM stock_data
-            WHERE snapshot_date = '{latest_date}'
-            GROUP BY sku
-            """
-            
-            self.trino_cursor.execute(stock_query)
-            results = self.trino_cursor.fetchall()
+            if snapshots:
+                dates = sorted({snapshot['date'] for snapshot in snapshots.values()})
+                print(f"  → Using stock snapshots of {len(snapshots)} warehouses from: {', '.join(dates)}")
+                results = self.engine.stock_by_snapshots(snapshots)
+            else:
+                print(f"  → Using stock snapshot from: {latest_date}")
+                results = self.engine.stock_by_warehouse(latest_date)
+            if results.cache_hit:
+                print("  ✓ Inputs unchanged, served from the query result cache")
             
-            # Convert to dictionary
+            # Convert to dictionary keyed by (sku, warehouse_id)
             stock_data = {}
             for row in results:
-                sku = row[0]
-                stock_data[sku] = {
-                    'available': row[1],
-                    'reserved': row[2],
-                    'safety_stock': row[3]
+                warehouse_id, sku = row[0], row[1]
+                stock_data[(sku, warehouse_id)] = {
+                    'available': row[2],
+                    'reserved': row[3],
+                    'safety_stock': row[4]
                 }
             
-            print(f"  ✓ Loaded stock for {len(stock_data)} SKUs")
+            self.metrics.add(rows_in=len(results), rows_out=len(stock_data),
+                             bytes_read=results.bytes_read)
+            print(f"  ✓ Loaded stock for {len({sku for sku, _ in stock_data})} SKUs "
+                  f"across {len({wh for _, wh in stock_data})} warehouses")
             return stock_data
             
         except Exception as e:
-            print(f"  ✗ Trino query failed: {e}")
+            print(f"  ✗ {self.engine.name} query failed: {e}")
             self.exceptions.append({
-                'type': 'trino_error',
+                'type': f'{self.engine.name}_error',
                 'message': str(e)
             })
             return {}
     
-    def calculate_net_demand(self, historical_orders, current_stock, products, rules):
+    def calculate_net_demand(self, historical_orders, current_stock, products, rules, pos_warehouses):
         """
-        Calculate net demand: cumulative orders + safety stock - available stock
+        Calculate net demand per SKU and warehouse (see net_demand.NetDemandEngine)
         Formula: net_demand = max(0, total_orders + safety_stock - (available - reserved))
         """
         print(f"\n🧮 Calculating net demand...")
         
-        net_demand = {}
-        calculation_details = []
+        engine = NetDemandEngine(products, rules, pos_warehouses)
+        net_demand, exceptions, calculation_details = engine.compute(historical_orders, current_stock)
+        self.exceptions.extend(exceptions)
+        self.metrics.add(rows_in=len(historical_orders) + len(current_stock), rows_out=len(net_demand))
         
-        # Get all SKUs
-        all_skus = set(historical_orders.keys()) | set(current_stock.keys())
+        print(f"  ✓ Net demand calculated for {len(net_demand)} SKU/warehouse pairs")
         
-        for sku in all_skus:
-            # Check if SKU exists in master data
-            if sku not in products:
-                self.exceptions.append({
-                    'type': 'missing_product',
-                    'sku': sku,
-                    'message': f'SKU {sku} not in product catalog'
-                })
-                continue
-            
-            # Get values
-            total_orders = historical_orders.get(sku, 0)
-            stock = current_stock.get(sku, {
-                'available': 0, # Exception logged
-                'reserved': 0,
-                'safety_stock': 50
+        # Show top 5 calculations
+        if calculation_details:
+            print(f"\n  Top 5 calculations:")
+            for detail in calculation_details:
+                print(f"    {detail['sku']}@{detail['warehouse_id']}: orders={detail['total_orders']}, "
+                      f"stock={detail['available_stock']}, "
+                      f"safety={detail['safety_stock']} → net_demand={detail['net_demand']}")
+        
+        return net_demand
+    
+    def calculate_net_demand_pushdown(self):
+        """
+        Net demand computed by Trino in one federated query (see pushdown.PushdownNetDemand)
+        Replaces the orders, stock and master data transfers; only the resulting rows are fetched
+        """
+        start, end = window_dates(self.date_str, self.window_days)
+        print(f"\n🧮 Calculating net demand in Trino ({start} → {end})...")
+        
+        try:
+            snapshots = self.stock_snapshots()
+            net_demand, exceptions, calculation_details, totals = PushdownNetDemand(
+                self.trino_cursor).compute(self.date_str, self.window_days, snapshots)
+        except Exception as e:
+            print(f"  ✗ Pushdown query failed: {e}")
+            self.exceptions.append({
+                'type': 'trino_error',
+                'message': str(e)
             })
-            
-            # Calculate net demand
-            available_stock = stock['available'] - stock['reserved']
-            required = total_orders + stock['safety_stock']
-            net = max(0, required - available_stock)
-            
-            # Store calculation details for logging
-            calculation_details.append({
-                'sku': sku,
-                'total_orders': total_orders,
-                'available_stock': available_stock,
-                'safety_stock': stock['safety_stock'],
-                'required': required,
-                'net_demand': net
+            return {}
+        
+        if totals['snapshot_date']:
+            print(f"  → Using stock snapshot from: {totals['snapshot_date']}")
+        else:
+            print(f"  ✗ No stock data found before {self.date_str}")
+            self.exceptions.append({
+                'type': 'no_stock',
+                'message': 'No stock snapshots available'
             })
-            
-            # Check for abnormal demand
-            if net > stock['safety_stock'] * 5:
-                self.exceptions.append({
-                    'type': 'demand_spike',
-                    'sku': sku,
-                    'net_demand': net,
-                    'safety_stock': stock['safety_stock']
-                })
-            
-            if net > 0:
-                product = products[sku]
-                
-                # Apply case size rounding
-                case_size = product['case_size']
-                rounded_quantity = ((net + case_size - 1) // case_size) * case_size
-                
-                # Get MOQ
-                rule_key = (sku, 'WH001')
-                moq = rules.get(rule_key, {}).get('minimum_order_quantity', 1)
-                
-                # Apply MOQ
-                final_quantity = max(rounded_quantity, moq)
-                
-                net_demand[sku] = {
-                    'sku': sku,
-                    'product_name': product['product_name'],
-                    'supplier_id': product['supplier_id'],
-                    'historical_orders': total_orders,
-                    'current_stock': available_stock,
-                    'safety_stock': stock['safety_stock'],
-                    'raw_demand': net,
-                    'rounded_demand': rounded_quantity,
-                    'final_quantity': final_quantity,
-                    'case_size': case_size,
-                    'moq': moq
-                }
+        print(f"  ✓ Total demand: {totals['total_demand']} units")
+        if not totals['order_keys']:
+            self.exceptions.append({
+                'type': 'no_data',
+                'message': 'No orders found by trino engine'
+            })
+        self.exceptions.extend(exceptions)
+        self.metrics.add(rows_in=totals['rows'], rows_out=len(net_demand))
         
-        print(f"  ✓ Net demand calculated for {len(net_demand)} SKUs")
+        print(f"  ✓ Net demand calculated for {len(net_demand)} SKU/warehouse pairs "
+              f"({totals['rows']} rows fetched)")
         
-        # Show top 5 calculations
         if calculation_details:
             print(f"\n  Top 5 calculations:")
-            for detail in sorted(calculation_details, key=lambda x: x['net_demand'], reverse=True)[:5]:
-                print(f"    {detail['sku']}: orders={detail['total_orders']}, "
+            for detail in calculation_details:
+                print(f"    {detail['sku']}@{detail['warehouse_id']}: orders={detail['total_orders']}, "
                       f"stock={detail['available_stock']}, "
                       f"safety={detail['safety_stock']} → net_demand={detail['net_demand']}")
         
@@ -384,115 +637,289 @@ class ProcurementPipeline:
         """Generate supplier order files"""
         print(f"\n📄 Generating supplier orders...")
         
+        # With nothing to order the writer still runs, to remove an earlier run's files
         if not net_demand:
             print("  ℹ No replenishment needed")
-            return 0
         
         # Group by supplier
         supplier_orders = defaultdict(list)
-        for sku, demand_info in net_demand.items():
+        for demand_info in net_demand.values():
             supplier_id = demand_info['supplier_id']
             supplier_orders[supplier_id].append(demand_info)
         
-        # Create directories
-        local_output_dir = f"{LOCAL_OUTPUT_DIR}/{self.date_str}"
-        os.makedirs(local_output_dir, exist_ok=True)
-        
-        hdfs_output_dir = f"{HDFS_OUTPUT_DIR}/{self.date_str}"
-        self.hdfs.mkdir(hdfs_output_dir)
+        try:
+            writer = SupplierOrderWriter(self.date_str, f"{LOCAL_OUTPUT_DIR}/{self.date_str}",
+                                         f"{HDFS_OUTPUT_DIR}/{self.date_str}", self.hdfs)
+        except ValueError as e:
+            print(f"  ✗ {e}")
+            self.exceptions.append({
+                'type': 'output_error',
+                'message': str(e)
+            })
+            return 0
         
-        # Generate files
-        for supplier_id, items in supplier_orders.items():
-            order_document = {
+        # Build documents (a retry of the same run writes the same bytes)
+        generated_at = self.checkpoint.created_at if self.checkpoint else datetime.now().isoformat()
+        documents = {}
+        for supplier_id, items in sorted(supplier_orders.items()):
+            documents[supplier_id] = {
                 'supplier_id': supplier_id,
                 'order_date': self.date_str,
-                'generated_at': datetime.now().isoformat(),
+                'generated_at': generated_at,
                 'total_items': len(items),
                 'total_quantity': sum(item['final_quantity'] for item in items),
                 'items': items
             }
-            
-            # Save locally
-            local_file = f"{local_output_dir}/{supplier_id}_order.json"
-            with open(local_file, 'w') as f:
-                json.dump(order_document, f, indent=2)
-            
-            # Upload to HDFS
-            hdfs_file = f"{hdfs_output_dir}/{supplier_id}_order.json"
-            json_data = json.dumps(order_document, indent=2)
-            
-            if self.hdfs.create_file(hdfs_file, json_data):
-                print(f"  ✓ {supplier_id}: {len(items)} SKUs, {order_document['total_quantity']} units")
+        
+        # Serialize once, write locally and upload to HDFS concurrently (CREATE overwrites, so
+        # re-uploads are idempotent); suppliers whose content is unchanged are skipped
+        results = writer.write(documents, generated_at)
+        self.metrics.add(bytes_written=writer.bytes_written)
+        for supplier_id, order_document in documents.items():
+            hdfs_file = f"{writer.hdfs_dir}/{writer.document_name(supplier_id)}"
+            if supplier_id in writer.unchanged and hdfs_file not in results:
+                print(f"  = {supplier_id}: unchanged ({order_document['total_items']} SKUs)")
+            elif results.get(hdfs_file, True):
+                print(f"  ✓ {supplier_id}: {order_document['total_items']} SKUs, {order_document['total_quantity']} units")
             else:
                 print(f"  ⚠ {supplier_id}: Local only (HDFS upload failed)")
+        for name in writer.removed:
+            print(f"  ℹ Removed {name} (no longer in the day's orders)")
+        for hdfs_file, ok in results.items():
+            if not ok:
+                self.exceptions.append({
+                    'type': 'upload_error',
+                    'message': f'HDFS upload of {hdfs_file} failed'
+                })
+        for hdfs_file in writer.failed_deletes:
+            self.exceptions.append({
+                'type': 'delete_error',
+                'message': f'HDFS delete of {hdfs_file} failed'
+            })
         
+        self.metrics.add(rows_in=len(net_demand), rows_out=len(supplier_orders))
         return len(supplier_orders)
     
     def save_exceptions_log(self):
-        """Save exception report"""
+        """Publish the exception stream and its summary (counts and samples per type)"""
+        summary_file = self.exceptions.save()
         if not self.exceptions:
             print("\n✅ No exceptions")
             return
         
-        log_dir = f"{LOCAL_LOGS_DIR}/exceptions"
-        os.makedirs(log_dir, exist_ok=True)
+        counts = ', '.join(f"{kind}={count}" for kind, count in sorted(self.exceptions.counts.items()))
+        print(f"\n⚠️  {len(self.exceptions)} exceptions ({counts}) → {summary_file}")
+    
+    def current_master_fingerprint(self):
+        """Fingerprint of the master tables, on a short connection of its own (the checkpoint opens first)"""
+        if self.master_fingerprint is None:
+            db_conn = create_db_connection()
+            try:
+                self.master_fingerprint = MasterDataCache().fingerprint(db_conn)
+            finally:
+                db_conn.close()
+        return self.master_fingerprint
+    
+    def open_checkpoint(self):
+        """Checkpoint directory for this date, the current raw inputs of the demand window and the master data"""
+        try:
+            dates = list(date_range(*window_dates(self.date_str, self.window_days)))
+            fingerprint = input_fingerprint(dates, self.hdfs if self.engine_name == 'trino' else None,
+                                            extra=(self.engine_name, self.window_days,
+                                                   self.current_master_fingerprint()))
+            self.checkpoint = RunCheckpoint(self.date_str, fingerprint, reset=not self.resume)
+            self.checkpoint.prune()
+        except Exception as e:
+            print(f"⚠ Checkpoints disabled for this run: {e}")
+            self.checkpoint = None
+    
+    def resumable(self, stage):
+        return self.resume and self.checkpoint is not None and self.checkpoint.has(stage)
+    
+    def checkpointed(self, stage, compute, mappings=False, inputs=(), query=False):
+        """
+        Result of compute(), or of the stage's checkpoint when resuming
+        A checkpoint is only restored if every stage in inputs was restored too, and a result is
+        only checkpointed if the stage logged no *_error exception (failed query or upload) and
+        every input was restored or checkpointed; a query stage that logged one fails
+        """
+        if self.resumable(stage) and all(name in self.restored for name in inputs):
+            result, exceptions = self.checkpoint.load(stage)
+            self.exceptions.extend(exceptions)
+            self.metrics.skip()
+            self.restored.add(stage)
+            print(f"\n↷ {stage}: resumed from checkpoint {self.checkpoint.fingerprint}")
+            return result
         
-        log_file = f"{log_dir}/{self.date_str}_exceptions.json"
-        with open(log_file, 'w') as f:
-            json.dump({
-                'date': self.date_str,
-                'exception_count': len(self.exceptions),
-                'exceptions': self.exceptions
-            }, f, indent=2)
+        # Only this stage's exceptions (other stages may be logging concurrently), saved before
+        # the capture file is discarded
+        with self.exceptions.capture() as new_exceptions:
+            result = compute()
+            failed = sorted(kind for kind in new_exceptions.counts if kind.endswith('_error'))
+            if (self.checkpoint and not failed
+                    and all(name in self.restored or name in self.saved for name in inputs)):
+                try:
+                    self.checkpoint.save(stage, result, new_exceptions, mappings)
+                    self.saved.add(stage)
+                except Exception as e:
+                    print(f"  ⚠ Could not checkpoint {stage}: {e}")
+        if failed and query:
+            raise StageError(stage, f"query failed ({', '.join(failed)})")
+        return result
+    
+    def connect_postgres_stage(self):
+        """Graph stage: PostgreSQL, unless master data was passed in or is restored from a checkpoint"""
+        if self.master_data is None and not self.resumable('master_data') and not self.connect_database():
+            raise StageError('connect_postgres', 'cannot proceed without PostgreSQL')
+    
+    def connect_engine_stage(self):
+        """Graph stage: the aggregation engine, unless every query is restored from checkpoints"""
+        queries = ('net_demand',) if self.pushdown else ('orders', 'stock')
+        if all(self.resumable(stage) for stage in queries):
+            return
+        if not self.connect_engine():
+            raise StageError('connect_engine', f"cannot proceed without {self.engine_name} engine")
+    
+    def ingest_stage(self, ingest):
+        """Graph stage: columnar conversion and demand aggregates for today's raw files"""
+        if not ingest or self.engine_name != 'trino' or self.trino_cursor is None:
+            return
+        if self.resumable('ingest'):
+            self.metrics.skip()
+            print(f"\n↷ ingest: resumed from checkpoint {self.checkpoint.fingerprint}")
+        elif self.ingest():
+            if self.checkpoint:
+                self.checkpoint.save('ingest')
+        else:
+            # The queries still run on what is already ingested
+            self.metrics.fail()
+    
+    def master_data_stage(self):
+        """Graph stage: master data (shared by a backfill, restored, or loaded from PostgreSQL)"""
+        if self.master_data:
+            # Passed in again on every run, so it counts as restored
+            self.restored.add('master_data')
+        products, rules, pos_warehouses = self.master_data or self.checkpointed(
+            'master_data', self.load_master_data, mappings=True)
+        self.metrics.add(rows_in=len(products) + len(rules) + len(pos_warehouses))
+        return products, rules, pos_warehouses
+    
+    def connect_engine(self):
+        """Set up the aggregation engine (Trino tables are created only if self.ensure_tables)"""
+        if self.engine_name == 'local':
+            self.engine = LocalEngine()
+            print(f"✓ Using local engine on {self.engine.raw_dir}")
+            connected = True
+        else:
+            connected = self.connect_trino(ensure_tables=self.ensure_tables)
         
-        print(f"\n⚠️  {len(self.exceptions)} exceptions → {log_file}")
+        # Aggregations over unchanged inputs are answered from the query result cache
+        if connected and self.query_cache:
+            try:
+                cache = QueryResultCache()
+                cache.prune()
+                self.engine = CachedEngine(self.engine, cache, self.hdfs)
+            except Exception as e:
+                print(f"⚠ Query result cache unavailable: {e}")
+        return connected
     
-    def run(self):
-        """Execute pipeline with Trino"""
+    def cancel_queries(self, *targets):
+        """
+        Stage timeout hook: cancel what is still running on these Trino cursors / PostgreSQL
+        connections, so the stage's thread fails fast instead of using them after close()
+        """
+        for target in targets:
+            if target is None:
+                continue
+            try:
+                target.cancel()
+            except Exception as e:
+                # Nothing running on it any more
+                print(f"  ⚠ Could not cancel query: {e}")
+    
+    def close(self):
+        """Release connections owned by this pipeline"""
+        if self.trino_cursor:
+            self.trino_cursor.close()
+        if self.stock_cursor:
+            self.stock_cursor.close()
+        if self.trino_conn and self.owns_trino:
+            self.trino_conn.close()
+        if self.db_conn and self.owns_db:
+            self.db_conn.close()
+        if self.owns_hdfs:
+            self.hdfs.close()
+        self.exceptions.close()
+    
+    def run(self, ingest=True):
+        """Execute pipeline with the configured engine"""
         print("="*70)
-        print(f"PROCUREMENT PIPELINE (TRINO MODE) - {self.date_str}")
+        print(f"PROCUREMENT PIPELINE ({self.engine_name.upper()} MODE{', PUSHDOWN' if self.pushdown else ''}) "
+              f"- {self.date_str}")
         print("="*70)
         
-        # Connect to databases
-        if not self.connect_database():
-            return False
+        # Stages start as soon as their dependencies are done: the PostgreSQL and Trino
+        # branches overlap, and so do the orders and stock queries (on separate cursors)
+        # When resuming, connections are only opened if a remaining stage needs them
+        after_checkpoint = ('checkpoint',) if self.resume else ()
+        graph = StageGraph(self.metrics, max_workers=PIPELINE_STAGE_WORKERS, timeouts=STAGE_TIMEOUTS)
+        graph.add('checkpoint', lambda r: self.open_checkpoint())
+        # A timed-out query stage has its query cancelled (cursors exist once connect_engine ran)
+        cancel_trino = lambda: self.cancel_queries(self.trino_cursor)
+        graph.add('connect_engine', lambda r: self.connect_engine_stage(), after_checkpoint, on_timeout=cancel_trino)
+        graph.add('ingest', lambda r: self.ingest_stage(ingest), ('checkpoint', 'connect_engine'),
+                  on_timeout=cancel_trino)
+        if self.pushdown:
+            # Trino reads the master data through its PostgreSQL catalog
+            graph.add('net_demand', lambda r: self.checkpointed(
+                'net_demand', self.calculate_net_demand_pushdown, mappings=True, query=True), ('ingest',),
+                on_timeout=cancel_trino)
+        else:
+            graph.add('connect_postgres', lambda r: self.connect_postgres_stage(), after_checkpoint)
+            graph.add('load_master_data', lambda r: self.master_data_stage(), ('checkpoint', 'connect_postgres'),
+                      on_timeout=lambda: self.cancel_queries(self.db_conn))
+            graph.add('orders', lambda r: self.checkpointed(
+                'orders', self.get_historical_orders_via_trino, mappings=True, query=True), ('ingest',),
+                on_timeout=cancel_trino)
+            graph.add('stock', lambda r: self.checkpointed(
+                'stock', self.get_latest_stock_via_trino, mappings=True, query=True), ('ingest',),
+                on_timeout=lambda: self.cancel_queries(self.stock_cursor))
+            graph.add('net_demand', lambda r: self.checkpointed('net_demand', lambda: self.calculate_net_demand(
+                r['orders'], r['stock'], *r['load_master_data']), mappings=True,
+                inputs=('master_data', 'orders', 'stock')), ('load_master_data', 'orders', 'stock'))
+        graph.add('supplier_orders', lambda r: self.checkpointed(
+            'supplier_orders', lambda: self.generate_supplier_orders(r['net_demand']), inputs=('net_demand',)),
+            ('net_demand',))
+        graph.add('exceptions_log', lambda r: self.save_exceptions_log(), ('supplier_orders',))
         
-        if not self.connect_trino():
-            print("\n⚠️  Cannot proceed without Trino connection")
+        results, errors = graph.run()
+        if errors:
+            for error in errors.values():
+                if error.status != 'skipped':
+                    print(f"\n✗ Stage {error}")
+            print(f"\n⚠️  Pipeline stopped: {len(errors)} stages failed or were not run")
+            if errors.get('exceptions_log') and errors['exceptions_log'].status == 'skipped':
+                self.save_exceptions_log()
+            self.close()
+            self.metrics.finish('error')
             return False
-        
-        # Load master data
-        products, rules = self.load_master_data()
-        
-        # Query historical data via Trino
-        historical_orders = self.get_historical_orders_via_trino()
-        current_stock = self.get_latest_stock_via_trino()
-        
-        # Calculate and generate orders
-        net_demand = self.calculate_net_demand(historical_orders, current_stock, products, rules)
-        supplier_count = self.generate_supplier_orders(net_demand)
-        
-        # Log exceptions
-        self.save_exceptions_log()
+        net_demand = results['net_demand']
+        supplier_count = results['supplier_orders']
         
         # Cleanup
-        if self.trino_cursor:
-            self.trino_cursor.close()
-        if self.trino_conn:
-            self.trino_conn.close()
-        self.db_conn.close()
+        self.close()
+        self.metrics.finish('ok')
         
         print("\n" + "="*70)
         print("✅ PIPELINE COMPLETED!")
         print("="*70)
 
 # Calculate totals
-        total_orders = sum(historical_orders.values())
         total_units_needed = sum(d['final_quantity'] for d in net_demand.values())
 
         # AFFICAHGE
         print(f"\n📦 Procurement Results:")
-        print(f"  - SKUs needing replenishment: {len(net_demand)}")
+        print(f"  - SKU/warehouse pairs needing replenishment: {len(net_demand)}")
         print(f"  - Total units to order: {total_units_needed:,}")
         print(f"  - Supplier order files: {supplier_count}")
         print(f"\n⚠️  Quality:")
@@ -501,16 +928,143 @@ class ProcurementPipeline:
         return True
 
 
+def run_backfill(dates, window_days=DEMAND_WINDOW_DAYS, engine=PIPELINE_ENGINE, workers=BACKFILL_WORKERS,
+                 resume=False, pushdown=PIPELINE_PUSHDOWN, query_cache=QUERY_CACHE_ENABLED):
+    """
+    Process many dates across a thread pool
+    Master data is loaded once and shared (unless pushed down to Trino), each worker
+    thread keeps one Trino connection
+    """
+    pushdown = pushdown and engine == 'trino'
+    print("="*70)
+    print(f"PROCUREMENT BACKFILL - {len(dates)} dates ({dates[0]} → {dates[-1]}), {workers} workers")
+    print("="*70)
+    
+    # Load master data and create tables once
+    metrics = RunMetrics('backfill', dates[-1])
+    with metrics.stage('setup'):
+        setup = ProcurementPipeline(dates[0], window_days, engine, metrics=metrics)
+        master_data = master_fingerprint = None
+        if not pushdown:
+            if not setup.connect_database():
+                metrics.finish('error')
+                return False
+            # Taken before loading, so checkpoints never pair newer master data with an older fingerprint
+            try:
+                master_fingerprint = setup.current_master_fingerprint()
+            except Exception as e:
+                print(f"⚠ Master data fingerprint unavailable: {e}")
+            master_data = setup.load_master_data()
+        if engine == 'trino' and not setup.connect_trino():
+            setup.close()
+            metrics.finish('error')
+            return False
+        setup.close()
+    
+    # Every date's HDFS calls are recorded on the backfill's metrics
+    hdfs = WebHDFSClient(HDFS_NAMENODE_URL, user=HDFS_USER)
+    hdfs.metrics = metrics
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+    
+    def worker_pipeline(date_str, run_metrics=None, resume=False):
+        conn = None
+        if engine == 'trino':
+            conn = getattr(local, 'trino_conn', None)
+            if conn is None:
+                conn = local.trino_conn = create_trino_connection()
+                with lock:
+                    connections.append(conn)
+        return ProcurementPipeline(date_str, window_days, engine,
+                                   master_data=master_data, trino_conn=conn, hdfs=hdfs, metrics=run_metrics,
+                                   resume=resume, query_cache=query_cache, pushdown=pushdown,
+                                   master_fingerprint=master_fingerprint)
+    
+    def ingest(date_str):
+        pipeline = worker_pipeline(date_str, RunMetrics('ingest', date_str))
+        ok = False
+        try:
+            with pipeline.metrics.stage('ingest'):
+                ok = pipeline.connect_trino(ensure_tables=False) and pipeline.ingest()
+            return ok
+        finally:
+            pipeline.close()
+            pipeline.metrics.finish('ok' if ok else 'error')
+    
+    def process(date_str):
+        try:
+            return worker_pipeline(date_str, resume=resume).run(ingest=False)
+        except Exception as e:
+            print(f"✗ {date_str} failed: {e}")
+            return False
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Every date's aggregates must exist before any multi-day window is read
+        if engine == 'trino':
+            with metrics.stage('ingest'):
+                list(executor.map(ingest, dates))
+        with metrics.stage('process'):
+            results = dict(zip(dates, executor.map(process, dates)))
+    
+    for conn in connections:
+        conn.close()
+    hdfs.close()
+    
+    failed = [date_str for date_str, ok in results.items() if not ok]
+    metrics.add('process', rows_in=len(dates), rows_out=len(dates) - len(failed))
+    metrics.finish('error' if failed else 'ok')
+    print("\n" + "="*70)
+    print(f"BACKFILL DONE: {len(dates) - len(failed)}/{len(dates)} dates succeeded")
+    for date_str in failed:
+        print(f"  ✗ {date_str}")
+    print("="*70)
+    return not failed
+
+
 def main():
     parser = argparse.ArgumentParser(description='Run procurement pipeline with Trino')
     parser.add_argument('--date', type=str,
                        default=datetime.now().strftime('%Y-%m-%d'),
                        help='Date to process (YYYY-MM-DD)')
+    parser.add_argument('--start', type=str, help='Backfill: first date to process (YYYY-MM-DD)')
+    parser.add_argument('--end', type=str, help='Backfill: last date to process (YYYY-MM-DD)')
+    parser.add_argument('--dates', type=str, help='Backfill: comma-separated dates to process')
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS,
+                       help='Backfill: number of dates processed concurrently')
+    parser.add_argument('--window-days', type=int, default=DEMAND_WINDOW_DAYS,
+                       help='Number of days of demand to aggregate, ending on --date')
+    parser.add_argument('--engine', choices=ENGINES, default=PIPELINE_ENGINE,
+                       help='Aggregation engine: trino (HDFS) or local (data/raw files)')
+    parser.add_argument('--no-ingest', action='store_true',
+                       help='Skip partition registration and ORC/aggregate refresh (already done)')
+    parser.add_argument('--resume', action='store_true',
+                       help='Reuse the stages a previous run with the same inputs completed')
+    parser.add_argument('--no-query-cache', action='store_true',
+                       help='Always run the orders and stock aggregations (ignore cached results)')
+    parser.add_argument('--pushdown', action='store_true', default=PIPELINE_PUSHDOWN,
+                       help='Compute net demand in Trino with one federated query (trino engine only)')
     
     args = parser.parse_args()
+    if args.pushdown and args.engine != 'trino':
+        parser.error('--pushdown needs the trino engine')
     
-    pipeline = ProcurementPipeline(args.date)
-    success = pipeline.run()
+    if args.dates or args.start or args.end:
+        if args.dates:
+            dates = sorted({d.strip() for d in args.dates.split(',') if d.strip()})
+        elif args.start and args.end:
+            dates = list(date_range(args.start, args.end))
+        else:
+            parser.error('--start and --end must be given together')
+        if not dates:
+            parser.error('no dates to process')
+        success = run_backfill(dates, args.window_days, args.engine, max(1, args.workers), args.resume,
+                               args.pushdown, query_cache=not args.no_query_cache)
+    else:
+        pipeline = ProcurementPipeline(args.date, window_days=args.window_days, engine=args.engine,
+                                       resume=args.resume, query_cache=not args.no_query_cache,
+                                       pushdown=args.pushdown)
+        success = pipeline.run(ingest=not args.no_ingest)
     
     if not success:
         exit(1)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Net-Demand Pushdown
+Computes net demand in Trino with one federated query joining the demand
+aggregates and stock snapshot in Hive with products, replenishment rules and
+points of sale read through the PostgreSQL catalog. Only the rows the pipeline
+keeps (positive demand, missing products, spikes, top calculations) come back
+"""
+
+import os
+from aggregates import DEMAND_TABLE, window_dates
+from columnar import STOCK_TABLE
+from net_demand import DEFAULT_WAREHOUSE, DEFAULT_SAFETY_STOCK, SPIKE_FACTOR
+
+# Configuration
+TRINO_PG_CATALOG = os.getenv('TRINO_PG_CATALOG', 'postgresql')
+TRINO_PG_SCHEMA = os.getenv('TRINO_PG_SCHEMA', 'public')
+PUSHDOWN_FETCH_SIZE = int(os.getenv('PUSHDOWN_FETCH_SIZE', '1000'))
+TOP_CALCULATIONS = 5
+
+
+def _sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class PushdownNetDemand:
+    """
+    Same rules as net_demand.NetDemandEngine, evaluated by Trino:
+        net_demand = max(0, orders + safety_stock - (available - reserved))
+    with orders attributed to the warehouse serving each POS
+    """
+
+    def __init__(self, cursor, catalog=TRINO_PG_CATALOG, schema=TRINO_PG_SCHEMA, fetch_size=PUSHDOWN_FETCH_SIZE):
+        self.cursor = cursor
+        self.master = f"{catalog}.{schema}"
+        self.fetch_size = fetch_size
+
+    def query(self, date_str, window_days, snapshots=None):
+        """snapshots: {warehouse_id: {'date', ...}} from the snapshot catalog, None = latest partition"""
+        start, end = window_dates(date_str, window_days)
+        if snapshots is None:
+            latest = f"""
+            SELECT MAX(snapshot_date) AS snapshot_date
+            FROM "{STOCK_TABLE}$partitions"
+            WHERE snapshot_date <= DATE '{date_str}'"""
+            stock_filter = "snapshot_date = (SELECT snapshot_date FROM latest)"
+        elif snapshots:
+            latest = f"SELECT DATE '{max(s['date'] for s in snapshots.values())}' AS snapshot_date"
+            stock_filter = ' OR '.join(
+                f"(snapshot_date = DATE '{snapshot['date']}' AND warehouse_id = {_sql_string(warehouse_id)})"
+                for warehouse_id, snapshot in sorted(snapshots.items()))
+        else:
+            latest = "SELECT CAST(NULL AS DATE) AS snapshot_date"
+            stock_filter = "FALSE"
+        return f"""
+        WITH latest AS (
+            {latest.strip()}
+        ),
+        pos AS (
+            SELECT pos_id, warehouse_id FROM {self.master}.points_of_sale WHERE active = TRUE
+        ),
+        catalog_products AS (
+            SELECT p.sku, p.product_name, p.supplier_id, p.case_size
+            FROM {self.master}.products p
+            JOIN {self.master}.suppliers s ON p.supplier_id = s.supplier_id
+            WHERE p.active = TRUE AND s.active = TRUE
+        ),
+        active_rules AS (
+            SELECT sku, warehouse_id, safety_stock, minimum_order_quantity,
+                   maximum_order_quantity, reorder_point
+            FROM {self.master}.replenishment_rules
+            WHERE active = TRUE
+        ),
+        orders AS (
+            SELECT d.sku, COALESCE(pos.warehouse_id, '{DEFAULT_WAREHOUSE}') AS warehouse_id,
+                   SUM(d.total_quantity) AS demand, COUNT(DISTINCT d.pos_id) AS order_keys
+            FROM {DEMAND_TABLE} d
+            LEFT JOIN pos ON d.pos_id = pos.pos_id
+            WHERE d.order_date BETWEEN DATE '{start}' AND DATE '{end}'
+            GROUP BY d.sku, COALESCE(pos.warehouse_id, '{DEFAULT_WAREHOUSE}')
+        ),
+        stock AS (
+            SELECT sku, warehouse_id,
+                   COALESCE(SUM(available_stock), 0) - COALESCE(SUM(reserved_stock), 0) AS available_stock,
+                   COALESCE(MAX(safety_stock), 0) AS safety_stock
+            FROM {STOCK_TABLE}
+            WHERE {stock_filter}
+            GROUP BY sku, warehouse_id
+        ),
+        cells AS (
+            SELECT COALESCE(o.sku, s.sku) AS sku,
+                   COALESCE(o.warehouse_id, s.warehouse_id) AS warehouse_id,
+                   COALESCE(o.demand, 0) AS demand,
+                   COALESCE(o.order_keys, 0) AS order_keys,
+                   s.sku IS NOT NULL AS has_stock,
+                   COALESCE(s.available_stock, 0) AS available_stock,
+                   s.safety_stock AS stock_safety
+            FROM orders o
+            FULL OUTER JOIN stock s ON o.sku = s.sku AND o.warehouse_id = s.warehouse_id
+        ),
+        rated AS (
+            SELECT c.sku, c.warehouse_id, c.demand, c.order_keys, c.has_stock, c.available_stock,
+                   p.sku IS NOT NULL AS known,
+                   p.sku IS NOT NULL AND (c.has_stock OR c.demand > 0) AS active,
+                   p.product_name, p.supplier_id,
+                   GREATEST(COALESCE(p.case_size, 1), 1) AS case_size,
+                   CASE WHEN c.has_stock THEN c.stock_safety
+                        WHEN r.sku IS NOT NULL THEN r.safety_stock
+                        ELSE {DEFAULT_SAFETY_STOCK} END AS safety_stock,
+                   CASE WHEN r.minimum_order_quantity > 0 THEN r.minimum_order_quantity ELSE 1 END AS moq,
+                   r.maximum_order_quantity AS max_oq,
+                   r.reorder_point
+            FROM cells c
+            LEFT JOIN catalog_products p ON c.sku = p.sku
+            LEFT JOIN active_rules r ON c.sku = r.sku AND c.warehouse_id = r.warehouse_id
+        ),
+        net AS (
+            SELECT *,
+                   CASE WHEN NOT active THEN 0
+                        -- Only order when the projected position has fallen to the reorder point
+                        WHEN reorder_point >= 0 AND available_stock - demand > reorder_point THEN 0
+                        ELSE GREATEST(0, demand + safety_stock - available_stock) END AS net_demand
+            FROM rated
+        ),
+        ranked AS (
+            SELECT *,
+                   (net_demand + case_size - 1) / case_size * case_size AS rounded_demand,
+                   active AND net_demand > safety_stock * {SPIKE_FACTOR} AS spike,
+                   ROW_NUMBER() OVER (ORDER BY active DESC, net_demand DESC, sku, warehouse_id) AS net_rank,
+                   SUM(demand) OVER () AS total_demand,
+                   SUM(order_keys) OVER () AS total_order_keys,
+                   COUNT_IF(has_stock) OVER () AS total_stock_keys
+            FROM net
+        )
+        SELECT sku, warehouse_id, known, active, spike, net_rank,
+               product_name, supplier_id, demand, available_stock, safety_stock,
+               net_demand, rounded_demand,
+               CASE WHEN max_oq > 0 THEN LEAST(GREATEST(rounded_demand, moq), max_oq)
+                    ELSE GREATEST(rounded_demand, moq) END AS final_quantity,
+               case_size, moq,
+               CASE WHEN max_oq > 0 THEN max_oq END AS max_order_quantity,
+               total_demand, total_order_keys, total_stock_keys,
+               (SELECT snapshot_date FROM latest) AS snapshot_date
+        FROM ranked
+        -- The first ranked row is always kept: it carries the totals
+        WHERE net_demand > 0 OR NOT known OR spike OR net_rank <= {TOP_CALCULATIONS}
+        ORDER BY sku, warehouse_id
+        """
+
+    def rows(self, date_str, window_days, snapshots=None):
+        """Yield the result rows, fetched fetch_size at a time"""
+        self.cursor.execute(self.query(date_str, window_days, snapshots))
+        while True:
+            batch = self.cursor.fetchmany(self.fetch_size)
+            if not batch:
+                return
+            yield from batch
+
+    def compute(self, date_str, window_days, snapshots=None):
+        """
+        Returns (net_demand {(sku, warehouse_id): item}, exceptions, top calculations, totals)
+        like NetDemandEngine.compute, plus the window's totals:
+        {'rows', 'total_demand', 'order_keys', 'stock_keys', 'snapshot_date'}
+        """
+        net_demand = {}
+        missing = set()
+        spikes = []
+        top = []
+        totals = {'rows': 0, 'total_demand': 0, 'order_keys': 0, 'stock_keys': 0, 'snapshot_date': None}
+
+        for (sku, warehouse_id, known, active, spike, net_rank, product_name, supplier_id, demand,
+             available_stock, safety_stock, net, rounded, final, case_size, moq, max_oq,
+             total_demand, order_keys, stock_keys, snapshot_date) in self.rows(date_str, window_days, snapshots):
+            if not totals['rows']:
+                totals.update(total_demand=total_demand or 0, order_keys=order_keys, stock_keys=stock_keys,
+                              snapshot_date=str(snapshot_date) if snapshot_date else None)
+            totals['rows'] += 1
+
+            if not known:
+                missing.add(sku)
+            if spike:
+                spikes.append({
+                    'type': 'demand_spike',
+                    'sku': sku,
+                    'warehouse_id': warehouse_id,
+                    'net_demand': net,
+                    'safety_stock': safety_stock
+                })
+            if active and net_rank <= TOP_CALCULATIONS:
+                top.append((net_rank, {
+                    'sku': sku,
+                    'warehouse_id': warehouse_id,
+                    'total_orders': demand,
+                    'available_stock': available_stock,
+                    'safety_stock': safety_stock,
+                    'net_demand': net
+                }))
+            if net > 0:
+                net_demand[(sku, warehouse_id)] = {
+                    'sku': sku,
+                    'warehouse_id': warehouse_id,
+                    'product_name': product_name,
+                    'supplier_id': supplier_id,
+                    'historical_orders': demand,
+                    'current_stock': available_stock,
+                    'safety_stock': safety_stock,
+                    'raw_demand': net,
+                    'rounded_demand': rounded,
+                    'final_quantity': final,
+                    'case_size': case_size,
+                    'moq': moq,
+                    'max_order_quantity': max_oq
+                }
+
+        exceptions = [{
+            'type': 'missing_product',
+            'sku': sku,
+            'message': f'SKU {sku} not in product catalog'
+        } for sku in sorted(missing)]
+        exceptions.extend(spikes)
+        details = [detail for _, detail in sorted(top, key=lambda entry: entry[0])]
+        return net_demand, exceptions, details, totals
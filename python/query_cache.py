@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Query Result Cache
+Keeps the results of the orders and stock aggregations keyed by the query and a
+fingerprint of its raw input files, so re-runs over unchanged data skip the scan.
+Any added, removed or rewritten file under a queried date changes the
+fingerprint and turns the entry into a miss
+"""
+
+import os
+import json
+import time
+import hashlib
+from aggregates import date_range
+from checkpoints import input_fingerprint, IngestState
+from engines import DATA_DIR, QueryRows
+
+# Configuration
+QUERY_CACHE_DIR = os.getenv('QUERY_CACHE_DIR', f"{DATA_DIR}/cache/query_results")
+QUERY_CACHE_ENABLED = os.getenv('QUERY_CACHE_ENABLED', '1') == '1'
+QUERY_CACHE_RETENTION_DAYS = int(os.getenv('QUERY_CACHE_RETENTION_DAYS', '30'))
+
+
+class QueryResultCache:
+    """One JSON file per query holding the input fingerprint it was computed from and its rows"""
+
+    def __init__(self, cache_dir=QUERY_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, query):
+        return f"{self.cache_dir}/{hashlib.sha256(json.dumps(query).encode()).hexdigest()[:24]}.json"
+
+    def get(self, query, fingerprint):
+        """Cached rows, or None if the query was never run on these exact inputs"""
+        path = self._path(query)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['fingerprint'] != fingerprint:
+            return None
+        return [tuple(row) for row in entry['rows']]
+
+    def put(self, query, fingerprint, rows):
+        """Replace the query's entry (written under a temp name and renamed)"""
+        path = self._path(query)
+        with open(f"{path}.{os.getpid()}.tmp", 'w') as f:
+            json.dump({'query': query, 'fingerprint': fingerprint, 'rows': [list(row) for row in rows]}, f)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def prune(self, retention_days=QUERY_CACHE_RETENTION_DAYS):
+        """Drop entries not refreshed for retention_days"""
+        cutoff = time.time() - retention_days * 86400
+        for name in os.listdir(self.cache_dir):
+            path = f"{self.cache_dir}/{name}"
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+
+class CachedEngine:
+    """
+    Engine proxy answering orders_by_sku_pos and the stock aggregations from the cache
+    Results are fingerprinted on the raw files of the queried dates only. Trino reads the
+    ORC partitions and aggregates built from them, so its results are only cached when
+    every queried date was ingested from exactly those raw files
+    """
+
+    def __init__(self, engine, cache, hdfs=None, ingest_state=None):
+        self.engine = engine
+        self.cache = cache
+        self.hdfs = hdfs
+        self.ingest_state = ingest_state or IngestState()
+        self.name = engine.name
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def _fingerprint(self, kind, dates):
+        """(fingerprint, whether results computed now may be cached)"""
+        if self.name != 'trino':
+            return input_fingerprint(dates, raw_dir=self.engine.raw_dir, kinds=(kind,)), True
+        per_date = [input_fingerprint([date_str], self.hdfs, kinds=(kind,)) for date_str in dates]
+        ingested = all(self.ingest_state.get(date_str).get(kind) == fingerprint
+                       for date_str, fingerprint in zip(dates, per_date))
+        return hashlib.sha256('\n'.join(per_date).encode()).hexdigest()[:16], ingested
+
+    def _cached(self, query, fingerprint, compute):
+        """QueryRows from the cache (cache_hit=True) or from compute(), then cached if allowed"""
+        fingerprint, cacheable = fingerprint
+        rows = self.cache.get(query, fingerprint)
+        if rows is not None:
+            return QueryRows(rows, cache_hit=True)
+        rows = compute()
+        if cacheable:
+            self.cache.put(query, fingerprint, rows)
+        return rows
+
+    def orders_by_sku_pos(self, start, end):
+        fingerprint = self._fingerprint('orders', list(date_range(start, end)))
+        return self._cached([self.name, 'orders_by_sku_pos', start, end], fingerprint,
+                            lambda: self.engine.orders_by_sku_pos(start, end))
+
+    def stock_by_warehouse(self, snapshot_date):
+        fingerprint = self._fingerprint('stock', [snapshot_date])
+        return self._cached([self.name, 'stock_by_warehouse', snapshot_date], fingerprint,
+                            lambda: self.engine.stock_by_warehouse(snapshot_date))
+
+    def stock_by_snapshots(self, snapshots):
+        dates = sorted({snapshot['date'] for snapshot in snapshots.values()})
+        fingerprint = self._fingerprint('stock', dates)
+        query = [self.name, 'stock_by_snapshots', sorted([wh, snapshot['date']] for wh, snapshot in snapshots.items())]
+        return self._cached(query, fingerprint, lambda: self.engine.stock_by_snapshots(snapshots))
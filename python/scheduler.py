@@ -2,82 +2,243 @@
 """
 Procurement Pipeline Scheduler
 Runs the pipeline automatically at scheduled time (22:00-23:00)
+
+Steps run in-process by default, reusing warm PostgreSQL / Trino / WebHDFS
+connections between runs; SCHEDULER_EXECUTION=subprocess runs the generator and
+pipeline.py as child processes instead (isolation fallback)
+
+SCHEDULER_MODE=watch processes landing files in micro-batches as they arrive
+(normalize, upload, append the new files to the day's ORC and demand aggregates), so the
+22:00 job only finalizes the day
 """
 
-import requests
 import schedule
 import time
 import subprocess
 import logging
+import argparse
+import contextlib
+import threading
 from datetime import datetime
 import os
+from hdfs_client import WebHDFSClient
+from engines import DATA_DIR, RAW_DATA_DIR
+from normalize_orders import normalize_day, load_known_skus
+from dedup_index import OrderIdIndex
+from metrics import RunMetrics
+from watcher import LandingWatcher, WATCH_SOURCES, WATCH_EVENTS
+from compaction import run_compaction
+from snapshot_catalog import record_snapshots
+from pipeline import ProcurementPipeline, create_db_connection, create_trino_connection, PIPELINE_ENGINE
+import generate_data_realistic
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('/data/logs/scheduler.log'),
+        logging.FileHandler(f'{DATA_DIR}/logs/scheduler.log'),
         logging.StreamHandler()
     ]
 )
 
 logger = logging.getLogger(__name__)
 
-def upload_to_hdfs(date_str):
-    """Upload generated data to HDFS using WebHDFS API"""
+# Shared WebHDFS client (keeps connections warm between runs)
+hdfs_client = WebHDFSClient(os.getenv('HDFS_URL', 'http://namenode:9870'), user='root')
+
+SCHEDULER_EXECUTION = os.getenv('SCHEDULER_EXECUTION', 'inprocess')
+EXECUTION_MODES = ('inprocess', 'subprocess')
+
+SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'batch')
+SCHEDULER_MODES = ('batch', 'watch')
+# Watch mode: landing files are polled locally or on HDFS (already uploaded by the producers)
+WATCH_SOURCE = os.getenv('WATCH_SOURCE', 'local')
+WATCH_POLL_SECONDS = int(os.getenv('WATCH_POLL_SECONDS', '30'))
+# A day with new files is re-ingested into Trino at most this often before the nightly finalize
+MICROBATCH_MIN_INTERVAL = int(os.getenv('MICROBATCH_MIN_INTERVAL', '900'))
+# Daily time (HH:MM) of the raw small-file compaction of closed days, empty to disable it
+# Each compacted day's partition is re-registered at its new version (two back-to-back metastore
+# calls), so a query planned right in between misses the day: pick a time no pipeline run overlaps
+COMPACTION_TIME = os.getenv('COMPACTION_TIME', '')
+
+
+class WarmConnections:
+    """PostgreSQL and Trino connections kept open between in-process runs"""
+
+    def __init__(self):
+        self.db_conn = None
+        self.trino_conn = None
+        self.tables_ready = False
+
+    def postgres(self):
+        """Live PostgreSQL connection, reconnecting if the previous one went away"""
+        if self.db_conn is not None:
+            try:
+                cursor = self.db_conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                self.db_conn.rollback()
+                return self.db_conn
+            except Exception as e:
+                logger.warning(f"PostgreSQL connection lost ({e}), reconnecting")
+                self._close_postgres()
+        self.db_conn = create_db_connection()
+        return self.db_conn
+
+    def trino(self):
+        if self.trino_conn is None:
+            self.trino_conn = create_trino_connection()
+        return self.trino_conn
+
+    def release(self):
+        """End the open read transaction so the idle connection holds no snapshot"""
+        if self.db_conn is not None:
+            try:
+                self.db_conn.rollback()
+            except Exception:
+                self._close_postgres()
+
+    def _close_postgres(self):
+        try:
+            self.db_conn.close()
+        except Exception:
+            pass
+        self.db_conn = None
+
+    def reset(self):
+        """Drop every connection (after a failed run)"""
+        if self.db_conn is not None:
+            self._close_postgres()
+        if self.trino_conn is not None:
+            try:
+                self.trino_conn.close()
+            except Exception:
+                pass
+            self.trino_conn = None
+        self.tables_ready = False
+
+
+warm = WarmConnections()
+
+
+def warm_postgres():
+    """Warm PostgreSQL connection, or None (callers fall back to their own) if it cannot be opened"""
+    try:
+        return warm.postgres()
+    except Exception as e:
+        logger.warning(f"PostgreSQL unavailable: {e}")
+        return None
+
+
+class LogWriter:
+    """File-like object sending each printed line to the scheduler log as it is written"""
+
+    def __init__(self, log):
+        self.log = log
+        self.buffer = ''
+        # Pipeline stages print from several threads
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self.buffer += text
+            while '\n' in self.buffer:
+                line, self.buffer = self.buffer.split('\n', 1)
+                if line.strip():
+                    self.log.info(line)
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            if self.buffer.strip():
+                self.log.info(self.buffer)
+            self.buffer = ''
+
+
+def run_subprocess(args):
+    """Run a script in a child interpreter, logging its output line by line while it runs"""
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                               env=dict(os.environ, PYTHONUNBUFFERED='1'))
+    for line in process.stdout:
+        if line.strip():
+            logger.info(line.rstrip())
+    return process.wait() == 0
+
+
+def generate_data(date_str, execution):
+    """Step 1: write today's raw order and stock files"""
+    if execution == 'subprocess':
+        return run_subprocess(['python', '/app/generate_data_realistic.py', date_str])
+    with contextlib.redirect_stdout(LogWriter(logger)):
+        generate_data_realistic.generate_realistic_orders(date_str)
+        generate_data_realistic.generate_realistic_stock(date_str)
+    return True
+
+
+def run_pipeline(date_str, execution, ingest=True, resume=False):
+    """Step 4: run the procurement pipeline over warm connections (or as pipeline.py)"""
+    if execution == 'subprocess':
+        return run_subprocess(['python', '/app/pipeline.py', '--date', date_str] +
+                              ([] if ingest else ['--no-ingest']) + (['--resume'] if resume else []))
+    try:
+        pipeline = ProcurementPipeline(
+            date_str,
+            db_conn=warm.postgres(),
+            trino_conn=warm.trino() if PIPELINE_ENGINE == 'trino' else None,
+            hdfs=hdfs_client,
+            ensure_tables=not warm.tables_ready,
+            resume=resume
+        )
+        with contextlib.redirect_stdout(LogWriter(logger)):
+            ok = pipeline.run(ingest=ingest)
+        if ok:
+            warm.tables_ready = True
+            warm.release()
+        else:
+            warm.reset()
+        return ok
+    except Exception:
+        warm.reset()
+        raise
+
+def upload_to_hdfs(date_str, paths=None):
+    """Upload generated data (or only the given local paths) to HDFS using WebHDFS API"""
     logger.info(f"Uploading data to HDFS for {date_str}")
     
     try:
-        namenode_url = "http://namenode:9870/webhdfs/v1"
+        hdfs_client.reset_directory_cache()
+        files = []
         
-        # Upload orders directory
-        orders_path = f"/data/raw/orders/{date_str}"
-        if os.path.exists(orders_path):
-            for filename in os.listdir(orders_path):
-                if filename.endswith('.json'):
-                    local_file = f"{orders_path}/{filename}"
-                    hdfs_path = f"/data/raw/orders/{date_str}/{filename}"
-                    
-                    # Create directory
-                    requests.put(f"{namenode_url}/data/raw/orders/{date_str}?op=MKDIRS&user.name=root")
-                    
-                    # Upload file
-                    with open(local_file, 'rb') as f:
-                        data = f.read()
-                    
-                    # Get redirect URL
-                    create_url = f"{namenode_url}{hdfs_path}?op=CREATE&overwrite=true&user.name=root"
-                    resp = requests.put(create_url, allow_redirects=False)
-                    
-                    if resp.status_code == 307:
-                        upload_url = resp.headers['Location']
-                        requests.put(upload_url, data=data)
-                        logger.info(f"  ✓ Uploaded {filename}")
+        # Collect orders and stock files
+        for kind, extension in (('orders', '.json'), ('stock', '.csv')):
+            local_path = f"{RAW_DATA_DIR}/{kind}/{date_str}"
+            if not os.path.exists(local_path):
+                continue
+            for filename in sorted(os.listdir(local_path)):
+                if filename.endswith(extension) and (paths is None or f"{local_path}/{filename}" in paths):
+                    files.append((f"{local_path}/{filename}", f"/data/raw/{kind}/{date_str}/{filename}"))
         
-        # Upload stock directory
-        stock_path = f"/data/raw/stock/{date_str}"
-        if os.path.exists(stock_path):
-            for filename in os.listdir(stock_path):
-                if filename.endswith('.csv'):
-                    local_file = f"{stock_path}/{filename}"
-                    hdfs_path = f"/data/raw/stock/{date_str}/{filename}"
-                    
-                    # Create directory
-                    requests.put(f"{namenode_url}/data/raw/stock/{date_str}?op=MKDIRS&user.name=root")
-                    
-                    # Upload file
-                    with open(local_file, 'rb') as f:
-                        data = f.read()
-                    
-                    # Get redirect URL
-                    create_url = f"{namenode_url}{hdfs_path}?op=CREATE&overwrite=true&user.name=root"
-                    resp = requests.put(create_url, allow_redirects=False)
-                    
-                    if resp.status_code == 307:
-                        upload_url = resp.headers['Location']
-                        requests.put(upload_url, data=data)
-                        logger.info(f"  ✓ Uploaded {filename}")
+        # Upload concurrently over pooled connections
+        results = hdfs_client.upload_files(files)
+        failed = [path for path, ok in results.items() if not ok]
+        for path, ok in results.items():
+            if ok:
+                logger.info(f"  ✓ Uploaded {os.path.basename(path)}")
+        
+        # Index the uploaded stock snapshots per warehouse for the pipeline's stock lookup
+        stock_files = [local for local, hdfs_path in files
+                       if hdfs_path.startswith('/data/raw/stock/') and results.get(hdfs_path)]
+        if stock_files:
+            try:
+                counts = record_snapshots(date_str, stock_files)
+                logger.info(f"  ✓ Snapshot catalog: {len(counts)} warehouses for {date_str}")
+            except Exception as e:
+                logger.warning(f"  ⚠ Could not update the snapshot catalog: {e}")
+        
+        if failed:
+            logger.error(f"✗ {len(failed)}/{len(files)} files failed to upload")
+            return False
         
         logger.info(f"✓ HDFS upload completed")
         return True
@@ -87,54 +248,66 @@ def upload_to_hdfs(date_str):
         return False
 
 
-def run_daily_pipeline():
+def run_daily_pipeline(date_str=None, execution=None, resume=False):
     """Execute the complete daily procurement pipeline"""
     
-    # Get today's date
-    date_str = datetime.now().strftime('%Y-%m-%d')
+    # Today's date unless catching up on an earlier one
+    date_str = date_str or datetime.now().strftime('%Y-%m-%d')
+    execution = execution or SCHEDULER_EXECUTION
     
     logger.info("="*70)
-    logger.info(f"STARTING DAILY PROCUREMENT PIPELINE - {date_str}")
+    logger.info(f"STARTING DAILY PROCUREMENT PIPELINE - {date_str} ({execution})")
     logger.info("="*70)
     
+    # Step timings, row counts and HDFS calls for this run
+    metrics = RunMetrics('scheduler', date_str)
+    hdfs_client.metrics = metrics
+    status = 'error'
+    
     try:
         # Step 1: Generate data
-        logger.info("Step 1/3: Generating test data...")
-        result = subprocess.run(
-            ['python', '/app/generate_data_realistic.py', date_str], 
-            capture_output=True,
-            text=True
-        )
+        logger.info("Step 1/4: Generating test data...")
+        with metrics.stage('generate'):
+            generated = generate_data(date_str, execution)
         
-        if result.returncode != 0:
-            logger.error(f"Data generation failed: {result.stderr}")
-            logger.error(f"Output: {result.stdout}")
+        if not generated:
+            metrics.fail('generate')
+            logger.error("Data generation failed")
             return
         
         logger.info("✓ Data generation completed")
-        logger.info(result.stdout)
 
-        logger.info("Step 2/3: Uploading to HDFS...")
-        if not upload_to_hdfs(date_str):
+        # Step 2: Validate and normalize raw orders before they reach HDFS
+        logger.info("Step 2/4: Normalizing raw orders...")
+        with metrics.stage('normalize'):
+            known_skus = load_known_skus(warm_postgres() if execution == 'inprocess' else None)
+            report = normalize_day(date_str, known_skus, OrderIdIndex())
+            metrics.add(rows_in=sum(report['totals'].values()), rows_out=report['totals'].get('valid', 0))
+        logger.info(f"✓ {report['totals'].get('valid', 0)} valid orders in {len(report['files'])} files")
+        if report.get('rejected'):
+            reasons = {k: v for k, v in report['totals'].items() if k != 'valid'}
+            logger.warning(f"⚠ {report['rejected']} orders quarantined: {reasons}")
+
+        logger.info("Step 3/4: Uploading to HDFS...")
+        with metrics.stage('upload'):
+            uploaded = upload_to_hdfs(date_str)
+        if not uploaded:
+           metrics.fail('upload')
            logger.error("HDFS upload failed, aborting pipeline")
            return
         logger.info("✓ HDFS upload completed")
 
-        # Step 3: Run pipeline
-        logger.info("Step 3/3: Running procurement pipeline...")
-        result = subprocess.run(
-            ['python', '/app/pipeline.py', '--date', date_str],
-            capture_output=True,
-            text=True
-        )
+        # Step 4: Run pipeline
+        logger.info("Step 4/4: Running procurement pipeline...")
+        with metrics.stage('pipeline'):
+            completed = run_pipeline(date_str, execution, resume=resume)
         
-        if result.returncode != 0:
-            logger.error(f"Pipeline execution failed: {result.stderr}")
-            logger.error(f"Output: {result.stdout}")
+        if not completed:
+            metrics.fail('pipeline')
+            logger.error("Pipeline execution failed")
             return
         
-       
-        logger.info(result.stdout)
+        status = 'ok'
         
        # logger.info("="*70)
        # logger.info("✅ DAILY PIPELINE COMPLETED SUCCESSFULLY")
@@ -145,20 +318,200 @@ def run_daily_pipeline():
         logger.error("="*70)
         logger.error("✗ PIPELINE FAILED")
         logger.error("="*70)
+    finally:
+        hdfs_client.metrics = None
+        log_run_metrics(metrics.finish(status))
+
+
+def log_run_metrics(record):
+    logger.info(f"📊 Run metrics: {record['duration_s']:.1f}s total, " +
+                ', '.join(f"{name} {stage['wall_s']:.1f}s" for name, stage in record['stages'].items()))
+
+
+def ingest_day(date_str, metrics, incremental=False):
+    """
+    Register a day's raw partitions and rebuild its ORC and demand aggregates over warm connections
+    incremental=True only appends the files added since the day's last ingest (when nothing else changed)
+    """
+    if PIPELINE_ENGINE != 'trino':
+        # The local engine reads the raw files directly
+        return True
+    try:
+        pipeline = ProcurementPipeline(
+            date_str,
+            trino_conn=warm.trino(),
+            hdfs=hdfs_client,
+            metrics=metrics,
+            ensure_tables=not warm.tables_ready
+        )
+        with contextlib.redirect_stdout(LogWriter(logger)):
+            ok = pipeline.connect_engine() and pipeline.ingest(incremental)
+            pipeline.close()
+        if ok:
+            warm.tables_ready = True
+        else:
+            warm.reset()
+        return ok
+    except Exception as e:
+        logger.error(f"Ingest of {date_str} failed: {e}")
+        warm.reset()
+        return False
+
+
+def process_micro_batch(watcher, date_str, files, metrics):
+    """Normalize and upload newly landed files of one day (local source) and mark the day for ingestion"""
+    if watcher.source == 'local':
+        orders = [os.path.basename(path) for path in files['orders']]
+        if orders:
+            known_skus = load_known_skus(warm_postgres())
+            report = normalize_day(date_str, known_skus, OrderIdIndex(), filenames=orders)
+            metrics.add(rows_in=sum(sum(report['files'][name].values()) for name in orders),
+                        rows_out=sum(report['files'][name].get('valid', 0) for name in orders))
+        if not upload_to_hdfs(date_str, set(files['orders'] + files['stock'])):
+            return False
+    watcher.mark_processed(files['orders'] + files['stock'])
+    watcher.mark_dirty(date_str)
+    logger.info(f"✓ Micro-batch {date_str}: {len(files['orders'])} order and {len(files['stock'])} stock files")
+    return True
+
+
+def watch_tick(watcher, force=False, settle=None):
+    """
+    One poll: process files that landed since the last one, then ingest days with new files
+    (each at most every MICROBATCH_MIN_INTERVAL seconds unless forced)
+    """
+    batches = watcher.poll(settle)
+    due = [date_str for date_str in watcher.dirty_days()
+           if force or watcher.seconds_since_ingest(date_str) >= MICROBATCH_MIN_INTERVAL]
+    if not batches and not due:
+        return True
+
+    metrics = RunMetrics('microbatch', datetime.now().strftime('%Y-%m-%d'))
+    hdfs_client.metrics = metrics
+    ok = True
+    try:
+        with metrics.stage('landing'):
+            for date_str, files in sorted(batches.items()):
+                if not process_micro_batch(watcher, date_str, files, metrics):
+                    metrics.fail()
+                    ok = False
+
+        with metrics.stage('ingest'):
+            for date_str in watcher.dirty_days():
+                if not force and watcher.seconds_since_ingest(date_str) < MICROBATCH_MIN_INTERVAL:
+                    continue
+                if ingest_day(date_str, metrics, incremental=True):
+                    watcher.mark_ingested(date_str)
+                    logger.info(f"✓ Ingested {date_str}")
+                else:
+                    metrics.fail()
+                    ok = False
+    except Exception as e:
+        logger.error(f"Micro-batch error: {e}")
+        ok = False
+    finally:
+        hdfs_client.metrics = None
+        metrics.finish('ok' if ok else 'error')
+    return ok
+
+
+def finalize_day(watcher, date_str=None, execution=None):
+    """Nightly run in watch mode: pick up the remaining files, then compute the day's supplier orders"""
+    date_str = date_str or datetime.now().strftime('%Y-%m-%d')
+    execution = execution or SCHEDULER_EXECUTION
+    
+    logger.info("="*70)
+    logger.info(f"FINALIZING DAILY PROCUREMENT PIPELINE - {date_str} ({execution})")
+    logger.info("="*70)
+    
+    # Files still settling are taken as they are
+    watcher.rescan()
+    watch_tick(watcher, force=True, settle=0)
+    ingested = date_str not in watcher.dirty_days()
+    if not ingested:
+        logger.warning(f"⚠ {date_str} is not ingested yet, the pipeline will ingest it")
+    
+    metrics = RunMetrics('scheduler', date_str)
+    hdfs_client.metrics = metrics
+    status = 'error'
+    try:
+        with metrics.stage('pipeline'):
+            completed = run_pipeline(date_str, execution, ingest=not ingested)
+        if completed:
+            status = 'ok'
+            watcher.mark_ingested(date_str)
+        else:
+            metrics.fail('pipeline')
+            logger.error("Pipeline execution failed")
+    except Exception as e:
+        logger.error(f"Pipeline execution error: {e}")
+    finally:
+        hdfs_client.metrics = None
+        log_run_metrics(metrics.finish(status))
+
+
+def compact_raw_files():
+    """Merge the small raw HDFS files of closed days into size-targeted files"""
+    try:
+        with contextlib.redirect_stdout(LogWriter(logger)):
+            return run_compaction(hdfs_client, trino_conn=warm.trino())
+    except Exception as e:
+        logger.error(f"Compaction error: {e}")
+        warm.reset()
+        return False
 
 
 def main():
     """Main scheduler function"""
+    parser = argparse.ArgumentParser(description='Procurement pipeline scheduler')
+    parser.add_argument('--run-now', action='store_true',
+                        help='Run the pipeline once immediately (e.g. to catch up) and exit')
+    parser.add_argument('--date', type=str, help='Date for --run-now (YYYY-MM-DD), default today')
+    parser.add_argument('--resume', action='store_true',
+                        help='With --run-now: reuse the pipeline stages a failed run of the same inputs completed')
+    parser.add_argument('--execution', choices=EXECUTION_MODES, default=SCHEDULER_EXECUTION,
+                        help='Run steps in this process (warm connections) or as subprocesses')
+    parser.add_argument('--mode', choices=SCHEDULER_MODES, default=SCHEDULER_MODE,
+                        help='batch: one full run at 22:00; watch: micro-batches as files land, 22:00 finalizes')
+    parser.add_argument('--watch-source', choices=WATCH_SOURCES, default=WATCH_SOURCE,
+                        help='Watch mode: poll the local landing directories or the HDFS raw directories')
+    parser.add_argument('--watch-events', action='store_true', default=WATCH_EVENTS,
+                        help='Watch mode, local source: react to filesystem events (needs watchdog) instead of polling')
+    args = parser.parse_args()
+    
+    watcher = None
+    if args.mode == 'watch':
+        watcher = LandingWatcher(args.watch_source, hdfs=hdfs_client, events=args.watch_events)
+    
+    if args.run_now:
+        if watcher:
+            finalize_day(watcher, args.date, args.execution)
+        else:
+            run_daily_pipeline(args.date, args.execution, args.resume)
+        return
     
     logger.info("="*70)
     logger.info("🕐 Procurement Pipeline Scheduler Started")
-    logger.info("📅 Scheduled to run daily at 22:00")
+    logger.info(f"📅 Scheduled to run daily at 22:00 ({args.execution})")
+    if watcher and watcher.events:
+        logger.info(f"👀 Watching {args.watch_source} landing files through filesystem events")
+    elif watcher:
+        logger.info(f"👀 Watching {args.watch_source} landing files every {WATCH_POLL_SECONDS}s")
     logger.info("⏰ Current time: " + datetime.now().strftime('%H:%M:%S'))
     logger.info("Press Ctrl+C to stop")
     logger.info("="*70)
     
     # Schedule the job to run daily at 21:30
-    schedule.every().day.at("22:00").do(run_daily_pipeline)
+    if watcher:
+        schedule.every().day.at("22:00").do(finalize_day, watcher, execution=args.execution)
+        if not watcher.events:
+            schedule.every(WATCH_POLL_SECONDS).seconds.do(watch_tick, watcher)
+    else:
+        schedule.every().day.at("22:00").do(run_daily_pipeline, execution=args.execution)
+    if COMPACTION_TIME:
+        # Closed days only, away from the 22:00 run: a day being switched is briefly unregistered
+        schedule.every().day.at(COMPACTION_TIME).do(compact_raw_files)
+        logger.info(f"🗜  Raw file compaction scheduled daily at {COMPACTION_TIME}")
     
     # FOR TESTING: Uncomment to run immediately
     # run_daily_pipeline()
@@ -169,7 +522,13 @@ def main():
     while True:
         try:
             schedule.run_pending()
-            time.sleep(60)  # Check every minute
+            if watcher and watcher.events:
+                # Tick as soon as files land, once settling files are due, and at least every minute
+                timeout = watcher.settle_seconds if watcher.pending else min(60, WATCH_POLL_SECONDS)
+                watcher.wait(timeout)
+                watch_tick(watcher)
+                continue
+            time.sleep(min(60, WATCH_POLL_SECONDS) if watcher else 60)  # Check every minute
         except KeyboardInterrupt:
             logger.info("\n🛑 Scheduler stopped by user")
             break
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Stock Snapshot Catalog
+Small index of the stock snapshots uploaded for each warehouse (sorted dates,
+raw files and row counts), updated at upload time. The pipeline resolves each
+warehouse's latest usable snapshot from it with a binary search, so a warehouse
+whose feed is late keeps its previous snapshot instead of dropping out. Files
+that reached the raw directories another way (hdfs dfs -put, an HDFS watch, a
+manual run) are indexed by the pipeline when a warehouse looks stale
+"""
+
+import os
+import io
+import csv
+import json
+import argparse
+import threading
+from bisect import bisect_right, insort
+from datetime import datetime, timedelta
+from engines import DATA_DIR, RAW_DATA_DIR
+
+# Configuration
+SNAPSHOT_CATALOG_PATH = os.getenv('SNAPSHOT_CATALOG_PATH', f"{DATA_DIR}/state/snapshot_catalog.json")
+# Older snapshots are not used: the warehouse is reported as missing instead
+STOCK_MAX_AGE_DAYS = int(os.getenv('STOCK_MAX_AGE_DAYS', '7'))
+HDFS_RAW_DIR = '/data/raw'
+
+_update_lock = threading.Lock()
+
+
+def _age_days(date_str, snapshot_date):
+    return (datetime.strptime(date_str, '%Y-%m-%d') - datetime.strptime(snapshot_date, '%Y-%m-%d')).days
+
+
+def _count(lines):
+    counts = {}
+    for row in csv.DictReader(lines):
+        counts[row['warehouse_id']] = counts.get(row['warehouse_id'], 0) + 1
+    return counts
+
+
+def count_rows(path):
+    """{warehouse_id: rows} of a stock CSV file"""
+    with open(path, newline='') as f:
+        return _count(f)
+
+
+class SnapshotCatalog:
+    """
+    {warehouse_id: {'dates': [sorted dates], 'snapshots': {date: {'files': {path: rows}, 'rows': n}}}}
+    File paths are relative to the raw data root (stock/<date>/<file>), locally and on HDFS
+    """
+
+    def __init__(self, path=SNAPSHOT_CATALOG_PATH):
+        self.path = path
+        self.warehouses = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.warehouses = json.load(f)['warehouses']
+
+    def __len__(self):
+        return len(self.warehouses)
+
+    def record(self, date_str, warehouse_id, relative_path, rows):
+        """Add or replace one file's rows in a warehouse's snapshot of date_str"""
+        warehouse = self.warehouses.setdefault(warehouse_id, {'dates': [], 'snapshots': {}})
+        if date_str not in warehouse['snapshots']:
+            insort(warehouse['dates'], date_str)
+            warehouse['snapshots'][date_str] = {'files': {}, 'rows': 0}
+        snapshot = warehouse['snapshots'][date_str]
+        snapshot['files'][relative_path] = rows
+        snapshot['rows'] = sum(snapshot['files'].values())
+
+    def record_file(self, date_str, local_path, raw_dir=RAW_DATA_DIR):
+        """Index a stock CSV under every warehouse it has rows for; returns {warehouse_id: rows}"""
+        return self.record_counts(date_str, os.path.relpath(local_path, raw_dir), count_rows(local_path))
+
+    def record_counts(self, date_str, relative_path, counts):
+        for warehouse_id, rows in counts.items():
+            self.record(date_str, warehouse_id, relative_path, rows)
+        return counts
+
+    def files(self, date_str):
+        """Relative paths of the files indexed for date_str, across warehouses"""
+        return {path for warehouse in self.warehouses.values()
+                for path in warehouse['snapshots'].get(date_str, {}).get('files', {})}
+
+    def latest(self, date_str, max_age_days=STOCK_MAX_AGE_DAYS):
+        """
+        {warehouse_id: {'date', 'files', 'rows'}} of each warehouse's latest non-empty snapshot
+        on or before date_str, or None for a warehouse whose latest one is older than max_age_days
+        Warehouses with no snapshot up to date_str are left out
+        """
+        resolved = {}
+        for warehouse_id, warehouse in self.warehouses.items():
+            dates = warehouse['dates']
+            i = bisect_right(dates, date_str) - 1
+            while i >= 0 and not warehouse['snapshots'][dates[i]]['rows']:
+                i -= 1
+            if i < 0:
+                continue
+            snapshot = warehouse['snapshots'][dates[i]]
+            if _age_days(date_str, dates[i]) > max_age_days:
+                resolved[warehouse_id] = None
+            else:
+                resolved[warehouse_id] = {'date': dates[i], 'files': sorted(snapshot['files']),
+                                          'rows': snapshot['rows']}
+        return resolved
+
+    def save(self):
+        """Written under a temp name and renamed, so readers never see a partial catalog"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'warehouses': self.warehouses}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def record_snapshots(date_str, local_paths, raw_dir=RAW_DATA_DIR, path=SNAPSHOT_CATALOG_PATH):
+    """Index uploaded stock files of date_str; returns {warehouse_id: rows}"""
+    counts = {}
+    with _update_lock:
+        catalog = SnapshotCatalog(path)
+        for local_path in local_paths:
+            for warehouse_id, rows in catalog.record_file(date_str, local_path, raw_dir).items():
+                counts[warehouse_id] = counts.get(warehouse_id, 0) + rows
+        catalog.save()
+    return counts
+
+
+def _listed_files(date_str, hdfs, raw_dir, hdfs_raw_dir):
+    """Names of the stock CSVs of date_str on HDFS (if hdfs is given) or under raw_dir"""
+    if hdfs is not None:
+        return sorted(status['pathSuffix'] for status in hdfs.list_status(f"{hdfs_raw_dir}/stock/{date_str}")
+                      if status['type'] == 'FILE' and status['pathSuffix'].endswith('.csv'))
+    directory = f"{raw_dir}/stock/{date_str}"
+    return sorted(name for name in os.listdir(directory) if name.endswith('.csv')) if os.path.isdir(directory) else []
+
+
+def index_unrecorded(date_str, max_age_days=STOCK_MAX_AGE_DAYS, hdfs=None, raw_dir=RAW_DATA_DIR,
+                     hdfs_raw_dir=HDFS_RAW_DIR, path=SNAPSHOT_CATALOG_PATH):
+    """
+    Index the stock files listed for the last max_age_days up to date_str that the catalog
+    does not know: every file of a date missing from the catalog, and new files of date_str
+    (earlier indexed dates are left alone, compaction moves their files into versions on HDFS)
+    Returns (catalog, number of files indexed)
+    """
+    end = datetime.strptime(date_str, '%Y-%m-%d')
+    indexed = 0
+    with _update_lock:
+        catalog = SnapshotCatalog(path)
+        for age in range(max_age_days + 1):
+            day = (end - timedelta(days=age)).strftime('%Y-%m-%d')
+            recorded = catalog.files(day)
+            if recorded and day != date_str:
+                continue
+            for name in _listed_files(day, hdfs, raw_dir, hdfs_raw_dir):
+                relative_path = f"stock/{day}/{name}"
+                if relative_path in recorded:
+                    continue
+                if hdfs is not None:
+                    data = hdfs.read_file(f"{hdfs_raw_dir}/{relative_path}")
+                    catalog.record_counts(day, relative_path, _count(io.StringIO(data.decode())))
+                else:
+                    catalog.record_file(day, f"{raw_dir}/{relative_path}", raw_dir)
+                indexed += 1
+        if indexed:
+            catalog.save()
+    return catalog, indexed
+
+
+def rebuild(raw_dir=RAW_DATA_DIR, path=SNAPSHOT_CATALOG_PATH):
+    """Index every stock snapshot under raw_dir from scratch"""
+    catalog = SnapshotCatalog(path)
+    catalog.warehouses = {}
+    stock_dir = f"{raw_dir}/stock"
+    for date_str in sorted(os.listdir(stock_dir)) if os.path.isdir(stock_dir) else []:
+        directory = f"{stock_dir}/{date_str}"
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.csv'):
+                catalog.record_file(date_str, f"{directory}/{name}", raw_dir)
+    catalog.save()
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or rebuild the stock snapshot catalog')
+    parser.add_argument('--date', default=datetime.now().strftime('%Y-%m-%d'),
+                        help='Resolve the latest snapshot of each warehouse on or before this date')
+    parser.add_argument('--rebuild', action='store_true', help='Re-index every local raw stock file first')
+    args = parser.parse_args()
+
+    catalog = rebuild() if args.rebuild else SnapshotCatalog()
+    if args.rebuild:
+        print(f"✓ Indexed {len(catalog)} warehouses → {catalog.path}")
+    for warehouse_id, snapshot in sorted(catalog.latest(args.date).items()):
+        if snapshot is None:
+            print(f"  ✗ {warehouse_id}: no snapshot in the last {STOCK_MAX_AGE_DAYS} days")
+        else:
+            print(f"  ✓ {warehouse_id}: {snapshot['date']} ({snapshot['rows']} rows, {len(snapshot['files'])} files)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Stage Graph Executor
+Runs pipeline stages on daemon threads as soon as the stages they depend on have
+finished, so independent I/O-bound stages (PostgreSQL, Trino, HDFS) overlap.
+Every stage can have a timeout and a hook that cancels its work (e.g. its Trino
+query) when it expires; a failed or timed-out stage fails every stage that
+depends on it, which is never started
+"""
+
+import time
+import queue
+import threading
+
+
+class StageError(Exception):
+    """A stage failed, timed out or was not run because a dependency failed"""
+
+    def __init__(self, stage, message, status='error'):
+        super().__init__(f"{stage}: {message}")
+        self.stage = stage
+        self.status = status
+
+
+class StageGraph:
+    """
+    Dependency graph of named stages; each stage function receives the dict of results
+    of the stages finished so far (always including its dependencies)
+    """
+
+    def __init__(self, metrics=None, max_workers=4, timeouts=None):
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self.timeouts = timeouts or {}
+        self.stages = {}
+
+    def add(self, name, func, deps=(), timeout=None, on_timeout=None):
+        """
+        Add a stage; timeout (seconds) defaults to timeouts[name], None = no limit
+        on_timeout() is called once the stage is given up on, to stop what its thread is doing
+        """
+        unknown = [dep for dep in deps if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undefined stages {unknown}")
+        self.stages[name] = (func, tuple(deps), timeout if timeout is not None else self.timeouts.get(name),
+                             on_timeout)
+
+    def _run_stage(self, name, func, results, done):
+        try:
+            if self.metrics is None:
+                value = func(results)
+            else:
+                with self.metrics.stage(name):
+                    value = func(results)
+        except StageError as e:
+            done.put((name, None, e))
+        except Exception as e:
+            done.put((name, None, StageError(name, f"{type(e).__name__}: {e}")))
+        else:
+            done.put((name, value, None))
+
+    def _fail(self, errors, name, error):
+        errors[name] = error
+        if self.metrics:
+            self.metrics.fail(name, error.status)
+
+    def run(self):
+        """Run every stage; returns (results, errors) as {stage: value} and {stage: StageError}"""
+        results = {}
+        errors = {}
+        pending = dict(self.stages)
+        # name -> deadline of the stages whose thread is running and still waited for
+        running = {}
+        done = queue.Queue()
+        while pending or running:
+            # Fail stages behind a failure (repeat for chains), start those that are ready
+            changed = True
+            while changed:
+                changed = False
+                for name, (func, deps, timeout, _) in list(pending.items()):
+                    failed = [dep for dep in deps if dep in errors]
+                    if failed:
+                        self._fail(errors, name, StageError(name, f"not run, {failed[0]} failed", 'skipped'))
+                        del pending[name]
+                        changed = True
+                    elif all(dep in results for dep in deps) and len(running) < self.max_workers:
+                        # Daemon threads: a stage stuck past its timeout never keeps the process alive
+                        threading.Thread(target=self._run_stage, args=(name, func, results, done),
+                                         name=f"stage-{name}", daemon=True).start()
+                        running[name] = time.monotonic() + timeout if timeout else None
+                        del pending[name]
+            if not running:
+                break
+
+            deadlines = [deadline for deadline in running.values() if deadline]
+            try:
+                name, value, error = done.get(timeout=max(0.0, min(deadlines) - time.monotonic())
+                                              if deadlines else None)
+                # Results of stages already timed out are dropped
+                if name in running:
+                    del running[name]
+                    if error is None:
+                        results[name] = value
+                    else:
+                        self._fail(errors, name, error)
+            except queue.Empty:
+                pass
+
+            # A timed-out stage is cancelled and no longer waited for (nor counted as a worker)
+            now = time.monotonic()
+            for name, deadline in list(running.items()):
+                if deadline and now >= deadline:
+                    del running[name]
+                    self._fail(errors, name, StageError(name, f"timed out after {self.stages[name][2]}s", 'timeout'))
+                    on_timeout = self.stages[name][3]
+                    if on_timeout:
+                        try:
+                            on_timeout()
+                        except Exception as e:
+                            print(f"  ⚠ Could not cancel {name}: {e}")
+        return results, errors
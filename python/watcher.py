@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Landing Watcher
+Detects POS order and warehouse stock files as they land (local raw directories
+or HDFS listings) so the scheduler can process them in micro-batches during the
+day instead of all at 22:00. Local directories can also be watched through
+filesystem events (watchdog), so files are picked up as they land and only the
+directories that changed are listed
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from engines import DATA_DIR, RAW_DATA_DIR
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Configuration
+WATCH_STATE_PATH = os.getenv('WATCH_STATE_PATH', f"{DATA_DIR}/state/watcher.json")
+# A file is picked up once its size and mtime have not changed for this long
+WATCH_SETTLE_SECONDS = float(os.getenv('WATCH_SETTLE_SECONDS', '10'))
+# Late files are still picked up for this many days back
+WATCH_LOOKBACK_DAYS = int(os.getenv('WATCH_LOOKBACK_DAYS', '2'))
+# Local source: react to filesystem events instead of listing every directory on each poll
+WATCH_EVENTS = os.getenv('WATCH_EVENTS', '0') == '1'
+
+WATCH_SOURCES = ('local', 'hdfs')
+KINDS = (('orders', '.json'), ('stock', '.csv'))
+HDFS_RAW_DIR = '/data/raw'
+
+
+class _LandingEvents(FileSystemEventHandler):
+    """Records the <kind>/<date> directories files were created, changed or moved into"""
+
+    def __init__(self, raw_dir):
+        self.raw_dir = raw_dir
+        self.touched = set()
+        self.lock = threading.Lock()
+        self.arrived = threading.Event()
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        path = getattr(event, 'dest_path', '') or event.src_path
+        parts = os.path.relpath(path, self.raw_dir).split(os.sep)
+        if len(parts) != 3:
+            return
+        with self.lock:
+            self.touched.add((parts[0], parts[1]))
+        self.arrived.set()
+
+    def take(self):
+        """Directories touched since the last call"""
+        with self.lock:
+            touched, self.touched = self.touched, set()
+        self.arrived.clear()
+        return touched
+
+
+class LandingWatcher:
+    """
+    Polls the landing directories and reports new or changed files once they are stable
+    Processed files and days waiting for ingestion are kept in a small JSON state file
+    """
+
+    def __init__(self, source='local', raw_dir=RAW_DATA_DIR, hdfs=None, settle_seconds=WATCH_SETTLE_SECONDS,
+                 lookback_days=WATCH_LOOKBACK_DAYS, state_path=WATCH_STATE_PATH, events=WATCH_EVENTS):
+        if source not in WATCH_SOURCES:
+            raise ValueError(f"Unknown watch source {source}")
+        if source == 'hdfs' and hdfs is None:
+            raise ValueError("Watching HDFS needs a WebHDFS client")
+        if events and source != 'local':
+            raise ValueError("Filesystem events are only available for the local source")
+        if events and Observer is None:
+            raise ValueError("WATCH_EVENTS needs the watchdog package")
+        self.source = source
+        self.raw_dir = raw_dir if source == 'local' else HDFS_RAW_DIR
+        self.hdfs = hdfs
+        self.settle_seconds = settle_seconds
+        self.lookback_days = lookback_days
+        self.state_path = state_path
+        # path -> signature seen on the previous poll and since when
+        self.pending = {}
+        self.state = self._load_state()
+        # Event mode: the first poll lists everything (files that landed while stopped)
+        self.events = None
+        self.observer = None
+        self.listed_all = False
+        if events:
+            self.events = _LandingEvents(self.raw_dir)
+            os.makedirs(self.raw_dir, exist_ok=True)
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.schedule(self.events, self.raw_dir, recursive=True)
+            self.observer.start()
+
+    def _load_state(self):
+        state = {'processed': {}, 'dirty': [], 'ingested_at': {}}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path) as f:
+                    state.update(json.load(f))
+            except Exception as e:
+                print(f"⚠ Ignoring unreadable watcher state {self.state_path}: {e}")
+        return state
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _dates(self):
+        today = datetime.now().date()
+        return [(today - timedelta(days=offset)).isoformat() for offset in range(self.lookback_days, -1, -1)]
+
+    def _list(self, kind, date_str, extension):
+        """(path, signature) of the files of one kind and day"""
+        directory = f"{self.raw_dir}/{kind}/{date_str}"
+        if self.source == 'hdfs':
+            return [(f"{directory}/{status['pathSuffix']}", [status['length'], status['modificationTime']])
+                    for status in self.hdfs.list_status(directory)
+                    if status['type'] == 'FILE' and status['pathSuffix'].endswith(extension)]
+        if not os.path.isdir(directory):
+            return []
+        with os.scandir(directory) as entries:
+            return [(entry.path, self._signature(entry.stat()))
+                    for entry in entries if entry.is_file() and entry.name.endswith(extension)]
+
+    @staticmethod
+    def _signature(stat):
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def wait(self, timeout):
+        """Event mode: block until files land or timeout expires, True if they did"""
+        if self.events is None:
+            time.sleep(timeout)
+            return False
+        return self.events.arrived.wait(timeout)
+
+    def rescan(self):
+        """Event mode: list every directory on the next poll (in case an event was missed)"""
+        self.listed_all = False
+
+    def _to_list(self, dates):
+        """(kind, date) directories to list: all of them, or in event mode those with events or settling files"""
+        if self.events is None or not self.listed_all:
+            self.listed_all = True
+            return {(kind, date_str) for date_str in dates for kind, _ in KINDS}
+        touched = self.events.take()
+        touched.update(tuple(path.rsplit('/', 3)[-3:-1]) for path in self.pending)
+        return {(kind, date_str) for kind, date_str in touched if date_str in dates}
+
+    def poll(self, settle=None):
+        """
+        Files that are new or changed since they were processed and have been stable for the
+        settle window, as {date: {'orders': [paths], 'stock': [paths]}}
+        """
+        settle = self.settle_seconds if settle is None else settle
+        now = time.monotonic()
+        dates = self._dates()
+        self._forget_before(dates[0])
+        to_list = self._to_list(dates)
+        ready = {}
+        for date_str in dates:
+            for kind, extension in KINDS:
+                if (kind, date_str) not in to_list:
+                    continue
+                for path, signature in self._list(kind, date_str, extension):
+                    if self.state['processed'].get(path) == signature:
+                        continue
+                    seen = self.pending.get(path)
+                    if seen is None or seen[0] != signature:
+                        self.pending[path] = seen = (signature, now)
+                    if now - seen[1] >= settle:
+                        ready.setdefault(date_str, {'orders': [], 'stock': []})[kind].append(path)
+        return ready
+
+    def _forget_before(self, first_date):
+        """Drop processed signatures of days that are no longer watched"""
+        self.state['processed'] = {path: signature for path, signature in self.state['processed'].items()
+                                   if path.rsplit('/', 2)[-2] >= first_date}
+        self.state['ingested_at'] = {date_str: at for date_str, at in self.state['ingested_at'].items()
+                                     if date_str >= first_date}
+
+    def mark_processed(self, paths):
+        """Remember the current signature of each path (re-read after any rewrite of the file)"""
+        for path in paths:
+            self.pending.pop(path, None)
+            if self.source == 'local':
+                if os.path.exists(path):
+                    self.state['processed'][path] = self._signature(os.stat(path))
+                continue
+            directory, name = path.rsplit('/', 1)
+            for status in self.hdfs.list_status(directory):
+                if status['pathSuffix'] == name:
+                    self.state['processed'][path] = [status['length'], status['modificationTime']]
+        self.save()
+
+    def mark_dirty(self, date_str):
+        """The day has new files that are not ingested into Trino yet"""
+        if date_str not in self.state['dirty']:
+            self.state['dirty'].append(date_str)
+            self.save()
+
+    def dirty_days(self):
+        return sorted(self.state['dirty'])
+
+    def mark_ingested(self, date_str):
+        if date_str in self.state['dirty']:
+            self.state['dirty'].remove(date_str)
+        self.state['ingested_at'][date_str] = time.time()
+        self.save()
+
+    def seconds_since_ingest(self, date_str):
+        ingested_at = self.state['ingested_at'].get(date_str)
+        return float('inf') if ingested_at is None else time.time() - ingested_at
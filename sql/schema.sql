@@ -3,6 +3,7 @@
 -- ============================================
 
 -- Drop existing tables if they exist
+DROP TABLE IF EXISTS points_of_sale CASCADE;
 DROP TABLE IF EXISTS replenishment_rules CASCADE;
 DROP TABLE IF EXISTS products CASCADE;
 DROP TABLE IF EXISTS suppliers CASCADE;
@@ -73,6 +74,18 @@ CREATE TABLE replenishment_rules (
     UNIQUE(sku, warehouse_id)
 );
 
+-- ============================================
+-- POINTS OF SALE TABLE
+-- Which warehouse replenishes each POS system
+-- ============================================
+CREATE TABLE points_of_sale (
+    pos_id VARCHAR(50) PRIMARY KEY,
+    pos_name VARCHAR(200),
+    warehouse_id VARCHAR(50) REFERENCES warehouses(warehouse_id),
+    active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- ============================================
 -- INDEXES FOR PERFORMANCE
 -- ============================================
@@ -81,6 +94,7 @@ CREATE INDEX idx_products_category ON products(category);
 CREATE INDEX idx_products_active ON products(active);
 CREATE INDEX idx_replenishment_sku ON replenishment_rules(sku);
 CREATE INDEX idx_replenishment_warehouse ON replenishment_rules(warehouse_id);
+CREATE INDEX idx_pos_warehouse ON points_of_sale(warehouse_id);
 
 -- ============================================
 -- COMMENTS
@@ -89,8 +103,11 @@ COMMENT ON TABLE suppliers IS 'Vendor/supplier master data';
 COMMENT ON TABLE warehouses IS 'Warehouse/depot locations';
 COMMENT ON TABLE products IS 'Product master data (SKU catalog)';
 COMMENT ON TABLE replenishment_rules IS 'Procurement rules per SKU per warehouse';
+COMMENT ON TABLE points_of_sale IS 'POS systems and the warehouse that serves them';
 
 COMMENT ON COLUMN products.pack_size IS 'Number of units in one pack (e.g., 6-pack)';
 COMMENT ON COLUMN products.case_size IS 'Number of packs in one case for supplier ordering';
 COMMENT ON COLUMN replenishment_rules.safety_stock IS 'Minimum stock level to maintain';
-COMMENT ON COLUMN replenishment_rules.minimum_order_quantity IS 'Minimum units to order from supplier (MOQ)';
\ No newline at end of file
+COMMENT ON COLUMN replenishment_rules.minimum_order_quantity IS 'Minimum units to order from supplier (MOQ)';
+COMMENT ON COLUMN replenishment_rules.maximum_order_quantity IS 'Maximum units per order (NULL = no cap)';
+COMMENT ON COLUMN replenishment_rules.reorder_point IS 'Order only once projected stock falls to this level';
\ No newline at end of file
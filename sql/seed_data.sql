@@ -24,6 +24,16 @@ INSERT INTO warehouses (warehouse_id, warehouse_name, location, capacity) VALUES
 ('WH002', 'North Regional Warehouse', 'Tangier', 30000),
 ('WH003', 'South Regional Warehouse', 'Marrakech', 25000);
 
+-- ============================================
+-- INSERT POINTS OF SALE
+-- ============================================
+INSERT INTO points_of_sale (pos_id, pos_name, warehouse_id) VALUES
+('POS001', 'Casablanca Centre', 'WH001'),
+('POS002', 'Casablanca Maarif', 'WH001'),
+('POS003', 'Tangier Downtown', 'WH002'),
+('POS004', 'Marrakech Gueliz', 'WH003'),
+('POS005', 'Rabat Agdal', 'WH001');
+
 -- ============================================
 -- INSERT PRODUCTS (50 sample products)
 -- ============================================
@@ -102,5 +112,6 @@ INSERT INTO replenishment_rules (sku, warehouse_id, safety_stock, minimum_order_
 SELECT 'Database initialized successfully!' AS status;
 SELECT COUNT(*) AS supplier_count FROM suppliers;
 SELECT COUNT(*) AS warehouse_count FROM warehouses;
+SELECT COUNT(*) AS pos_count FROM points_of_sale;
 SELECT COUNT(*) AS product_count FROM products;
 SELECT COUNT(*) AS rule_count FROM replenishment_rules;
\ No newline at end of file
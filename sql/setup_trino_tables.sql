@@ -11,26 +11,31 @@ USE hive.warehouse;
 
 -- ============================================
 -- ORDERS DATA TABLE
--- Points to all historical order files in HDFS
+-- Partitioned by order_date, one partition per
+-- /data/raw/orders/<date> directory
 -- ============================================
 CREATE TABLE IF NOT EXISTS orders_data (
     order_id VARCHAR,
     pos_id VARCHAR,
     sku VARCHAR,
     quantity INTEGER,
-    order_date VARCHAR,
     order_time VARCHAR,
-    customer_id VARCHAR
+    customer_id VARCHAR,
+    order_date VARCHAR
 )
 WITH (
     format = 'JSON',
-    external_location = 'hdfs://namenode:9000/data/raw/orders'
+    external_location = 'hdfs://namenode:9000/data/raw/orders',
+    partitioned_by = ARRAY['order_date']
 );
 
 -- ============================================
 -- STOCK DATA TABLE
--- Points to all historical stock files in HDFS
+-- Partitioned by snapshot_date, one partition per
+-- /data/raw/stock/<date> directory
 -- CSV requires all VARCHAR, cast in queries
+-- CSV columns are positional: file_snapshot_date is the
+-- date column inside the file
 -- ============================================
 CREATE TABLE IF NOT EXISTS stock_data (
     warehouse_id VARCHAR,
@@ -38,15 +43,79 @@ CREATE TABLE IF NOT EXISTS stock_data (
     available_stock VARCHAR,
     reserved_stock VARCHAR,
     safety_stock VARCHAR,
-    snapshot_date VARCHAR,
-    snapshot_time VARCHAR
+    file_snapshot_date VARCHAR,
+    snapshot_time VARCHAR,
+    snapshot_date VARCHAR
 )
 WITH (
     format = 'CSV',
     external_location = 'hdfs://namenode:9000/data/raw/stock',
-    skip_header_line_count = 1
+    skip_header_line_count = 1,
+    partitioned_by = ARRAY['snapshot_date']
 );
 
+-- ============================================
+-- COLUMNAR (ORC) TABLES
+-- Typed copies of orders_data / stock_data,
+-- rewritten per day by pipeline.py (columnar.py)
+-- Compression: hive.compression-codec=ZSTD
+-- ============================================
+CREATE TABLE IF NOT EXISTS orders_orc (
+    order_id VARCHAR,
+    pos_id VARCHAR,
+    sku VARCHAR,
+    quantity INTEGER,
+    order_time VARCHAR,
+    customer_id VARCHAR,
+    order_date DATE
+)
+WITH (
+    format = 'ORC',
+    partitioned_by = ARRAY['order_date']
+);
+
+CREATE TABLE IF NOT EXISTS stock_orc (
+    warehouse_id VARCHAR,
+    sku VARCHAR,
+    available_stock INTEGER,
+    reserved_stock INTEGER,
+    safety_stock INTEGER,
+    snapshot_time VARCHAR,
+    snapshot_date DATE
+)
+WITH (
+    format = 'ORC',
+    partitioned_by = ARRAY['snapshot_date']
+);
+
+-- ============================================
+-- DAILY DEMAND AGGREGATES
+-- One row per (order_date, sku, pos_id), built once
+-- per day from orders_orc (aggregates.py); micro-batches
+-- append partial rows, so readers always SUM
+-- ============================================
+CREATE TABLE IF NOT EXISTS daily_sku_demand (
+    sku VARCHAR,
+    pos_id VARCHAR,
+    total_quantity BIGINT,
+    order_count BIGINT,
+    order_date DATE
+)
+WITH (
+    format = 'ORC',
+    partitioned_by = ARRAY['order_date']
+);
+
+-- ============================================
+-- PARTITION REGISTRATION
+-- pipeline.py registers each date automatically;
+-- to register a date by hand:
+-- ============================================
+-- CALL system.register_partition('warehouse', 'orders_data', ARRAY['order_date'], ARRAY['2025-12-14'],
+--     'hdfs://namenode:9000/data/raw/orders/2025-12-14');
+-- CALL system.register_partition('warehouse', 'stock_data', ARRAY['snapshot_date'], ARRAY['2025-12-14'],
+--     'hdfs://namenode:9000/data/raw/stock/2025-12-14');
+
 -- ============================================
 -- VERIFICATION QUERIES
 -- ============================================
@@ -72,6 +141,10 @@ FROM stock_data
 GROUP BY snapshot_date 
 ORDER BY snapshot_date;
 
+-- Registered partitions
+SELECT * FROM "orders_data$partitions" ORDER BY order_date;
+SELECT * FROM "stock_data$partitions" ORDER BY snapshot_date;
+
 -- Top 10 SKUs by demand
 SELECT sku, SUM(quantity) as total_demand 
 FROM orders_data 
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The pipeline modules are flat scripts in python/ that read their configuration at import
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='procurement-tests-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
@@ -0,0 +1,76 @@
+import json
+import os
+
+import numpy as np
+
+from dedup_index import OrderIdIndex
+
+
+def fill(index, date_str, order_ids, source='POS001.json'):
+    return [index.is_duplicate(order_id, date_str, source) for order_id in order_ids]
+
+
+def test_duplicates_within_a_run_and_across_days(tmp_path):
+    index = OrderIdIndex(str(tmp_path))
+    assert fill(index, '2025-03-01', ['O1', 'O2', 'O1']) == [False, False, True]
+    assert index.commit() == 2
+
+    index = OrderIdIndex(str(tmp_path))
+    assert len(index) == 2
+    assert fill(index, '2025-03-02', ['O1', 'O3']) == [True, False]
+
+
+def test_same_file_is_idempotent_other_file_is_not(tmp_path):
+    index = OrderIdIndex(str(tmp_path))
+    fill(index, '2025-03-01', ['O1'], 'POS001.json')
+    index.commit()
+    index = OrderIdIndex(str(tmp_path))
+    assert fill(index, '2025-03-01', ['O1'], 'POS001.json') == [False]
+    assert fill(index, '2025-03-01', ['O1'], 'POS002.json') == [True]
+    # Re-processing adds nothing new to the index
+    assert index.commit() == 0
+
+
+def test_runs_stay_logarithmic_and_keep_every_order(tmp_path):
+    index = OrderIdIndex(str(tmp_path))
+    for batch in range(32):
+        fill(index, '2025-03-01', [f"O{batch}_{i}" for i in range(10)], f"POS{batch}.json")
+        index.commit()
+    assert len(index) == 320
+    assert len(index.runs) <= 6
+    for run in index.runs:
+        assert np.all(np.diff(run.hashes.astype(np.uint64)) > 0)
+    with open(tmp_path / 'CURRENT') as f:
+        names = {run['name'] for run in json.load(f)['runs']}
+    assert set(os.listdir(tmp_path)) == names | {'CURRENT'}
+    assert all(fill(OrderIdIndex(str(tmp_path)), '2025-03-02', [f"O{b}_0" for b in range(32)]))
+
+
+def test_orders_past_retention_are_forgotten(tmp_path):
+    index = OrderIdIndex(str(tmp_path), retention_days=10)
+    fill(index, '2025-01-01', ['OLD'])
+    index.commit()
+    fill(index, '2025-03-01', ['NEW'])
+    index.commit()
+    index = OrderIdIndex(str(tmp_path), retention_days=10)
+    assert len(index) == 1
+    assert fill(index, '2025-03-02', ['OLD', 'NEW']) == [False, True]
+
+
+def test_single_generation_index_loads_as_one_run(tmp_path):
+    index = OrderIdIndex(str(tmp_path))
+    fill(index, '2025-03-01', ['O1', 'O2'])
+    index.commit()
+    run = index.runs[0]
+    # Layout written before runs: one generation directory without sources
+    legacy = tmp_path / 'legacy'
+    (legacy / '00000007').mkdir(parents=True)
+    for name in ('hashes', 'days', 'bloom'):
+        np.save(legacy / '00000007' / f"{name}.npy", np.asarray(getattr(run, name)))
+    (legacy / 'CURRENT').write_text(json.dumps({'generation': 7, 'bloom_bits': run.bits}))
+
+    index = OrderIdIndex(str(legacy))
+    assert len(index) == 2
+    assert fill(index, '2025-03-02', ['O1', 'O3']) == [True, False]
+    index.commit()
+    assert index.sequence > 7
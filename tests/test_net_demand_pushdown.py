@@ -0,0 +1,144 @@
+import random
+import re
+import sqlite3
+
+import pytest
+
+from net_demand import NetDemandEngine
+from pushdown import PushdownNetDemand
+
+WAREHOUSES = ['WH001', 'WH002', 'WH003']
+DEMAND_DATES = ['2025-01-01', '2025-01-02', '2025-01-03']
+STOCK_DATES = ['2025-01-01', '2025-01-03', '2025-01-05']
+
+
+class SQLiteCursor:
+    """Runs the pushdown query on SQLite: Hive and PostgreSQL tables live in one database"""
+
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+
+    def execute(self, sql):
+        sql = sql.replace('postgresql.public.', '').replace('COUNT_IF(', 'SUM(')
+        sql = re.sub(r"DATE '([^']+)'", r"'\1'", sql)
+        self.result = self.db.execute(sql)
+
+    def fetchmany(self, size):
+        return self.result.fetchmany(size)
+
+
+@pytest.fixture(scope='module')
+def fixture():
+    """Seeded master data, demand aggregates and stock snapshots, in SQLite and as engine inputs"""
+    rng = random.Random(7)
+    db = sqlite3.connect(':memory:')
+    db.create_function('GREATEST', -1, max, deterministic=True)
+    db.create_function('LEAST', -1, min, deterministic=True)
+    db.executescript("""
+        CREATE TABLE suppliers(supplier_id, active);
+        CREATE TABLE products(sku, product_name, supplier_id, case_size, active);
+        CREATE TABLE replenishment_rules(sku, warehouse_id, safety_stock, minimum_order_quantity,
+                                         maximum_order_quantity, reorder_point, active);
+        CREATE TABLE points_of_sale(pos_id, warehouse_id, active);
+        CREATE TABLE daily_sku_demand(sku, pos_id, total_quantity, order_count, order_date);
+        CREATE TABLE stock_orc(sku, warehouse_id, available_stock, reserved_stock, safety_stock, snapshot_date);
+        CREATE TABLE "stock_orc$partitions"(snapshot_date);
+    """)
+    db.executemany("INSERT INTO suppliers VALUES (?, ?)", [('S1', 1), ('S2', 1), ('S3', 0)])
+    skus = [f"SKU{i:03d}" for i in range(60)]
+
+    products = {}
+    for sku in skus[:50]:
+        row = (sku, f"P{sku}", rng.choice(['S1', 'S2', 'S3']), rng.choice([1, 6, 12, 24]), rng.random() > 0.1)
+        db.execute("INSERT INTO products VALUES (?, ?, ?, ?, ?)", row)
+        if row[4] and row[2] != 'S3':
+            products[sku] = {'sku': sku, 'product_name': row[1], 'supplier_id': row[2], 'case_size': row[3]}
+
+    rules = {}
+    for sku in skus:
+        for warehouse_id in WAREHOUSES:
+            if rng.random() < 0.4:
+                rule = {'sku': sku, 'warehouse_id': warehouse_id, 'safety_stock': rng.randint(0, 80),
+                        'minimum_order_quantity': rng.choice([0, 1, 10, 50]),
+                        'maximum_order_quantity': rng.choice([None, 100, 500]),
+                        'reorder_point': rng.choice([None, None, 20])}
+                active = rng.random() > 0.1
+                db.execute("INSERT INTO replenishment_rules VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (*rule.values(), active))
+                if active:
+                    rules[(sku, warehouse_id)] = rule
+
+    pos_warehouses = {}
+    for i in range(10):
+        warehouse_id = rng.choice(WAREHOUSES)
+        db.execute("INSERT INTO points_of_sale VALUES (?, ?, ?)", (f"POS{i}", warehouse_id, i != 3))
+        if i != 3:
+            pos_warehouses[f"POS{i}"] = warehouse_id
+
+    demand = []
+    for date_str in DEMAND_DATES:
+        for _ in range(300):
+            # POS10 and POS11 are unknown points of sale, served by the default warehouse
+            row = (rng.choice(skus), f"POS{rng.randint(0, 11)}", rng.randint(1, 30), 1, date_str)
+            db.execute("INSERT INTO daily_sku_demand VALUES (?, ?, ?, ?, ?)", row)
+            demand.append(row)
+
+    stock = []
+    for date_str in STOCK_DATES:
+        db.execute('INSERT INTO "stock_orc$partitions" VALUES (?)', (date_str,))
+        for sku in skus:
+            for warehouse_id in WAREHOUSES:
+                if rng.random() < 0.5:
+                    row = (sku, warehouse_id, rng.randint(0, 300), rng.randint(0, 20), rng.randint(0, 60), date_str)
+                    db.execute("INSERT INTO stock_orc VALUES (?, ?, ?, ?, ?, ?)", row)
+                    stock.append(row)
+
+    return {'db': db, 'engine': NetDemandEngine(products, rules, pos_warehouses), 'demand': demand, 'stock': stock}
+
+
+def engine_inputs(fixture, start, end, snapshot_of):
+    """orders and stock as the pipeline hands them to NetDemandEngine"""
+    orders = {}
+    for sku, pos_id, quantity, _, date_str in fixture['demand']:
+        if start <= date_str <= end:
+            orders[(sku, pos_id)] = orders.get((sku, pos_id), 0) + quantity
+    stock = {}
+    for sku, warehouse_id, available, reserved, safety_stock, date_str in fixture['stock']:
+        if snapshot_of(warehouse_id) == date_str:
+            level = stock.setdefault((sku, warehouse_id), {'available': 0, 'reserved': 0, 'safety_stock': 0})
+            level['available'] += available
+            level['reserved'] += reserved
+            level['safety_stock'] = max(level['safety_stock'], safety_stock)
+    return orders, stock
+
+
+def test_pushdown_matches_engine_on_latest_partition(fixture):
+    pushdown = PushdownNetDemand(SQLiteCursor(fixture['db']), fetch_size=7)
+    net_demand, exceptions, details, totals = pushdown.compute('2025-01-03', 2)
+
+    orders, stock = engine_inputs(fixture, '2025-01-02', '2025-01-03', lambda warehouse_id: '2025-01-03')
+    expected = fixture['engine'].compute(orders, stock)
+
+    assert net_demand and net_demand == expected[0]
+    assert exceptions == expected[1]
+    assert details == expected[2]
+    assert totals['total_demand'] == sum(orders.values())
+    assert totals['order_keys'] == len(orders)
+    assert totals['stock_keys'] == len(stock)
+    assert totals['snapshot_date'] == '2025-01-03'
+
+
+def test_pushdown_matches_engine_on_catalog_snapshots(fixture):
+    snapshots = {'WH001': {'date': '2025-01-03'}, 'WH002': {'date': '2025-01-01'}}
+    pushdown = PushdownNetDemand(SQLiteCursor(fixture['db']), fetch_size=7)
+    net_demand, exceptions, details, totals = pushdown.compute('2025-01-03', 2, snapshots)
+
+    orders, stock = engine_inputs(fixture, '2025-01-02', '2025-01-03',
+                                  lambda warehouse_id: snapshots.get(warehouse_id, {}).get('date'))
+    expected = fixture['engine'].compute(orders, stock)
+
+    assert net_demand == expected[0]
+    assert exceptions == expected[1]
+    assert details == expected[2]
+    assert totals['stock_keys'] == len(stock)
@@ -0,0 +1,69 @@
+import io
+import json
+
+from normalize_orders import iter_json_records, validate_order, normalize_day
+from dedup_index import OrderIdIndex
+
+DATE = '2025-03-01'
+
+
+def order(order_id, **fields):
+    return dict({'order_id': order_id, 'pos_id': 'POS001', 'sku': 'SKU001',
+                 'quantity': 2, 'order_date': DATE}, **fields)
+
+
+def test_array_and_ndjson_give_the_same_records():
+    records = [order(f"O{i}") for i in range(50)]
+    array = io.StringIO(json.dumps(records, indent=2))
+    ndjson = io.StringIO(''.join(json.dumps(record) + '\n' for record in records))
+    assert [r for _, r, _ in iter_json_records(array, chunk_size=7)] == records
+    assert [r for _, r, _ in iter_json_records(ndjson)] == records
+
+
+def test_broken_array_element_stops_the_stream():
+    f = io.StringIO('[{"order_id": "O1"}, {"order_id": ')
+    results = list(iter_json_records(f, chunk_size=4))
+    assert results[0] == (0, {'order_id': 'O1'}, None)
+    assert results[1][1] is None and results[1][2].startswith('malformed element')
+
+
+def test_broken_ndjson_line_only_loses_that_line():
+    f = io.StringIO('{"a": 1}\n{broken\n{"a": 2}\n')
+    assert [(p, r) for p, r, _ in iter_json_records(f)] == [(0, {'a': 1}), (1, None), (2, {'a': 2})]
+
+
+def test_validate_order():
+    assert validate_order(order('O1'), DATE) is None
+    assert validate_order([], DATE) == 'not_an_object'
+    assert validate_order(order(''), DATE) == 'invalid_order_id'
+    assert validate_order(order('O1', quantity=True), DATE) == 'invalid_quantity'
+    assert validate_order(order('O1', quantity=0), DATE) == 'invalid_quantity'
+    assert validate_order(order('O1', order_date='2025-02-30'), DATE) == 'invalid_order_date'
+    assert validate_order(order('O1', order_date='2025-03-02'), DATE) == 'date_mismatch'
+    assert validate_order(order('O1'), DATE, known_skus={'SKU002'}) == 'unknown_sku'
+
+
+def test_normalize_day_rewrites_quarantines_and_deduplicates(tmp_path):
+    orders_dir = tmp_path / 'orders'
+    quarantine_dir = tmp_path / 'quarantine'
+    day = orders_dir / DATE
+    day.mkdir(parents=True)
+    (day / 'POS001.json').write_text(json.dumps([order('O1'), order('O2', quantity=-1), order('O3')]))
+    (day / 'POS002.json').write_text(json.dumps(order('O1')) + '\n' + json.dumps(order('O4')) + '\n')
+    dedup = OrderIdIndex(str(tmp_path / 'index'))
+
+    report = normalize_day(DATE, dedup=dedup, orders_dir=str(orders_dir), quarantine_dir=str(quarantine_dir))
+
+    assert report['totals'] == {'valid': 3, 'invalid_quantity': 1, 'duplicate_order_id': 1}
+    assert report['rejected'] == 2 and report['new_order_ids'] == 3
+    kept = [json.loads(line)['order_id'] for name in ('POS001.json', 'POS002.json')
+            for line in (day / name).read_text().splitlines()]
+    assert kept == ['O1', 'O3', 'O4']
+    rejected = [json.loads(line) for line in (quarantine_dir / DATE / 'rejected.ndjson').read_text().splitlines()]
+    assert [(r['file'], r['reason']) for r in rejected] == [('POS001.json', 'invalid_quantity'),
+                                                          ('POS002.json', 'duplicate_order_id')]
+
+    # Normalizing the day again is idempotent: its own order_ids are not duplicates
+    report = normalize_day(DATE, dedup=OrderIdIndex(str(tmp_path / 'index')), orders_dir=str(orders_dir),
+                           quarantine_dir=str(quarantine_dir))
+    assert report['totals'] == {'valid': 3} and report['new_order_ids'] == 0
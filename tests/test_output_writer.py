@@ -0,0 +1,100 @@
+import gzip
+import json
+
+import pytest
+
+from output_writer import SupplierOrderWriter, MANIFEST_NAME, content_hash
+
+DATE = '2025-03-01'
+HDFS_DIR = f"/data/output/supplier_orders/{DATE}"
+
+
+class MemoryHDFS:
+    """The WebHDFSClient calls the writer makes, on a dict of path -> bytes"""
+
+    def __init__(self):
+        self.files = {}
+        self.uploaded = []
+
+    def read_file(self, path):
+        return self.files[path]
+
+    def create_files(self, files):
+        for path, data in files:
+            self.files[path] = data
+            self.uploaded.append(path.rsplit('/', 1)[1])
+        return {path: True for path, _ in files}
+
+    def delete(self, path, recursive=False):
+        return self.files.pop(path, None) is not None
+
+    def exists(self, path):
+        return path in self.files
+
+
+def document(supplier_id, quantity, generated_at='2025-03-01T22:00:00'):
+    items = [{'sku': f"SKU{i}", 'warehouse_id': 'WH001', 'quantity': quantity} for i in range(3)]
+    return {'supplier_id': supplier_id, 'order_date': DATE, 'generated_at': generated_at,
+            'items': items, 'total_items': len(items), 'total_quantity': 3 * quantity}
+
+
+def writer(tmp_path, hdfs, **options):
+    return SupplierOrderWriter(DATE, str(tmp_path), HDFS_DIR, hdfs, **options)
+
+
+def test_documents_line_items_and_manifest(tmp_path):
+    hdfs = MemoryHDFS()
+    documents = {'S1': document('S1', 10), 'S2': document('S2', 5)}
+    results = writer(tmp_path, hdfs, document_format='json.gz').write(documents)
+
+    assert all(results.values())
+    assert hdfs.uploaded[-1] == MANIFEST_NAME
+    assert json.loads(gzip.decompress((tmp_path / 'S1_order.json.gz').read_bytes())) == documents['S1']
+    rows = [json.loads(line) for line in (tmp_path / 'line_items.ndjson').read_text().splitlines()]
+    assert len(rows) == 6 and all(row['order_date'] == DATE for row in rows)
+    manifest = json.loads((tmp_path / MANIFEST_NAME).read_text())
+    assert manifest['documents']['S2']['content_hash'] == content_hash(documents['S2'])
+    assert manifest['line_items']['rows'] == 6
+    assert hdfs.files[f"{HDFS_DIR}/{MANIFEST_NAME}"] == (tmp_path / MANIFEST_NAME).read_bytes()
+
+
+def test_gzip_output_is_identical_across_retries(tmp_path):
+    documents = {'S1': document('S1', 10)}
+    writer(tmp_path / 'a', MemoryHDFS(), document_format='json.gz').write(documents, generated_at='t')
+    writer(tmp_path / 'b', MemoryHDFS(), document_format='json.gz').write(documents, generated_at='t')
+    for name in ('S1_order.json.gz', 'line_items.ndjson', MANIFEST_NAME):
+        assert (tmp_path / 'a' / name).read_bytes() == (tmp_path / 'b' / name).read_bytes()
+
+
+def test_rerun_only_publishes_what_changed(tmp_path):
+    hdfs = MemoryHDFS()
+    writer(tmp_path, hdfs).write({'S1': document('S1', 10), 'S2': document('S2', 5)})
+    manifest = (tmp_path / MANIFEST_NAME).read_bytes()
+
+    # Same content generated later: nothing is rewritten or uploaded
+    hdfs.uploaded = []
+    unchanged = writer(tmp_path, hdfs)
+    assert unchanged.write({'S1': document('S1', 10, 'later'), 'S2': document('S2', 5, 'later')}) == {}
+    assert unchanged.unchanged == {'S1', 'S2'} and unchanged.bytes_written == 0
+    assert (tmp_path / MANIFEST_NAME).read_bytes() == manifest
+
+    # S2 changed, S1 dropped out: S2, the line items and the manifest go up, S1 is deleted
+    hdfs.uploaded = []
+    changed = writer(tmp_path, hdfs)
+    changed.write({'S2': document('S2', 7)})
+    assert hdfs.uploaded == ['S2_order.json', 'line_items.ndjson', MANIFEST_NAME]
+    assert changed.removed == ['S1_order.json']
+    assert not (tmp_path / 'S1_order.json').exists()
+    assert f"{HDFS_DIR}/S1_order.json" not in hdfs.files
+
+
+def test_documents_can_stay_local(tmp_path):
+    hdfs = MemoryHDFS()
+    writer(tmp_path, hdfs, documents_to_hdfs=False).write({'S1': document('S1', 10)})
+    assert (tmp_path / 'S1_order.json').exists()
+    assert sorted(hdfs.uploaded) == sorted(['line_items.ndjson', MANIFEST_NAME])
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        writer(tmp_path, MemoryHDFS(), document_format='xml')
@@ -0,0 +1,65 @@
+from snapshot_catalog import SnapshotCatalog, record_snapshots, index_unrecorded
+
+HEADER = 'warehouse_id,sku,available_stock,reserved_stock,safety_stock\n'
+
+
+def write_stock(raw_dir, date_str, name, rows):
+    directory = raw_dir / 'stock' / date_str
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / name).write_text(HEADER + ''.join(f"{wh},SKU{i:03d},10,0,5\n" for wh, i in rows))
+    return directory / name
+
+
+def test_latest_resolves_each_warehouse_on_its_own(tmp_path):
+    catalog = SnapshotCatalog(str(tmp_path / 'catalog.json'))
+    catalog.record('2025-03-01', 'WH001', 'stock/2025-03-01/WH001_stock.csv', 10)
+    catalog.record('2025-03-03', 'WH001', 'stock/2025-03-03/WH001_stock.csv', 12)
+    catalog.record('2025-03-02', 'WH002', 'stock/2025-03-02/WH002_stock.csv', 8)
+    # An empty snapshot does not hide the previous one
+    catalog.record('2025-03-04', 'WH002', 'stock/2025-03-04/WH002_stock.csv', 0)
+    catalog.record('2025-01-01', 'WH003', 'stock/2025-01-01/WH003_stock.csv', 5)
+    catalog.record('2025-03-09', 'WH004', 'stock/2025-03-09/WH004_stock.csv', 5)
+
+    latest = catalog.latest('2025-03-04', max_age_days=7)
+    assert latest['WH001'] == {'date': '2025-03-03', 'files': ['stock/2025-03-03/WH001_stock.csv'], 'rows': 12}
+    assert latest['WH002']['date'] == '2025-03-02'
+    assert latest['WH003'] is None
+    assert 'WH004' not in latest
+    assert catalog.latest('2025-03-02')['WH001']['date'] == '2025-03-01'
+
+
+def test_snapshots_survive_a_save(tmp_path):
+    path = str(tmp_path / 'state' / 'catalog.json')
+    catalog = SnapshotCatalog(path)
+    catalog.record('2025-03-02', 'WH001', 'stock/2025-03-02/a.csv', 4)
+    catalog.record('2025-03-01', 'WH001', 'stock/2025-03-01/a.csv', 3)
+    catalog.save()
+    loaded = SnapshotCatalog(path)
+    assert len(loaded) == 1
+    assert loaded.warehouses['WH001']['dates'] == ['2025-03-01', '2025-03-02']
+    assert loaded.files('2025-03-02') == {'stock/2025-03-02/a.csv'}
+
+
+def test_record_snapshots_counts_rows_per_warehouse(tmp_path):
+    raw_dir = tmp_path / 'raw'
+    path = write_stock(raw_dir, '2025-03-01', 'mixed.csv', [('WH001', 1), ('WH001', 2), ('WH002', 1)])
+    counts = record_snapshots('2025-03-01', [str(path)], str(raw_dir), str(tmp_path / 'catalog.json'))
+    assert counts == {'WH001': 2, 'WH002': 1}
+    catalog = SnapshotCatalog(str(tmp_path / 'catalog.json'))
+    assert catalog.latest('2025-03-01')['WH002']['files'] == ['stock/2025-03-01/mixed.csv']
+
+
+def test_index_unrecorded_picks_up_files_that_bypassed_the_upload(tmp_path):
+    raw_dir = tmp_path / 'raw'
+    catalog_path = str(tmp_path / 'catalog.json')
+    uploaded = write_stock(raw_dir, '2025-03-02', 'WH001_stock.csv', [('WH001', 1)])
+    record_snapshots('2025-03-02', [str(uploaded)], str(raw_dir), catalog_path)
+    write_stock(raw_dir, '2025-03-01', 'WH002_stock.csv', [('WH002', 1)])
+    write_stock(raw_dir, '2025-03-02', 'WH003_stock.csv', [('WH003', 1), ('WH003', 2)])
+
+    catalog, indexed = index_unrecorded('2025-03-02', raw_dir=str(raw_dir), path=catalog_path)
+    assert indexed == 2
+    assert {wh: snapshot['date'] for wh, snapshot in catalog.latest('2025-03-02').items()} == {
+        'WH001': '2025-03-02', 'WH002': '2025-03-01', 'WH003': '2025-03-02'}
+    assert catalog.latest('2025-03-02')['WH003']['rows'] == 2
+    assert index_unrecorded('2025-03-02', raw_dir=str(raw_dir), path=catalog_path)[1] == 0
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from stage_graph import StageGraph
+
+
+def test_stages_see_their_dependencies_and_run_in_parallel():
+    started = threading.Barrier(2, timeout=5)
+
+    def independent(value):
+        def run(results):
+            started.wait()
+            return value
+        return run
+
+    graph = StageGraph(max_workers=2)
+    graph.add('a', independent(1))
+    graph.add('b', independent(2))
+    graph.add('sum', lambda results: results['a'] + results['b'], deps=('a', 'b'))
+    results, errors = graph.run()
+    assert errors == {}
+    assert results == {'a': 1, 'b': 2, 'sum': 3}
+
+
+def test_unknown_dependency_is_rejected():
+    graph = StageGraph()
+    with pytest.raises(ValueError):
+        graph.add('b', lambda results: None, deps=('a',))
+
+
+def test_failure_skips_the_stages_behind_it():
+    def fail(results):
+        raise RuntimeError('boom')
+
+    ran = []
+    graph = StageGraph()
+    graph.add('a', fail)
+    graph.add('b', lambda results: ran.append('b'), deps=('a',))
+    graph.add('c', lambda results: ran.append('c'), deps=('b',))
+    graph.add('d', lambda results: 'ok')
+    results, errors = graph.run()
+    assert results == {'d': 'ok'}
+    assert errors['a'].status == 'error' and 'RuntimeError: boom' in str(errors['a'])
+    assert errors['b'].status == 'skipped' and errors['c'].status == 'skipped'
+    assert ran == []
+
+
+def test_timeout_cancels_the_stage_and_does_not_wait_for_it():
+    release = threading.Event()
+    cancelled = []
+
+    def stuck(results):
+        release.wait(10)
+        return 'late'
+
+    graph = StageGraph(timeouts={'stuck': 0.2})
+    graph.add('stuck', stuck, on_timeout=lambda: cancelled.append(True))
+    graph.add('after', lambda results: 'never', deps=('stuck',))
+    started = time.monotonic()
+    results, errors = graph.run()
+    release.set()
+    assert time.monotonic() - started < 5
+    assert results == {}
+    assert errors['stuck'].status == 'timeout'
+    assert errors['after'].status == 'skipped'
+    assert cancelled == [True]